@@ -42,6 +42,7 @@ setup(
         'collective.js.jqueryui',
         'plone.api',
         'plone.memoize',
+        'plone.protect',
         'yafowil.widget.array',
         'yafowil.widget.datetime',
     ],
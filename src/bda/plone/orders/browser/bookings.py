@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from AccessControl import Unauthorized
+from Products.CMFPlone.interfaces import IPloneSiteRoot
 from Products.CMFPlone.utils import safe_unicode
 from Products.Five import BrowserView
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
@@ -10,8 +11,11 @@ from bda.plone.orders import message_factory as _
 from bda.plone.orders import permissions
 from bda.plone.orders import vocabularies as vocabs
 from bda.plone.orders.browser.dropdown import BaseDropdown
+from bda.plone.orders.browser.dropdown import dropdown_definitions
 from bda.plone.orders.browser.views import OrdersContentView
 from bda.plone.orders.browser.views import Transition
+from bda.plone.orders.browser.views import compact_mode
+from bda.plone.orders.browser.views import compile_columns
 from bda.plone.orders.browser.views import customers_form_vocab
 from bda.plone.orders.browser.views import salaried_form_vocab
 from bda.plone.orders.browser.views import states_form_vocab
@@ -20,15 +24,17 @@ from bda.plone.orders.common import BookingData
 from bda.plone.orders.common import DT_FORMAT
 from bda.plone.orders.common import get_bookings_soup
 from bda.plone.orders.common import get_order
+from bda.plone.orders.common import get_orders_soup
 from bda.plone.orders.common import get_vendor_by_uid
 from bda.plone.orders.common import get_vendor_uids_for
-from bda.plone.orders.common import get_vendors_for
-from bda.plone.orders.interfaces import IBuyable
 from bda.plone.orders.transitions import do_transition_for
 from bda.plone.orders.transitions import transitions_of_main_state
 from bda.plone.orders.transitions import transitions_of_salaried_state
 from decimal import Decimal
+from itertools import islice
 from odict import odict
+from plone.uuid.interfaces import IUUID
+from repoze.catalog.query import Any
 from repoze.catalog.query import Contains
 from repoze.catalog.query import Eq
 from repoze.catalog.query import Ge
@@ -72,9 +78,8 @@ class BookingStateDropdown(BookingsDropdown):
         return self.booking_data.state
 
     @property
-    def items(self):
-        transitions = transitions_of_main_state(self.value)
-        return self.create_items(transitions)
+    def available_transitions(self):
+        return transitions_of_main_state(self.value)
 
 
 class BookingSalariedDropdown(BookingsDropdown):
@@ -89,9 +94,8 @@ class BookingSalariedDropdown(BookingsDropdown):
         return self.booking_data.salaried or ifaces.SALARIED_NO
 
     @property
-    def items(self):
-        transitions = transitions_of_salaried_state(self.value)
-        return self.create_items(transitions)
+    def available_transitions(self):
+        return transitions_of_salaried_state(self.value)
 
 
 class BookingTransition(Transition):
@@ -127,7 +131,7 @@ class BookingsView(OrdersContentView):
 
     def __call__(self):
         # check if authenticated user is vendor
-        if not get_vendors_for():
+        if not get_vendor_uids_for():
             raise Unauthorized
         return super(BookingsView, self).__call__()
 
@@ -136,6 +140,10 @@ class BookingsTable(BrowserView):
     table_template = ViewPageTemplateFile('table.pt')
     table_id = 'bdaplonebookings'
     data_view_name = '@@bookingsdata'
+    # order records by uid, see ``prefetch_orders``
+    _orders = None
+    # dropdown classes rendered on client side in compact mode
+    dropdowns = (BookingStateDropdown, BookingSalariedDropdown)
 
     def rendered_table(self):
         return self.table_template(self)
@@ -479,29 +487,13 @@ class BookingsTable(BrowserView):
         soup = get_bookings_soup(self.context)
         aaData = list()
         size, result = self.query(soup)
+        self.prefetch_orders(
+            record for records in result.values() for record in records)
 
-        columns = self.columns
-        colnames = [_['id'] for _ in columns]
-
-        def record2list(record, bookings_quantity=None):
-            result = list()
-            for colname in colnames:
-                coldef = self.column_def(colname)
-                renderer = coldef.get('renderer')
-
-                if coldef['origin'] == 'o':
-                    if renderer:
-                        value = renderer(colname, record)
-                    else:
-                        value = self._get_ordervalue(colname, record)
-                else:
-                    if renderer:
-                        value = renderer(colname, record)
-                    else:
-                        value = record.attrs.get(colname, '')
-
-                result.append(value)
-            return result
+        plan = compile_columns(
+            self.columns,
+            extractors={'o': self._get_ordervalue}
+        )
 
         for key in result:
             bookings_quantity = 0
@@ -512,7 +504,7 @@ class BookingsTable(BrowserView):
             for record in result[key]:
                 record._v_bookings_quantity = bookings_quantity
                 record._v_bookings_total_sum = bookings_total_sum
-                aaData.append(record2list(record))
+                aaData.append([extract(record) for extract in plan])
 
         data = {
             "draw": int(self.request.form['draw']),
@@ -520,6 +512,12 @@ class BookingsTable(BrowserView):
             "recordsFiltered": size,
             "data": aaData,
         }
+        if compact_mode(self.request):
+            data['dropdowns'] = dropdown_definitions(
+                self.context,
+                self.request,
+                self.dropdowns
+            )
 
         self.request.response.setHeader(
             'Content-Type',
@@ -558,20 +556,32 @@ class BookingsTable(BrowserView):
         helper method to get the values which are saved on the order and not
         on the booking itself.
         """
-        order = get_order(self.context, record.attrs.get('order_uid'))
+        order_uid = record.attrs.get('order_uid')
+        order = None
+        if self._orders is not None:
+            order = self._orders.get(order_uid)
+        if order is None:
+            order = get_order(self.context, order_uid)
         value = order.attrs.get(colname, '')
         return value
 
+    def prefetch_orders(self, bookings):
+        """Fetch orders of bookings with one query. Used by
+        ``_get_ordervalue``.
+        """
+        order_uids = set(booking.attrs['order_uid'] for booking in bookings)
+        self._orders = dict()
+        if not order_uids:
+            return
+        soup = get_orders_soup(self.context)
+        for order in soup.query(Any('uid', list(order_uids))):
+            self._orders[order.attrs['uid']] = order
+
     def slice(self, fullresult):
         start = int(self.request.form['start'])
         length = int(self.request.form['length'])
-        count = 0
-        for lr in fullresult:
-            if count >= start and count < (start + length):
-                yield lr
-            if count >= (start + length):
-                break
-            count += 1
+        end = start + length if length >= 0 else None
+        return islice(fullresult, start, end)
 
     def column_def(self, colname):
         for column in self.columns:
@@ -615,13 +625,6 @@ class BookingsTable(BrowserView):
             return None
         return Contains('text', text + '*')
 
-    def _get_buyables_in_context(self):
-        catalog = plone.api.portal.get_tool("portal_catalog")
-        path = '/'.join(self.context.getPhysicalPath())
-        brains = catalog(path=path, object_provides=IBuyable.__identifier__)
-        for brain in brains:
-            yield brain.UID
-
     def check_modify_order(self, order):
         vendor_uid = self.request.form.get('vendor', '')
         if vendor_uid:
@@ -637,7 +640,6 @@ class BookingsTable(BrowserView):
         return True
 
     def query(self, soup):
-        self._get_buyables_in_context()
         req_group_id = self.request.get('group_by', 'email')
         # if no req group is set
         if len(req_group_id) == 0:
@@ -693,44 +695,47 @@ class BookingsTable(BrowserView):
         if text_query:
             queries.append(text_query)
 
+        # filter by bookings of buyables inside given context, get all
+        # bookings on site root. use explicit IPloneSiteRoot to make it play
+        # nice with lineage
+        if not IPloneSiteRoot.providedBy(self.context):
+            queries.append(Any('container_uids', [IUUID(self.context)]))
+
+        family = group_index.family
         if queries:
             # TODO: See the TODO above.
             query = queries[0]
             for q in queries[1:]:
                 query = query & q
-            dummysize, bookings_set = soup.catalog.query(query)
+            dummysize, query_set = soup.catalog.query(query)
+            bookings_set = family.IF.Set(query_set)
         else:
-            booking_uids = soup.catalog['uid']
-            bookings_set = booking_uids._rev_index.keys()
-
-        bookings_set = set(bookings_set)
-
-        buyable_index = soup.catalog['buyable_uid']
-        buyables_set = set()
-        # get all buyables for the current context/path
-        for buyable_uid in self._get_buyables_in_context():
-            try:
-                buyables_set.update(buyable_index._fwd_index[buyable_uid])
-            except KeyError:
-                continue
-        # filter bookings_set to only match the current context/path
-        bookings_set = bookings_set.intersection(buyables_set)
-
-        unique_group_ids = []
-        # for each booking which matches the query append the qroup id once
-        for group_id, group_booking_ids in group_index._fwd_index.items():
-            if bookings_set.intersection(group_booking_ids):
-                unique_group_ids.append(group_id)
+            bookings_set = family.IF.Set(soup.storage.data.keys())
+
+        # lookup group ids of matching bookings via reverse index, so group
+        # discovery scales with the number of matching bookings instead of
+        # the number of groups in index
+        rev_index = group_index._rev_index
+        unique_group_ids = set()
+        for booking_id in bookings_set:
+            group_id = rev_index.get(booking_id)
+            if group_id is not None:
+                unique_group_ids.add(group_id)
+        unique_group_ids = sorted(unique_group_ids)
 
         res = odict()
         size = len(unique_group_ids)
 
         # for each unique group id  get the matching group booking ids
+        fwd_index = group_index._fwd_index
         for group_id in self.slice(unique_group_ids):
-            res[group_id] = []
-            for group_booking_id in group_index._fwd_index[group_id]:
-                if group_booking_id in bookings_set:
-                    res[group_id].append(soup.get(group_booking_id))
+            group_booking_ids = family.IF.intersection(
+                fwd_index[group_id],
+                bookings_set
+            )
+            res[group_id] = [
+                soup.get(booking_id) for booking_id in group_booking_ids
+            ]
 
         return size, res
 
@@ -744,11 +749,14 @@ class BookingsTable(BrowserView):
                 vocabs.salaried_vocab()[booking_data.salaried],
                 context=self.request
             )
-        return BookingSalariedDropdown(
+        dropdown = BookingSalariedDropdown(
             self.context,
             self.request,
             record
-        ).render()
+        )
+        if compact_mode(self.request):
+            return dropdown.data()
+        return dropdown.render()
 
     def render_state(self, colname, record):
         if not self.check_modify_order(record):
@@ -760,15 +768,14 @@ class BookingsTable(BrowserView):
                 vocabs.state_vocab()[booking_data.state],
                 context=self.request
             )
-        return BookingStateDropdown(
-            self.context,
-            self.request,
-            record
-        ).render()
+        dropdown = BookingStateDropdown(self.context, self.request, record)
+        if compact_mode(self.request):
+            return dropdown.data()
+        return dropdown.render()
 
     def __call__(self):
         # check if authenticated user is vendor
-        if not get_vendors_for():
+        if not get_vendor_uids_for():
             raise Unauthorized
         # disable diazo theming if ajax call
         if '_' in self.request.form:
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 from bda.plone.orders import message_factory as _
 from bda.plone.orders.browser.views import OrdersContentView
+from bda.plone.orders.browser.views import ResultWindow
+from bda.plone.orders.browser.views import compile_columns
 from bda.plone.orders.contacts import get_contacts_soup
+from itertools import islice
 from repoze.catalog.query import Contains
-from repoze.catalog.query import Gt
 from yafowil.utils import Tag
 from zope.i18n import translate
 from zope.i18nmessageid import Message
@@ -86,24 +88,10 @@ class ContactsTable(OrdersContentView):
         soup = get_contacts_soup(self.context)
         aaData = list()
         size, result = self.query(soup)
-
-        columns = self.columns
-        colnames = [_['id'] for _ in columns]
-
-        def record2list(record, bookings_quantity=None):
-            result = list()
-            for colname in colnames:
-                coldef = self.column_def(colname)
-                renderer = coldef.get('renderer')
-                if renderer:
-                    value = renderer(colname, record)
-                else:
-                    value = record.attrs.get(colname, '')
-                result.append(value)
-            return result
-
+        plan = compile_columns(self.columns)
         for lazyrecord in self.slice(result):
-            aaData.append(record2list(lazyrecord()))
+            record = lazyrecord()
+            aaData.append([extract(record) for extract in plan])
 
         data = {
             "draw": int(self.request.form['draw']),
@@ -117,16 +105,21 @@ class ContactsTable(OrdersContentView):
         )
         return json.dumps(data)
 
-    def slice(self, fullresult):
+    def window(self):
+        """Return 2-tuple with start and end of requested page. End is None
+        if all records are requested.
+        """
         start = int(self.request.form['start'])
         length = int(self.request.form['length'])
-        count = 0
-        for lr in fullresult:
-            if count >= start and count < (start + length):
-                yield lr
-            if count >= (start + length):
-                break
-            count += 1
+        if length < 0:
+            return start, None
+        return start, start + length
+
+    def slice(self, fullresult):
+        if isinstance(fullresult, ResultWindow):
+            return iter(fullresult)
+        start, end = self.window()
+        return islice(fullresult, start, end)
 
     def column_def(self, colname):
         for column in self.columns:
@@ -139,15 +132,25 @@ class ContactsTable(OrdersContentView):
             return None
         return Contains('text', text + '*')
 
+    def all_contacts(self, soup):
+        """Return 2-tuple with number of contacts and lazy records of
+        requested page.
+
+        Records are paged straight from soup storage in record id order, thus
+        the unfiltered listing neither queries the catalog nor touches
+        records outside the requested page.
+        """
+        start, end = self.window()
+        # slicing BTree keys skips preceding buckets without loading records
+        iids = soup.storage.data.keys()[start:end]
+        return soup.storage.length.value, ResultWindow(soup, iids)
+
     def query(self, soup):
-        # always get all contacts
-        query = Gt('uid', 1)
         req_text = self.request.get('search[value]', '')
         text_query = self._text_checker(req_text)
-        # take fulltext search into account
-        if text_query:
-            query = query & text_query
-
-        res = soup.lazy(query, with_size=True)
+        # get all contacts if no fulltext search given
+        if not text_query:
+            return self.all_contacts(soup)
+        res = soup.lazy(text_query, with_size=True)
         size = res.next()
         return size, res
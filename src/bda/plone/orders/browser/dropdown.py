@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+from zope.i18n import translate
 import urllib
 
 
@@ -48,6 +49,62 @@ class BaseDropdown(object):
                                       str(self.record.attrs['uid']))
 
     @property
-    def items(self):
+    def available_transitions(self):
+        """List of transition names available for current value.
+        """
         raise NotImplementedError(u"Abstract Dropdown does not implement "
-                                  u"``items``.")
+                                  u"``available_transitions``.")
+
+    @property
+    def items(self):
+        return self.create_items(self.available_transitions)
+
+    def data(self):
+        """Return compact dropdown data for rendering on client side.
+
+        Titles, CSS class and transition URL are shared by all dropdowns of
+        the same kind, see ``definition``.
+        """
+        return {
+            'dropdown': self.action,
+            'uid': str(self.record.attrs['uid']),
+            'value': self.value,
+            'transitions': self.available_transitions,
+        }
+
+    @classmethod
+    def definition(cls, context, request):
+        """Return data shared by all dropdowns of this kind on a page.
+
+        ``url`` is a template containing ``{uid}`` and ``{transition}``
+        placeholders. Like the targets of ``create_items`` it points to
+        context, the transition view is called via ``action``.
+        """
+        url = '{0}?'.format(context.absolute_url())
+        vendor = request.form.get('vendor', '')
+        if vendor:
+            url += '{0}&'.format(urllib.urlencode({'vendor': vendor}))
+        url += 'uid={uid}&transition={transition}'
+
+        def translated(vocab):
+            return dict([
+                (key, translate(value, context=request))
+                for key, value in vocab.items()
+            ])
+        return {
+            'name': cls.name,
+            'css': cls.css,
+            'action': cls.action,
+            'url': url,
+            'values': translated(cls.vocab),
+            'transitions': translated(cls.transitions),
+        }
+
+
+def dropdown_definitions(context, request, dropdowns):
+    """Return dropdown definitions by action for given dropdown classes.
+    """
+    return dict([
+        (dropdown.action, dropdown.definition(context, request))
+        for dropdown in dropdowns
+    ])
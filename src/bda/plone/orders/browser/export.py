@@ -1,30 +1,38 @@
 # -*- coding: utf-8 -*-
 from AccessControl import Unauthorized
 from Acquisition import aq_parent
-from Products.CMFPlone.utils import getToolByName
 from Products.CMFPlone.utils import safe_unicode
 from Products.Five import BrowserView
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from StringIO import StringIO
+from ZODB.POSException import ConflictError
 from bda.plone.cart import get_item_stock
-from bda.plone.cart import get_object_by_uid
 from bda.plone.orders import message_factory as _
 from bda.plone.orders import permissions
 from bda.plone.orders import safe_encode
 from bda.plone.orders import safe_filename
+from bda.plone.orders.browser.exportjobs import export_jobs_for_current_user
 from bda.plone.orders.browser.views import OrdersContentView
 from bda.plone.orders.browser.views import customers_form_vocab
+from bda.plone.orders.browser.views import json_value
 from bda.plone.orders.browser.views import vendors_form_vocab
+from bda.plone.orders.common import BuyableResolver
 from bda.plone.orders.common import DT_FORMAT
 from bda.plone.orders.common import OrderData
+from bda.plone.orders.common import commit_retrying
 from bda.plone.orders.common import get_bookings_soup
-from bda.plone.orders.common import get_order
 from bda.plone.orders.common import get_orders_soup
 from bda.plone.orders.common import get_vendor_uids_for
-from bda.plone.orders.common import get_vendors_for
-from bda.plone.orders.interfaces import IBuyable
+from bda.plone.orders.common import mark_bookings_exported
+from bda.plone.orders.common import set_export_watermark
+from bda.plone.orders.exportjobs import cleanup_export_jobs
+from bda.plone.orders.exportjobs import create_export_job
+from bda.plone.orders.exportjobs import export_job_workers_exhausted
+from bda.plone.orders.exportjobs import start_export_job
 from decimal import Decimal
 from odict import odict
+from plone.protect import CheckAuthenticator
+from plone.protect import PostOnly
 from plone.uuid.interfaces import IUUID
 from repoze.catalog.query import Any
 from repoze.catalog.query import Eq
@@ -33,11 +41,15 @@ from repoze.catalog.query import Le
 from yafowil.base import ExtractionError
 from yafowil.controller import Controller
 from yafowil.plone.form import YAMLForm
+from zExceptions import BadRequest
 import csv
 import datetime
+import json
+import logging
 import plone.api
 import uuid
 import yafowil.loader  # noqa
+import zlib
 
 
 class DialectExcelWithColons(csv.excel):
@@ -47,6 +59,9 @@ class DialectExcelWithColons(csv.excel):
 csv.register_dialect('excel-colon', DialectExcelWithColons)
 
 
+logger = logging.getLogger('bda.plone.orders')
+
+
 ORDER_EXPORT_ATTRS = [
     'uid',
     'created',
@@ -90,9 +105,28 @@ BOOKING_EXPORT_ATTRS = [
 ]
 COMPUTED_BOOKING_EXPORT_ATTRS = odict()
 
+# request key of ``BuyableResolver`` shared during an export
+EXPORT_BUYABLES_KEY = 'bda.plone.orders.export.buyables'
+
+
+def get_buyable(context, booking):
+    """Return buyable object of booking or ``None``.
+
+    Exports store a ``BuyableResolver`` on request, which has resolved the
+    buyables of all exported bookings up front. Thus each buyable gets woken
+    up only once per export.
+    """
+    buyables = None
+    request = getattr(context, 'REQUEST', None)
+    if request is not None:
+        buyables = request.get(EXPORT_BUYABLES_KEY)
+    if buyables is None:
+        buyables = BuyableResolver(context)
+    return buyables.object(booking.attrs['buyable_uid'])
+
 
 def buyable_available(context, booking):
-    obj = get_object_by_uid(context, booking.attrs['buyable_uid'])
+    obj = get_buyable(context, booking)
     if not obj:
         return None
     item_stock = get_item_stock(obj)
@@ -102,7 +136,7 @@ def buyable_available(context, booking):
 
 
 def buyable_overbook(context, booking):
-    obj = get_object_by_uid(context, booking.attrs['buyable_uid'])
+    obj = get_buyable(context, booking)
     if not obj:
         return None
     item_stock = get_item_stock(obj)
@@ -112,7 +146,7 @@ def buyable_overbook(context, booking):
 
 
 def buyable_url(context, booking):
-    obj = get_object_by_uid(context, booking.attrs['buyable_uid'])
+    obj = get_buyable(context, booking)
     if not obj:
         return None
     return obj.absolute_url()
@@ -123,6 +157,189 @@ COMPUTED_BOOKING_EXPORT_ATTRS['buyable_overbook'] = buyable_overbook
 COMPUTED_BOOKING_EXPORT_ATTRS['buyable_url'] = buyable_url
 
 
+# number of rows buffered before being written to response
+EXPORT_CHUNK_SIZE = 1000
+
+
+class StreamingWriter(object):
+    """Writer buffering rows and writing them to output stream in chunks.
+
+    Output stream is usually the response, in which case headers must be set
+    before the first chunk is written. The ZODB pickle cache gets garbage
+    collected after each chunk, thus memory consumption does not grow with
+    export size.
+    """
+
+    def __init__(self, out, jar=None, chunk_size=EXPORT_CHUNK_SIZE):
+        self.out = out
+        self.jar = jar
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.buffer = StringIO()
+
+    def row_written(self):
+        self.count += 1
+        if self.count % self.chunk_size == 0:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.flush()
+        if self.jar is not None:
+            self.jar.cacheGC()
+
+    def flush(self):
+        self.out.write(self.buffer.getvalue())
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def close(self):
+        self.flush()
+        self.buffer.close()
+
+
+class StreamingCSVWriter(StreamingWriter):
+    """CSV writer writing rows to output stream in chunks.
+    """
+
+    def __init__(self, out, jar=None, chunk_size=EXPORT_CHUNK_SIZE):
+        super(StreamingCSVWriter, self).__init__(
+            out,
+            jar=jar,
+            chunk_size=chunk_size
+        )
+        self.writer = csv.writer(
+            self.buffer,
+            dialect='excel-colon',
+            quoting=csv.QUOTE_MINIMAL
+        )
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.row_written()
+
+
+class StreamingNDJSONWriter(StreamingWriter):
+    """Writer writing one JSON object per line to output stream in chunks.
+    """
+
+    def writeobject(self, obj):
+        self.buffer.write(json.dumps(obj))
+        self.buffer.write('\n')
+        self.row_written()
+
+
+# attributes exported by NDJSON export in addition to CSV export attributes
+# if no field projection is requested
+NDJSON_ORDER_ATTRS = [
+    'creator',
+    'state',
+    'salaried',
+    'vendor_uids',
+    'net',
+    'vat',
+    'total',
+]
+NDJSON_BOOKING_ATTRS = [
+    'uid',
+    'buyable_uid',
+    'vendor_uid',
+    'created',
+]
+
+# accepted formats of date filters of NDJSON export
+ISO_DATETIME_FORMATS = [
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%d',
+]
+
+
+def parse_iso_datetime(value):
+    """Parse ISO-8601 date or datetime without timezone.
+
+    :raises: ``ValueError`` if value cannot be parsed.
+    """
+    for fmt in ISO_DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(u'Invalid ISO-8601 datetime: {0}'.format(value))
+
+
+def unique_attrs(*attr_lists):
+    """Concatenate attribute lists, skipping duplicates.
+    """
+    ret = list()
+    for attrs in attr_lists:
+        for attr in attrs:
+            if attr not in ret:
+                ret.append(attr)
+    return ret
+
+
+class GzipStream(object):
+    """File like object compressing written data incrementally with gzip and
+    writing it to output stream. ``close`` must be called to write the
+    remaining compressed data.
+    """
+
+    def __init__(self, out, level=6):
+        self.out = out
+        # add 16 to window bits for writing gzip header and trailer
+        self.compressor = zlib.compressobj(
+            level,
+            zlib.DEFLATED,
+            16 + zlib.MAX_WBITS
+        )
+
+    def write(self, data):
+        data = self.compressor.compress(data)
+        if data:
+            self.out.write(data)
+
+    def close(self):
+        self.out.write(self.compressor.flush())
+
+
+class ResponseStream(object):
+    """Uncompressed counterpart of ``GzipStream``.
+    """
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, data):
+        self.out.write(data)
+
+    def close(self):
+        pass
+
+
+def gzip_requested(request):
+    """Check whether gzip compressed export is requested.
+    """
+    return request.form.get('gzip') in ('1', 'true', 'on')
+
+
+def commit_streamed_export(func):
+    """Commit changes made after export has been streamed to response.
+
+    On ``ConflictError`` the publisher would retry the request and stream
+    the export again into the response already sent. Thus the commit gets
+    retried here instead. If it still fails, changes are discarded and the
+    affected bookings are contained in the next export again.
+    """
+    try:
+        commit_retrying(func)
+    except ConflictError:
+        logger.error(
+            u"Marking streamed export failed due to write conflicts, "
+            u"exported bookings have not been marked exported."
+        )
+
+
 def cleanup_for_csv(value):
     """Cleanup a value for CSV export.
     """
@@ -141,13 +358,19 @@ class ExportOrdersForm(YAMLForm, OrdersContentView):
     form_template = 'bda.plone.orders.browser:forms/orders_export.yaml'
     message_factory = _
     action_resource = 'exportorders'
+    gzip = False
+    # set by next handlers which already answered the request, either by
+    # streaming the export or by redirecting
+    response_done = False
 
     def __call__(self):
         # check if authenticated user is vendor
-        if not get_vendors_for():
+        if not get_vendor_uids_for():
             raise Unauthorized
         self.prepare()
         controller = Controller(self.form, self.request)
+        if self.response_done:
+            return ''
         if not controller.next:
             self.rendered_form = controller.rendered
             return self.browser_template(self)
@@ -165,6 +388,9 @@ class ExportOrdersForm(YAMLForm, OrdersContentView):
     def customer_mode(self):
         return len(customers_form_vocab()) > 2 and 'edit' or 'skip'
 
+    def export_jobs(self):
+        return export_jobs_for_current_user(self.context, self.request)
+
     def from_before_to(self, widget, data):
         from_date = data.fetch('exportorders.from').extracted
         to_date = data.fetch('exportorders.to').extracted
@@ -178,6 +404,7 @@ class ExportOrdersForm(YAMLForm, OrdersContentView):
         self.customer = self.request.form.get('exportorders.customer')
         self.from_date = data.fetch('exportorders.from').extracted
         self.to_date = data.fetch('exportorders.to').extracted
+        self.gzip = bool(data.fetch('exportorders.gzip').extracted)
 
     def export_val(self, record, attr_name):
         """Get attribute from record and cleanup.
@@ -186,11 +413,9 @@ class ExportOrdersForm(YAMLForm, OrdersContentView):
         val = record.attrs.get(attr_name)
         return cleanup_for_csv(val)
 
-    def csv(self, request):
-        # get orders soup
-        orders_soup = get_orders_soup(self.context)
-        # get bookings soup
-        bookings_soup = get_bookings_soup(self.context)
+    def export_query(self):
+        """Return orders query for export parameters.
+        """
         # fetch user vendor uids
         vendor_uids = get_vendor_uids_for()
         # base query for time range
@@ -209,16 +434,71 @@ class ExportOrdersForm(YAMLForm, OrdersContentView):
         customer = self.customer
         if customer:
             query = query & Eq('creator', customer)
+        return query
+
+    def export_filename(self):
+        s_start = self.from_date.strftime('%G-%m-%d_%H-%M-%S')
+        s_end = self.to_date.strftime('%G-%m-%d_%H-%M-%S')
+        filename = 'orders-export-%s-%s.csv' % (s_start, s_end)
+        if self.gzip:
+            filename += '.gz'
+        return filename
+
+    def write_export(self, out, progress=None):
+        """Write CSV export to output stream, gzip compressed if requested.
+
+        :returns: Record ids of exported bookings, see ``write_csv``.
+        """
+        if not self.gzip:
+            return self.write_csv(out, progress=progress)
+        out = GzipStream(out)
+        docids = self.write_csv(out, progress=progress)
+        out.close()
+        return docids
+
+    def write_csv(self, out, progress=None):
+        """Write CSV export to output stream in chunks.
+
+        If given, ``progress`` gets called with number of exported and total
+        number of orders after each order.
+
+        Bookings are not marked exported here, since this must happen after
+        the export has been written completely.
+
+        :returns: Record ids of exported bookings.
+        :rtype: list of int
+        """
+        # get orders soup
+        orders_soup = get_orders_soup(self.context)
+        # get bookings soup
+        bookings_soup = get_bookings_soup(self.context)
+        # fetch user vendor uids
+        vendor_uids = get_vendor_uids_for()
+        query = self.export_query()
         # prepare csv writer
-        sio = StringIO()
-        ex = csv.writer(sio, dialect='excel-colon', quoting=csv.QUOTE_MINIMAL)
+        ex = StreamingCSVWriter(out, jar=orders_soup.storage._p_jar)
         # exported column keys as first line
         ex.writerow(ORDER_EXPORT_ATTRS +
                     COMPUTED_ORDER_EXPORT_ATTRS.keys() +
                     BOOKING_EXPORT_ATTRS +
                     COMPUTED_BOOKING_EXPORT_ATTRS.keys())
+        # bookings get marked exported in one batch after export is written.
+        # only record ids are kept, thus memory does not grow with records
+        exported_docids = list()
         # query orders
-        for order in orders_soup.query(query):
+        size, docids = orders_soup.catalog.query(query)
+        docids = list(docids)
+        # resolve buyables of all orders with one catalog query. buyable uids
+        # are read from reverse index, thus orders are not loaded twice.
+        # resolver is shared with computed booking export attrs via request
+        rev_index = orders_soup.catalog['buyable_uids']._rev_index
+        buyables = BuyableResolver(self.context)
+        buyables.resolve(
+            uid for docid in docids for uid in rev_index.get(docid, ())
+        )
+        self.request.set(EXPORT_BUYABLES_KEY, buyables)
+        for count, docid in enumerate(docids, 1):
+            order = orders_soup.get(docid)
             # restrict order bookings for current vendor_uids
             order_data = OrderData(self.context,
                                    order=order,
@@ -247,44 +527,229 @@ class ExportOrdersForm(YAMLForm, OrdersContentView):
                     val = cleanup_for_csv(val)
                     booking_attrs.append(val)
                 ex.writerow(order_attrs + booking_attrs)
-                booking.attrs['exported'] = True
-                bookings_soup.reindex(booking)
-        # create and return response
-        s_start = self.from_date.strftime('%G-%m-%d_%H-%M-%S')
-        s_end = self.to_date.strftime('%G-%m-%d_%H-%M-%S')
-        filename = 'orders-export-%s-%s.csv' % (s_start, s_end)
-        self.request.response.setHeader('Content-Type', 'text/csv')
-        self.request.response.setHeader('Content-Disposition',
-                                        'attachment; filename=%s' % filename)
-        ret = sio.getvalue()
-        sio.close()
-        return ret
+                exported_docids.append(booking.intid)
+            if progress is not None:
+                progress(count, len(docids))
+        ex.close()
+        return exported_docids
 
+    def csv(self, request):
+        """Stream CSV export to response.
+        """
+        # check vendor permissions before streaming starts
+        self.export_query()
+        # set response headers before streaming starts
+        response = self.request.response
+        response.setHeader(
+            'Content-Type',
+            self.gzip and 'application/gzip' or 'text/csv'
+        )
+        response.setHeader('Content-Disposition',
+                           'attachment; filename=%s' % self.export_filename())
+        docids = self.write_export(response)
+        # body has already been written to response
+        self.response_done = True
+        commit_streamed_export(lambda: mark_bookings_exported(
+            get_bookings_soup(self.context),
+            docids
+        ))
+        return ''
+
+    def background(self, request):
+        """Submit export as background job and redirect to job view.
+        """
+        # check vendor permissions before job gets created
+        self.export_query()
+        cleanup_export_jobs(self.context)
+        if export_job_workers_exhausted():
+            plone.api.portal.show_message(
+                message=_(
+                    'export_jobs_exhausted',
+                    default=u'Too many exports are running, please try '
+                            u'again later.'
+                ),
+                request=self.request,
+                type='error'
+            )
+            self.request.response.redirect(
+                '%s/@@exportorders' % self.context.absolute_url()
+            )
+            self.response_done = True
+            return ''
+        job = create_export_job(
+            self.context,
+            plone.api.user.get_current().getId(),
+            self.export_filename(),
+            self.request,
+            {
+                'vendor': self.vendor,
+                'customer': self.customer,
+                'from_date': self.from_date,
+                'to_date': self.to_date,
+                'gzip': self.gzip,
+            }
+        )
+        start_export_job(self.context, job.attrs['uid'], self.__class__)
+        url = '%s/@@exportjob?uid=%s' % (
+            self.context.absolute_url(),
+            job.attrs['uid']
+        )
+        self.request.response.redirect(url)
+        self.response_done = True
+        return ''
+
+
+class ExportOrdersNDJSON(BrowserView):
+    """Machine oriented orders export streaming one JSON object per line.
+
+    Each line contains an order with its bookings nested as ``bookings``.
+    Values are not localized, datetimes are ISO-8601 formatted and decimals
+    are exported as strings to preserve precision.
+
+    Request parameters, all optional:
 
-class ExportOrdersContextual(BrowserView):
+    ``from_date``, ``to_date``
+        ISO-8601 datetime range orders have been created in.
+
+    ``vendor``
+        Vendor uid. Defaults to all vendors of authenticated user.
+
+    ``order_fields``
+        Comma separated order attributes to export.
+
+    ``booking_fields``
+        Comma separated booking attributes to export. If empty, bookings are
+        not exported at all.
+
+    ``gzip``
+        Compress export with gzip if ``1``.
+    """
 
     def __call__(self):
-        user = plone.api.user.get_current()
-        # check if authenticated user is vendor
-        if not user.checkPermission(permissions.ModifyOrders, self.context):
+        query = self.export_query()
+        order_fields = self.fields(
+            'order_fields',
+            unique_attrs(ORDER_EXPORT_ATTRS, NDJSON_ORDER_ATTRS)
+        )
+        booking_fields = self.fields(
+            'booking_fields',
+            unique_attrs(NDJSON_BOOKING_ATTRS, BOOKING_EXPORT_ATTRS)
+        )
+        response = self.request.response
+        if not gzip_requested(self.request):
+            response.setHeader(
+                'Content-Type',
+                'application/x-ndjson; charset=utf-8'
+            )
+            self.write_ndjson(response, query, order_fields, booking_fields)
+            # body has already been written to response
+            return ''
+        response.setHeader('Content-Type', 'application/gzip')
+        response.setHeader('Content-Disposition',
+                           'attachment; filename=orders-export.ndjson.gz')
+        out = GzipStream(response)
+        self.write_ndjson(out, query, order_fields, booking_fields)
+        out.close()
+        return ''
+
+    def fields(self, name, default):
+        value = self.request.form.get(name)
+        if value is None:
+            return default
+        return [field.strip() for field in value.split(',') if field.strip()]
+
+    def date_param(self, name):
+        value = self.request.form.get(name)
+        if not value:
+            return None
+        try:
+            return parse_iso_datetime(value)
+        except ValueError:
+            raise BadRequest(u'Invalid {0}: {1}'.format(name, value))
+
+    def export_query(self):
+        """Return orders query for request parameters.
+        """
+        # fetch user vendor uids
+        vendor_uids = get_vendor_uids_for()
+        if not vendor_uids:
             raise Unauthorized
+        # filter by given vendor uid or user vendor uids
+        vendor_uid = self.request.form.get('vendor')
+        if vendor_uid:
+            try:
+                vendor_uid = uuid.UUID(vendor_uid)
+            except ValueError:
+                raise BadRequest(u'Invalid vendor: {0}'.format(vendor_uid))
+            # raise if given vendor uid not in user vendor uids
+            if vendor_uid not in vendor_uids:
+                raise Unauthorized
+            vendor_uids = [vendor_uid]
+        self.vendor_uids = vendor_uids
+        query = Any('vendor_uids', vendor_uids)
+        # filter by time range if given
+        from_date = self.date_param('from_date')
+        if from_date:
+            query = query & Ge('created', from_date)
+        to_date = self.date_param('to_date')
+        if to_date:
+            query = query & Le('created', to_date)
+        return query
+
+    def write_ndjson(self, out, query, order_fields, booking_fields):
+        """Write orders with nested bookings to output stream, ordered by
+        creation date.
+        """
+        context = self.context
+        orders_soup = get_orders_soup(context)
+        size, docids = orders_soup.catalog.query(query, sort_index='created')
+        ex = StreamingNDJSONWriter(out, jar=orders_soup.storage._p_jar)
+        for docid in docids:
+            order = orders_soup.get(docid)
+            attrs = order.attrs
+            data = dict(
+                (name, json_value(attrs.get(name)))
+                for name in order_fields
+            )
+            if booking_fields:
+                # restrict order bookings for requested vendor_uids
+                order_data = OrderData(context,
+                                       order=order,
+                                       vendor_uids=self.vendor_uids)
+                data['bookings'] = [
+                    dict(
+                        (name, json_value(booking.attrs.get(name)))
+                        for name in booking_fields
+                    ) for booking in order_data.bookings
+                ]
+            ex.writeobject(data)
+        ex.close()
+
+
+class OrderGroupedExport(object):
+    """Mixin for exports writing bookings grouped by order.
+    """
 
-        # Special case for constructed objects like IEventOccurrence from
-        # plone.app.event
-        title = self.context.title or aq_parent(self.context).title
+    def start_export(self, filename):
+        """Set response headers and return output stream for export.
 
-        filename = u'{0}_{1}.csv'.format(
-            safe_unicode(title),
-            safe_unicode(datetime.datetime.now().strftime('%Y-%m-%d_%H-%M'))
-        )
-        filename = safe_filename(filename)
-        resp = self.request.response
-        resp.setHeader('content-type', 'text/csv; charset=utf-8')
-        resp.setHeader(
-            'content-disposition',
-            'attachment;filename={}'.format(filename)
+        If requested, export gets gzip compressed and ``.gz`` is appended to
+        filename. Output stream must be closed after export is written.
+        """
+        response = self.request.response
+        if gzip_requested(self.request):
+            response.setHeader('Content-Type', 'application/gzip')
+            response.setHeader(
+                'Content-Disposition',
+                'attachment; filename={0}.gz'.format(filename)
+            )
+            return GzipStream(response)
+        response.setHeader('Content-Type', 'text/csv; charset=utf-8')
+        response.setHeader(
+            'Content-Disposition',
+            'attachment; filename={0}'.format(filename)
         )
-        return self.get_csv()
+        return ResponseStream(response)
 
     def export_val(self, record, attr_name):
         """Get attribute from record and cleanup.
@@ -293,74 +758,223 @@ class ExportOrdersContextual(BrowserView):
         val = record.attrs.get(attr_name)
         return cleanup_for_csv(val)
 
-    def get_csv(self):
-        context = self.context
+    def write_grouped_csv(self, out, bookings_soup, docids, vendor_uids):
+        """Write CSV export of bookings grouped by order to output stream.
+
+        Order uids and buyable uids of bookings are read from reverse
+        indexes in one pass. Orders get resolved with one query and are
+        exported ordered by creation date.
 
+        :param out: Output stream.
+        :param bookings_soup: Bookings soup.
+        :param docids: Record ids of bookings to export.
+        :param vendor_uids: Vendor uids passed to ``OrderData`` for computed
+                            order export attributes.
+        :returns: Record ids of exported bookings.
+        :rtype: list of int
+        """
+        context = self.context
+        orders_soup = get_orders_soup(context)
+        # group booking ids by order uid, read from reverse index, thus
+        # bookings are not loaded before they get exported
+        order_index = bookings_soup.catalog['order_uid']._rev_index
+        buyable_index = bookings_soup.catalog['buyable_uid']._rev_index
+        order_bookings = dict()
+        buyable_uids = set()
+        for docid in docids:
+            order_uid = order_index.get(docid)
+            if order_uid is None:
+                continue
+            order_bookings.setdefault(order_uid, list()).append(docid)
+            buyable_uids.add(buyable_index.get(docid))
+        # resolve buyables of all bookings with one catalog query. resolver
+        # is shared with computed booking export attrs via request
+        buyables = BuyableResolver(context)
+        buyables.resolve(buyable_uids)
+        self.request.set(EXPORT_BUYABLES_KEY, buyables)
         # prepare csv writer
-        sio = StringIO()
-        ex = csv.writer(sio, dialect='excel-colon', quoting=csv.QUOTE_MINIMAL)
+        ex = StreamingCSVWriter(out, jar=bookings_soup.storage._p_jar)
         # exported column keys as first line
         ex.writerow(ORDER_EXPORT_ATTRS +
                     COMPUTED_ORDER_EXPORT_ATTRS.keys() +
                     BOOKING_EXPORT_ATTRS +
                     COMPUTED_BOOKING_EXPORT_ATTRS.keys())
+        exported_docids = list()
+        if not order_bookings:
+            ex.close()
+            return exported_docids
+        # resolve orders with one query, ordered by creation date
+        size, order_docids = orders_soup.catalog.query(
+            Any('uid', order_bookings.keys()),
+            sort_index='created'
+        )
+        for order_docid in order_docids:
+            order = orders_soup.get(order_docid)
+            order_attrs = list()
+            # order export attrs
+            for attr_name in ORDER_EXPORT_ATTRS:
+                val = self.export_val(order, attr_name)
+                order_attrs.append(val)
+            # computed order export attrs. order data is only needed there
+            if COMPUTED_ORDER_EXPORT_ATTRS:
+                order_data = OrderData(context,
+                                       order=order,
+                                       vendor_uids=vendor_uids)
+            for attr_name in COMPUTED_ORDER_EXPORT_ATTRS:
+                cb = COMPUTED_ORDER_EXPORT_ATTRS[attr_name]
+                val = cb(context, order_data)
+                val = cleanup_for_csv(val)
+                order_attrs.append(val)
+            for docid in order_bookings[order.attrs['uid']]:
+                booking = bookings_soup.get(docid)
+                booking_attrs = list()
+                # booking export attrs
+                for attr_name in BOOKING_EXPORT_ATTRS:
+                    val = self.export_val(booking, attr_name)
+                    booking_attrs.append(val)
+                # computed booking export attrs
+                for attr_name in COMPUTED_BOOKING_EXPORT_ATTRS:
+                    cb = COMPUTED_BOOKING_EXPORT_ATTRS[attr_name]
+                    val = cb(context, booking)
+                    val = cleanup_for_csv(val)
+                    booking_attrs.append(val)
+                ex.writerow(order_attrs + booking_attrs)
+                exported_docids.append(docid)
+        ex.close()
+        return exported_docids
 
-        bookings_soup = get_bookings_soup(context)
 
-        # First, filter by allowed vendor areas
+class ExportOrdersIncremental(OrderGroupedExport, BrowserView):
+    """Export bookings which have not been exported yet, grouped by order.
+
+    Unexported bookings are looked up via ``exported`` index, thus bookings
+    exported earlier are not read at all. Bookings created after the export
+    started are left for the next run. Exported bookings get marked exported.
+
+    Since bookings get modified, export must be requested via POST with a
+    valid ``_authenticator`` token of the requesting user.
+
+    Export start gets recorded as watermark for each vendor bookings have
+    been exported for. The watermark is informational only, i.e. for
+    monitoring the feed, it is not used for querying bookings.
+    """
+
+    def __call__(self):
+        PostOnly(self.request)
+        CheckAuthenticator(self.request)
+        vendor_uids = self.export_vendor_uids()
+        watermark = datetime.datetime.now()
+        filename = 'orders-export-incremental-%s.csv' % (
+            watermark.strftime('%G-%m-%d_%H-%M-%S')
+        )
+        self.request.response.setHeader(
+            'X-Export-Watermark',
+            watermark.isoformat()
+        )
+        out = self.start_export(filename)
+        docids = self.write_csv(out, vendor_uids, watermark)
+        out.close()
+        # body has already been written to response
+        commit_streamed_export(
+            lambda: self.mark_exported(docids, watermark)
+        )
+        return ''
+
+    def export_vendor_uids(self):
+        """Return uids of vendors to export bookings for.
+        """
+        # fetch user vendor uids
         vendor_uids = get_vendor_uids_for()
-        query_b = Any('vendor_uid', vendor_uids)
+        if not vendor_uids:
+            raise Unauthorized
+        # filter by given vendor uid or user vendor uids
+        vendor_uid = self.request.form.get('vendor')
+        if vendor_uid:
+            try:
+                vendor_uid = uuid.UUID(vendor_uid)
+            except ValueError:
+                raise BadRequest(u'Invalid vendor: {0}'.format(vendor_uid))
+            # raise if given vendor uid not in user vendor uids
+            if vendor_uid not in vendor_uids:
+                raise Unauthorized
+            return [vendor_uid]
+        return vendor_uids
 
-        # Second, query for the buyable
-        query_cat = {}
-        query_cat['object_provides'] = IBuyable.__identifier__
-        query_cat['path'] = '/'.join(context.getPhysicalPath())
-        cat = getToolByName(context, 'portal_catalog')
-        res = cat(**query_cat)
-        buyable_uids = [IUUID(it.getObject()) for it in res]
-
-        query_b = query_b & Any('buyable_uid', buyable_uids)
-
-        all_orders = {}
-        for booking in bookings_soup.query(query_b):
-            booking_attrs = []
-            # booking export attrs
-            for attr_name in BOOKING_EXPORT_ATTRS:
-                val = self.export_val(booking, attr_name)
-                booking_attrs.append(val)
-            # computed booking export attrs
-            for attr_name in COMPUTED_BOOKING_EXPORT_ATTRS:
-                cb = COMPUTED_BOOKING_EXPORT_ATTRS[attr_name]
-                val = cb(context, booking)
-                val = cleanup_for_csv(val)
-                booking_attrs.append(val)
+    def write_csv(self, out, vendor_uids, watermark):
+        """Write CSV export of unexported bookings to output stream.
 
-            # create order_attrs, if it doesn't exist
-            order_uid = booking.attrs.get('order_uid')
-            if order_uid not in all_orders:
-                order = get_order(context, order_uid)
-                order_data = OrderData(context,
-                                       order=order,
-                                       vendor_uids=vendor_uids)
-                order_attrs = []
-                # order export attrs
-                for attr_name in ORDER_EXPORT_ATTRS:
-                    val = self.export_val(order, attr_name)
-                    order_attrs.append(val)
-                # computed order export attrs
-                for attr_name in COMPUTED_ORDER_EXPORT_ATTRS:
-                    cb = COMPUTED_ORDER_EXPORT_ATTRS[attr_name]
-                    val = cb(self.context, order_data)
-                    val = cleanup_for_csv(val)
-                    order_attrs.append(val)
-                all_orders[order_uid] = order_attrs
+        :returns: Record ids of exported bookings.
+        :rtype: list of int
+        """
+        bookings_soup = get_bookings_soup(self.context)
+        # query unexported bookings
+        query = Eq('exported', False) & \
+            Any('vendor_uid', vendor_uids) & \
+            Le('created', watermark)
+        size, docids = bookings_soup.catalog.query(query)
+        return self.write_grouped_csv(out, bookings_soup, docids, vendor_uids)
+
+    def mark_exported(self, docids, watermark):
+        """Mark exported bookings and record watermark for vendors of
+        exported bookings.
+        """
+        bookings_soup = get_bookings_soup(self.context)
+        mark_bookings_exported(bookings_soup, docids)
+        vendor_index = bookings_soup.catalog['vendor_uid']._rev_index
+        for vendor_uid in set([vendor_index.get(docid) for docid in docids]):
+            set_export_watermark(vendor_uid, watermark)
+
+
+class ExportOrdersContextual(OrderGroupedExport, BrowserView):
+    """Export bookings of buyables inside context, grouped by order.
+    """
 
-            ex.writerow(all_orders[order_uid] + booking_attrs)
+    def __call__(self):
+        user = plone.api.user.get_current()
+        # check if authenticated user is vendor
+        if not user.checkPermission(permissions.ModifyOrders, self.context):
+            raise Unauthorized
 
-            # TODO: also set for contextual exports? i'd say no.
-            # booking.attrs['exported'] = True
-            # bookings_soup.reindex(booking)
+        # Special case for constructed objects like IEventOccurrence from
+        # plone.app.event
+        title = self.context.title or aq_parent(self.context).title
+
+        filename = u'{0}_{1}.csv'.format(
+            safe_unicode(title),
+            safe_unicode(datetime.datetime.now().strftime('%Y-%m-%d_%H-%M'))
+        )
+        filename = safe_filename(filename)
+        out = self.start_export(filename)
+        self.write_csv(out)
+        out.close()
+        # body has already been written to response
+        return ''
 
+    def get_csv(self):
+        """Return CSV export as string.
+        """
+        sio = StringIO()
+        self.write_csv(sio)
         ret = sio.getvalue()
         sio.close()
         return ret
+
+    def write_csv(self, out):
+        """Write CSV export to output stream in chunks.
+        """
+        context = self.context
+        bookings_soup = get_bookings_soup(context)
+
+        # First, filter by allowed vendor areas
+        vendor_uids = get_vendor_uids_for()
+        query_b = Any('vendor_uid', vendor_uids)
+
+        # Second, filter by bookings of buyables inside context
+        query_b = query_b & Any('container_uids', [IUUID(context)])
+
+        size, docids = bookings_soup.catalog.query(query_b)
+        self.write_grouped_csv(out, bookings_soup, docids, vendor_uids)
+
+        # TODO: also set for contextual exports? i'd say no.
+        # booking.attrs['exported'] = True
+        # bookings_soup.reindex(booking)
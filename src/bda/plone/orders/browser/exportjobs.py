@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from AccessControl import Unauthorized
+from Products.Five import BrowserView
+from ZPublisher.Iterators import filestream_iterator
+from bda.plone.orders import message_factory as _
+from bda.plone.orders.common import DT_FORMAT
+from bda.plone.orders.exportjobs import EXPORT_JOB_TIMEOUT_ERROR
+from bda.plone.orders.exportjobs import JOB_FAILED
+from bda.plone.orders.exportjobs import JOB_FINISHED
+from bda.plone.orders.exportjobs import JOB_PENDING
+from bda.plone.orders.exportjobs import JOB_RUNNING
+from bda.plone.orders.exportjobs import export_job_stale
+from bda.plone.orders.exportjobs import get_export_job
+from bda.plone.orders.exportjobs import get_export_jobs_for
+from zExceptions import NotFound
+from zope.i18n import translate
+import json
+import os
+import plone.api
+
+
+JOB_STATE_LABELS = {
+    JOB_PENDING: _('export_job_pending', default=u'Pending'),
+    JOB_RUNNING: _('export_job_running', default=u'Running'),
+    JOB_FINISHED: _('export_job_finished', default=u'Finished'),
+    JOB_FAILED: _('export_job_failed', default=u'Failed'),
+}
+
+
+def export_job_data(context, request, job):
+    """Return JSON serializable status of export job.
+    """
+    state = job.attrs['state']
+    error = job.attrs['error']
+    # worker died, job gets set failed on next cleanup
+    if export_job_stale(job):
+        state = JOB_FAILED
+        error = EXPORT_JOB_TIMEOUT_ERROR
+    download_url = None
+    if state == JOB_FINISHED:
+        download_url = '%s/@@exportjobdownload?uid=%s' % (
+            context.absolute_url(),
+            job.attrs['uid']
+        )
+    return {
+        'uid': str(job.attrs['uid']),
+        'created': job.attrs['created'].strftime(DT_FORMAT),
+        'state': state,
+        'state_label': translate(JOB_STATE_LABELS[state], context=request),
+        'progress': job.attrs['progress'],
+        'total': job.attrs['total'],
+        'filename': job.attrs['filename'],
+        'error': error,
+        'download_url': download_url,
+    }
+
+
+def export_jobs_for_current_user(context, request):
+    """Return status of export jobs of authenticated user, latest first.
+    """
+    user_id = plone.api.user.get_current().getId()
+    return [
+        export_job_data(context, request, job)
+        for job in get_export_jobs_for(context, user_id)
+    ]
+
+
+class ExportJobBase(BrowserView):
+
+    @property
+    def job(self):
+        """Export job by uid from request. Only the user who submitted the
+        job is allowed to access it.
+        """
+        job = get_export_job(self.context, self.request.get('uid', ''))
+        if job is None:
+            raise NotFound
+        user_id = plone.api.user.get_current().getId()
+        if job.attrs['creator'] != user_id:
+            raise Unauthorized
+        return job
+
+
+class ExportJobView(ExportJobBase):
+    """Export job status page, gets updated by polling
+    ``@@exportjobstatus``.
+    """
+
+    @property
+    def data(self):
+        return export_job_data(self.context, self.request, self.job)
+
+    @property
+    def status_url(self):
+        return '%s/@@exportjobstatus?uid=%s' % (
+            self.context.absolute_url(),
+            self.request.get('uid')
+        )
+
+
+class ExportJobStatus(ExportJobBase):
+
+    def __call__(self):
+        data = export_job_data(self.context, self.request, self.job)
+        self.request.response.setHeader(
+            'Content-Type',
+            'application/json; charset=utf-8'
+        )
+        return json.dumps(data)
+
+
+class ExportJobDownload(ExportJobBase):
+
+    def __call__(self):
+        job = self.job
+        if job.attrs['state'] != JOB_FINISHED:
+            raise NotFound
+        path = job.attrs['blob'].committed()
+        filename = job.attrs['filename']
+        response = self.request.response
+        response.setHeader(
+            'Content-Type',
+            filename.endswith('.gz') and 'application/gzip' or 'text/csv'
+        )
+        response.setHeader(
+            'Content-Disposition',
+            'attachment; filename=%s' % filename
+        )
+        response.setHeader('Content-Length', os.path.getsize(path))
+        return filestream_iterator(path, 'rb')
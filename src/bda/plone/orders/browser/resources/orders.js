@@ -24,6 +24,7 @@
         orders.qr_code_binder(document);
         orders.cancel_confirm_binder(document);
         orders.comment_edit_binder(document);
+        orders.exportjob_binder(document);
     });
 
     var orders = {
@@ -56,10 +57,25 @@
                 $('.filter').hide();
             }
 
-            $('#bdaploneorders', context).dataTable({
+            var table = $('#bdaploneorders', context);
+            table.dataTable({
                 "bProcessing": true,
                 "bServerSide": true,
                 "sAjaxSource": url,
+                "fnServerParams": function (aoData) {
+                    aoData.push({name: 'compact', value: '1'});
+                },
+                "fnServerData": function (sSource, aoData, fnCallback, oSettings) {
+                    oSettings.jqXHR = $.ajax({
+                        dataType: 'json',
+                        url: sSource,
+                        data: aoData,
+                        success: function (json) {
+                            table.data('dropdowns', json.dropdowns || {});
+                            fnCallback(json);
+                        }
+                    });
+                },
                 "sPaginationType": "full_numbers",
                 "oLanguage": {
                     "sUrl": "@@collective.js.datatables.translation"
@@ -67,6 +83,9 @@
                 "aoColumnDefs": [{
                     'bSortable': false,
                     'aTargets': [0]
+                }, {
+                    'mRender': orders.cell_renderer(table),
+                    'aTargets': ['_all']
                 }],
                 "aaSorting": [[1, "desc"]],
                 "oSearch": {"sSearch": hash},
@@ -83,6 +102,10 @@
                              .bind('change', orders.filter_orders);
             $('#input-salaried').unbind('change')
                                 .bind('change', orders.filter_orders);
+            $('#input-total_from').unbind('change')
+                                  .bind('change', orders.filter_orders);
+            $('#input-total_to').unbind('change')
+                                .bind('change', orders.filter_orders);
         },
 
         cancel_confirm_binder: function(context) {
@@ -169,6 +192,9 @@
             if (!$('#orders_wrapper').length) {
                 selector = '#bookings_wrapper';
                 target.params.group_by = $('#input-group_by').val();
+            } else {
+                target.params.total_from = $('#input-total_from', wrapper).val();
+                target.params.total_to = $('#input-total_to', wrapper).val();
             }
 
             bdajax.action({
@@ -253,7 +279,8 @@
             // that match the given email
             var hash = window.location.hash.substring(1);
             var oTable;
-            oTable = $('#bdaplonebookings', context).DataTable({
+            var table = $('#bdaplonebookings', context);
+            oTable = table.DataTable({
                 "sort": false,
                 "dom": 'l<"customfilter">frtip',
                 "processing": true,
@@ -268,8 +295,13 @@
                             "salaried": $('#input-salaried').val(),
                             "group_by": $('#input-group_by').val(),
                             "from_date": $('#input-from_date').val(),
-                            "to_date": $('#input-to_date').val()
+                            "to_date": $('#input-to_date').val(),
+                            "compact": 1
                         });
+                    },
+                    "dataSrc": function (json) {
+                        table.data('dropdowns', json.dropdowns || {});
+                        return json.data;
                     }
                 },
                 "paginationType": "full_numbers",
@@ -285,6 +317,10 @@
                     {
                         'visible': false,
                         'targets': [0, 1, 11, 12]  // hide Email, buyable_uid, bookings_quantity, bookings_total_sum
+                    },
+                    {
+                        'render': orders.cell_renderer(table),
+                        'targets': '_all'
                     }
                 ],
 
@@ -369,6 +405,56 @@
             });
         },
 
+        escape_html: function (value) {
+            return $('<div />').text(value === null ? '' : String(value)).html()
+                               .replace(/"/g, '&quot;');
+        },
+
+        // render cell data, dropdowns are delivered as data in compact mode.
+        cell_renderer: function (table) {
+            return function (data) {
+                if (data && data.dropdown) {
+                    var definitions = table.data('dropdowns') || {};
+                    var definition = definitions[data.dropdown];
+                    if (definition) {
+                        return orders.render_dropdown(data, definition);
+                    }
+                }
+                return data;
+            };
+        },
+
+        // client side counterpart of dropdown.pt
+        render_dropdown: function (data, definition) {
+            var esc = orders.escape_html;
+            var value = data.value === null ? '' : data.value;
+            var title = esc(definition.values[value] || '-/-');
+            var id = definition.name + '-' + data.uid;
+            var html = '<div id="' + esc(id) + '">';
+            if (!data.transitions.length) {
+                html += '<strong class="' + esc(definition.name + '-dropdown-' + value) + '">';
+                html += title + '</strong></div>';
+                return html;
+            }
+            var action = definition.action + ':#' + id + ':replace';
+            html += '<div class="' + esc(definition.css) + '">';
+            html += '<div class="dropdown_header">';
+            html += '<strong class="' + esc(definition.name + '-value-' + value) + '">';
+            html += title + '</strong></div>';
+            html += '<ul class="dropdown_items" style="display:none;">';
+            $.each(data.transitions, function (idx, transition) {
+                var target = definition.url
+                    .replace('{uid}', encodeURIComponent(data.uid))
+                    .replace('{transition}', encodeURIComponent(transition));
+                html += '<li><a href="" ajax:bind="click"';
+                html += ' ajax:action="' + esc(action) + '"';
+                html += ' ajax:target="' + esc(target) + '">';
+                html += esc(definition.transitions[transition]) + '</a></li>';
+            });
+            html += '</ul></div></div>';
+            return html;
+        },
+
         dropdown_binder: function (context) {
             var options = {
                 menu: '.dropdown_items',
@@ -385,6 +471,42 @@
 
             sel = '.change_booking_state_dropdown';
             $(sel, context).ordersdropdownmenu(options);
+        },
+
+        // poll export job status until job is finished or failed
+        exportjob_binder: function (context) {
+            var elem = $('.exportjob', context);
+            if (!elem.length) {
+                return;
+            }
+            var url = elem.data('statusurl');
+            var poll = function (state) {
+                if (state !== 'pending' && state !== 'running') {
+                    return;
+                }
+                setTimeout(function () {
+                    $.ajax({
+                        url: url,
+                        dataType: 'json',
+                        cache: false,
+                        success: function (data) {
+                            $('.exportjob-state', elem).text(data.state_label);
+                            $('.exportjob-progress', elem).text(data.progress);
+                            $('.exportjob-total', elem).text(data.total);
+                            if (data.error) {
+                                $('.exportjob-error', elem).text(data.error);
+                            }
+                            if (data.download_url) {
+                                $('.exportjob-download', elem)
+                                    .attr('href', data.download_url)
+                                    .show();
+                            }
+                            poll(data.state);
+                        }
+                    });
+                }, 3000);
+            };
+            poll(elem.data('state'));
         }
     };
 
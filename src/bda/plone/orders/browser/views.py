@@ -13,6 +13,7 @@ from bda.plone.orders import message_factory as _
 from bda.plone.orders import permissions
 from bda.plone.orders import vocabularies as vocabs
 from bda.plone.orders.browser.dropdown import BaseDropdown
+from bda.plone.orders.browser.dropdown import dropdown_definitions
 from bda.plone.orders.common import BookingData
 from bda.plone.orders.common import DT_FORMAT
 from bda.plone.orders.common import OrderData
@@ -20,15 +21,20 @@ from bda.plone.orders.common import booking_update_comment
 from bda.plone.orders.common import get_orders_soup
 from bda.plone.orders.common import get_vendor_by_uid
 from bda.plone.orders.common import get_vendor_uids_for
-from bda.plone.orders.common import get_vendors_for
-from bda.plone.orders.interfaces import IBuyable
+from bda.plone.orders.transitions import do_bulk_transition
 from bda.plone.orders.transitions import do_transition_for
 from bda.plone.orders.transitions import transitions_of_main_state
 from bda.plone.orders.transitions import transitions_of_salaried_state
+from decimal import Decimal
+from functools import partial
+from itertools import islice
 from plone.memoize import view
+from plone.uuid.interfaces import IUUID
 from repoze.catalog.query import Any
 from repoze.catalog.query import Contains
 from repoze.catalog.query import Eq
+from repoze.catalog.query import Ge
+from repoze.catalog.query import Le
 from souper.soup import LazyRecord
 from souper.soup import get_soup
 from yafowil.base import factory
@@ -39,6 +45,8 @@ from zExceptions import Redirect
 from zope.i18n import translate
 from zope.i18nmessageid import Message
 from zope.security import checkPermission
+import base64
+import datetime
 import json
 import pkg_resources
 import plone.api
@@ -101,9 +109,8 @@ class OrderStateDropdown(OrderDropdown):
         return self.order_data.state
 
     @property
-    def items(self):
-        transitions = transitions_of_main_state(self.value)
-        return self.create_items(transitions)
+    def available_transitions(self):
+        return transitions_of_main_state(self.value)
 
 
 class OrderSalariedDropdown(OrderDropdown):
@@ -118,9 +125,8 @@ class OrderSalariedDropdown(OrderDropdown):
         return self.order_data.salaried or ifaces.SALARIED_NO
 
     @property
-    def items(self):
-        transitions = transitions_of_salaried_state(self.value)
-        return self.create_items(transitions)
+    def available_transitions(self):
+        return transitions_of_salaried_state(self.value)
 
 
 class Transition(BrowserView):
@@ -174,9 +180,96 @@ class OrderSalariedTransition(OrderTransition):
     dropdown = OrderSalariedDropdown
 
 
+class BulkTransition(Transition):
+    """Do transition for many orders and bookings at once.
+
+    Expects ``transition`` and ``order_uids`` and/or ``booking_uids`` on
+    request. Returns number of modified orders and bookings as JSON.
+    """
+
+    def _uids(self, name):
+        uids = self.request.form.get(name, [])
+        if isinstance(uids, basestring):
+            uids = [uids]
+        return [uid for uid in uids if uid]
+
+    def __call__(self):
+        transition = self.request.form.get('transition')
+        order_uids = self._uids('order_uids')
+        booking_uids = self._uids('booking_uids')
+        if not transition or not (order_uids or booking_uids):
+            raise BadRequest('value not given')
+        vendor_uids = self.vendor_uids
+        try:
+            orders, bookings = do_bulk_transition(
+                self.context,
+                transition,
+                order_uids=order_uids,
+                booking_uids=booking_uids,
+                request=self.request,
+                vendor_uids=vendor_uids
+            )
+        except ValueError:
+            raise BadRequest('something is wrong with the value')
+        self.request.response.setHeader('Content-type', 'application/json')
+        return json.dumps({
+            'orders': len(orders),
+            'bookings': len(bookings),
+        })
+
+
+def compact_mode(request):
+    """Flag whether table data is requested in compact mode. In compact mode
+    dropdowns are delivered as data and rendered on client side.
+    """
+    return bool(request.form.get('compact'))
+
+
+def record_attr(colname, record):
+    """Default column value extractor. Return attribute of record.
+    """
+    return record.attrs.get(colname, '')
+
+
+def compile_columns(columns, extractors={}):
+    """Compile column definitions to a column plan.
+
+    The column plan is a tuple of callables, one per column, each expecting
+    the record and returning the column value. Column renderers are bound to
+    their column name. Columns without renderer use the extractor registered
+    in ``extractors`` for the column ``origin`` or ``record_attr``.
+
+    Compile the plan once per request and render rows with::
+
+        [extract(record) for extract in plan]
+    """
+    plan = list()
+    for column in columns:
+        extractor = column.get('renderer')
+        if not extractor:
+            extractor = extractors.get(column.get('origin'), record_attr)
+        plan.append(partial(extractor, column['id']))
+    return tuple(plan)
+
+
+class ResultWindow(object):
+    """Lazy records of requested page, already sliced by query.
+    """
+
+    def __init__(self, soup, iids):
+        self.soup = soup
+        self.iids = iids
+
+    def __iter__(self):
+        for iid in self.iids:
+            yield LazyRecord(iid, self.soup)
+
+
 class TableData(BrowserView):
     soup_name = None
     search_text_index = None
+    # dropdown classes rendered on client side in compact mode
+    dropdowns = ()
 
     @property
     def columns(self):
@@ -206,27 +299,44 @@ class TableData(BrowserView):
         sortparams['reverse'] = self.request.form.get('sSortDir_0') == 'desc'
         return sortparams
 
-    def all(self, soup):
-        data = soup.storage.data
+    def window(self):
+        """Return 2-tuple with start and end of requested page. End is None
+        if all records are requested.
+        """
+        start = int(self.request.form['iDisplayStart'])
+        length = int(self.request.form['iDisplayLength'])
+        if length < 0:
+            return start, None
+        return start, start + length
+
+    def sorted_window(self, soup, iids):
+        """Sort iids and return lazy records of requested page.
+
+        Sort index only sorts up to the end of requested page, thus deep pages
+        do not need to sort and skip all preceding records.
+        """
         sort = self.sort()
         sort_index = soup.catalog[sort['index']]
-        iids = sort_index.sort(data.keys(), reverse=sort['reverse'])
+        start, end = self.window()
+        iids = sort_index.sort(iids, reverse=sort['reverse'], limit=end)
+        return ResultWindow(soup, islice(iids, start, end))
+
+    def lazy(self, soup, query):
+        """Return 2-tuple with result length and lazy records of requested
+        page for query.
+        """
+        length, iids = soup.catalog.query(query)
+        return length, self.sorted_window(soup, iids)
 
-        def lazyrecords():
-            for iid in iids:
-                yield LazyRecord(iid, soup)
-        return soup.storage.length.value, lazyrecords()
+    def all(self, soup):
+        data = soup.storage.data
+        return soup.storage.length.value, self.sorted_window(soup, data.keys())
 
     def slice(self, fullresult):
-        start = int(self.request.form['iDisplayStart'])
-        length = int(self.request.form['iDisplayLength'])
-        count = 0
-        for lr in fullresult:
-            if count >= start and count < (start + length):
-                yield lr
-            if count >= (start + length):
-                break
-            count += 1
+        if isinstance(fullresult, ResultWindow):
+            return iter(fullresult)
+        start, end = self.window()
+        return islice(fullresult, start, end)
 
     def column_def(self, colname):
         for column in self.columns:
@@ -237,29 +347,22 @@ class TableData(BrowserView):
         soup = get_soup(self.soup_name, self.context)
         aaData = list()
         length, lazydata = self.query(soup)
-        columns = self.columns
-        colnames = [_['id'] for _ in columns]
-        # todo json response header einbaun
-
-        def record2list(record):
-            result = list()
-            for colname in colnames:
-                coldef = self.column_def(colname)
-                renderer = coldef.get('renderer')
-                if renderer:
-                    value = renderer(colname, record)
-                else:
-                    value = record.attrs.get(colname, '')
-                result.append(value)
-            return result
+        plan = compile_columns(self.columns)
         for lazyrecord in self.slice(lazydata):
-            aaData.append(record2list(lazyrecord()))
+            record = lazyrecord()
+            aaData.append([extract(record) for extract in plan])
         data = {
             "sEcho": int(self.request.form['sEcho']),
             "iTotalRecords": soup.storage.length.value,
             "iTotalDisplayRecords": length,
             "aaData": aaData,
         }
+        if compact_mode(self.request):
+            data['dropdowns'] = dropdown_definitions(
+                self.context,
+                self.request,
+                self.dropdowns
+            )
         self.request.response.setHeader("Content-type", "application/json")
         return json.dumps(data)
 
@@ -275,7 +378,7 @@ class OrdersView(OrdersViewBase):
 
     def __call__(self):
         # check if authenticated user is vendor
-        if not get_vendors_for():
+        if not get_vendor_uids_for():
             raise Unauthorized
         return super(OrdersView, self).__call__()
 
@@ -319,6 +422,12 @@ class OrdersTableBase(BrowserView):
             value = value.strftime(DT_FORMAT)
         return value
 
+    def render_total(self, colname, record):
+        value = record.attrs.get(colname)
+        if value is None:
+            return '-/-'
+        return ascur(value)
+
     @property
     def ajaxurl(self):
         return u'{0}/{1}'.format(
@@ -349,6 +458,10 @@ class OrdersTableBase(BrowserView):
         }, {
             'id': 'billing_address.city',
             'label': _('city', default=u'City'),
+        }, {
+            'id': 'total',
+            'label': _('total', default=u'Total'),
+            'renderer': self.render_total,
         }, {
             'id': 'salaried',
             'label': _('salaried', default=u'Salaried'),
@@ -381,6 +494,7 @@ def salaried_form_vocab():
 
 
 class OrdersTable(OrdersTableBase):
+    dropdowns = (OrderStateDropdown, OrderSalariedDropdown)
 
     def render_filter(self):
         # vendor areas of current user
@@ -438,6 +552,28 @@ class OrdersTable(OrdersTableBase):
             }
         )
 
+        total_from = factory(
+            'div:label:text',
+            name='total_from',
+            value=self.request.form.get('total_from', ''),
+            props={
+                'div.class': 'total_from_filter',
+                'label': _('filter_total_from',
+                           default=u'Filter total from'),
+            }
+        )
+
+        total_to = factory(
+            'div:label:text',
+            name='total_to',
+            value=self.request.form.get('total_to', ''),
+            props={
+                'div.class': 'total_to_filter',
+                'label': _('filter_total_to',
+                           default=u'Filter total to'),
+            }
+        )
+
         # concatenate filters
         filter_widgets = ''
         if vendor_selector:
@@ -447,6 +583,8 @@ class OrdersTable(OrdersTableBase):
 
         filter_widgets += state_selector(request=self.request)
         filter_widgets += salaried_selector(request=self.request)
+        filter_widgets += total_from(request=self.request)
+        filter_widgets += total_to(request=self.request)
 
         return filter_widgets
 
@@ -520,22 +658,20 @@ class OrdersTable(OrdersTableBase):
             salaried = OrderData(self.context, order=record).salaried
             return translate(vocabs.salaried_vocab()[salaried],
                              context=self.request)
-        return OrderSalariedDropdown(
-            self.context,
-            self.request,
-            record
-        ).render()
+        dropdown = OrderSalariedDropdown(self.context, self.request, record)
+        if compact_mode(self.request):
+            return dropdown.data()
+        return dropdown.render()
 
     def render_state(self, colname, record):
         if not self.check_modify_order(record):
             state = OrderData(self.context, order=record).state
             return translate(vocabs.state_vocab()[state],
                              context=self.request)
-        return OrderStateDropdown(
-            self.context,
-            self.request,
-            record
-        ).render()
+        dropdown = OrderStateDropdown(self.context, self.request, record)
+        if compact_mode(self.request):
+            return dropdown.data()
+        return dropdown.render()
 
     @property
     def ajaxurl(self):
@@ -544,6 +680,8 @@ class OrdersTable(OrdersTableBase):
             ('customer', self.request.form.get('customer')),
             ('state', self.request.form.get('state')),
             ('salaried', self.request.form.get('salaried')),
+            ('total_from', self.request.form.get('total_from')),
+            ('total_to', self.request.form.get('total_to')),
         ]
         query = urllib.urlencode(dict([it for it in params if it[1]]))
         query = query and u'?{0}'.format(query) or ''
@@ -555,7 +693,7 @@ class OrdersTable(OrdersTableBase):
 
     def __call__(self):
         # check if authenticated user is vendor
-        if not get_vendors_for():
+        if not get_vendor_uids_for():
             raise Unauthorized
         # disable diazo theming if ajax call
         if '_' in self.request.form:
@@ -592,12 +730,14 @@ class OrdersData(OrdersTable, TableData):
     soup_name = 'bda_plone_orders_orders'
     search_text_index = 'text'
 
-    def _get_buyables_in_context(self):
-        catalog = plone.api.portal.get_tool("portal_catalog")
-        path = '/'.join(self.context.getPhysicalPath())
-        brains = catalog(path=path, object_provides=IBuyable.__identifier__)
-        for brain in brains:
-            yield brain.UID
+    def _total_value(self, name):
+        value = self.request.form.get(name, '').strip().replace(',', '.')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return None
 
     def query(self, soup):
         # fetch user vendor uids
@@ -628,25 +768,27 @@ class OrdersData(OrdersTable, TableData):
         if salaried:
             query = query & Eq('salaried', salaried)
 
+        # Filter by total range if given
+        total_from = self._total_value('total_from')
+        if total_from is not None:
+            query = query & Ge('total', total_from)
+        total_to = self._total_value('total_to')
+        if total_to is not None:
+            query = query & Le('total', total_to)
+
         # filter by search term if given
         term = self.request.form['sSearch'].decode('utf-8')
         if term:
             # append * for proper fulltext search
             term += '*'
             query = query & Contains(self.search_text_index, term)
-        # get buyable uids for given context, get all buyables on site root
-        # use explicit IPloneSiteRoot to make it play nice with lineage
+        # filter by orders containing buyables inside given context, get all
+        # orders on site root. use explicit IPloneSiteRoot to make it play
+        # nice with lineage
         if not IPloneSiteRoot.providedBy(self.context):
-            buyable_uids = self._get_buyables_in_context()
-            query = query & Any('buyable_uids', buyable_uids)
+            query = query & Any('container_uids', [IUUID(self.context)])
         # query orders and return result
-        sort = self.sort()
-        res = soup.lazy(query,
-                        sort_index=sort['index'],
-                        reverse=sort['reverse'],
-                        with_size=True)
-        length = res.next()
-        return length, res
+        return self.lazy(soup, query)
 
 
 class MyOrdersData(MyOrdersTable, TableData):
@@ -662,13 +804,169 @@ class MyOrdersData(MyOrdersTable, TableData):
             term += '*'
             query = query & Contains(self.search_text_index, term)
         # query orders and return result
-        sort = self.sort()
-        res = soup.lazy(query,
-                        sort_index=sort['index'],
-                        reverse=sort['reverse'],
-                        with_size=True)
-        length = res.next()
-        return length, res
+        return self.lazy(soup, query)
+
+
+# order attributes contained in ``OrdersCursorData`` result
+CURSOR_ORDER_ATTRS = [
+    'uid',
+    'ordernumber',
+    'created',
+    'creator',
+    'state',
+    'salaried',
+    'vendor_uids',
+    'personal_data.email',
+    'personal_data.firstname',
+    'personal_data.lastname',
+    'net',
+    'vat',
+    'total',
+]
+
+CURSOR_DT_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def json_value(value):
+    """Convert order attribute value to JSON serializable value.
+    """
+    if isinstance(value, (list, tuple, set)):
+        return [json_value(val) for val in value]
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, (uuid.UUID, Decimal)):
+        return str(value)
+    return value
+
+
+class OrdersCursorData(BrowserView):
+    """JSON orders listing paged by cursor.
+
+    Orders are returned ordered by creation date. Each page contains an
+    opaque ``cursor`` which is passed to request the next page. Paging resumes
+    directly on the ``created`` index, thus the cost of a request does not
+    depend on the page position, and orders created while paging get appended
+    at the end instead of shifting pages. If filtered by vendor, order ids of
+    the vendors are collected once per request from ``vendor_uids`` index and
+    intersected with the ``created`` index buckets.
+
+    Request parameters:
+
+    ``cursor``
+        Cursor returned by previous page. Omit to start from first order.
+
+    ``limit``
+        Number of orders per page.
+
+    ``vendor``
+        Optional vendor uid to filter orders.
+    """
+    default_limit = 100
+    max_limit = 1000
+
+    def encode_cursor(self, created, docid):
+        cursor = json.dumps([created.strftime(CURSOR_DT_FORMAT), docid])
+        return base64.urlsafe_b64encode(cursor)
+
+    def decode_cursor(self, cursor):
+        try:
+            created, docid = json.loads(base64.urlsafe_b64decode(cursor))
+            created = datetime.datetime.strptime(created, CURSOR_DT_FORMAT)
+            return created, int(docid)
+        except (TypeError, ValueError):
+            raise BadRequest('invalid cursor')
+
+    @property
+    def limit(self):
+        try:
+            limit = int(self.request.form.get('limit', self.default_limit))
+        except ValueError:
+            raise BadRequest('invalid limit')
+        return max(1, min(limit, self.max_limit))
+
+    @property
+    def vendor_uids(self):
+        vendor_uids = get_vendor_uids_for()
+        vendor_uid = self.request.form.get('vendor')
+        if vendor_uid:
+            try:
+                vendor_uid = uuid.UUID(vendor_uid)
+            except ValueError:
+                raise BadRequest(u'Invalid vendor: {0}'.format(vendor_uid))
+            if vendor_uid not in vendor_uids:
+                raise Unauthorized
+            return set([vendor_uid])
+        return set(vendor_uids)
+
+    def vendor_docids(self, soup, vendor_uids):
+        """Return set of order docids of vendors or None if orders of all
+        vendors are included.
+        """
+        vendor_index = soup.catalog['vendor_uids']
+        fwd_index = vendor_index._fwd_index
+        if vendor_uids.issuperset(fwd_index.keys()):
+            return None
+        return vendor_index.family.IF.multiunion([
+            fwd_index[vendor_uid] for vendor_uid in vendor_uids
+            if vendor_uid in fwd_index
+        ])
+
+    def docids(self, soup, cursor, vendor_docids=None):
+        """Iterate 2-tuples of created value and docid in creation order,
+        starting after cursor.
+
+        If ``vendor_docids`` is given, each ``created`` bucket gets
+        intersected with it.
+        """
+        created_index = soup.catalog['created']
+        fwd_index = created_index._fwd_index
+        intersection = created_index.family.IF.intersection
+
+        def bucket(docids):
+            if vendor_docids is None:
+                return docids
+            return intersection(docids, vendor_docids)
+
+        if cursor:
+            created, docid = cursor
+            docids = fwd_index.get(created)
+            if docids is not None:
+                for iid in bucket(docids):
+                    if iid > docid:
+                        yield created, iid
+            items = fwd_index.items(min=created, excludemin=True)
+        else:
+            items = fwd_index.items()
+        for created, docids in items:
+            for iid in bucket(docids):
+                yield created, iid
+
+    def __call__(self):
+        cursor = self.request.form.get('cursor')
+        if cursor:
+            cursor = self.decode_cursor(cursor)
+        limit = self.limit
+        soup = get_orders_soup(self.context)
+        vendor_docids = self.vendor_docids(soup, self.vendor_uids)
+        orders = list()
+        last = None
+        for created, docid in self.docids(soup, cursor, vendor_docids):
+            record = soup.get(docid)
+            orders.append(dict(
+                (name, json_value(record.attrs.get(name)))
+                for name in CURSOR_ORDER_ATTRS
+            ))
+            last = (created, docid)
+            if len(orders) == limit:
+                break
+        next_cursor = None
+        if len(orders) == limit:
+            next_cursor = self.encode_cursor(*last)
+        self.request.response.setHeader('Content-type', 'application/json')
+        return json.dumps({
+            'orders': orders,
+            'cursor': next_cursor,
+        })
 
 
 class OrderViewBase(BrowserView):
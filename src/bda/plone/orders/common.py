@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 from Acquisition import aq_inner
 from Acquisition import aq_parent
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
 from Products.CMFPlone.interfaces import IPloneSiteRoot
+from ZODB.POSException import ConflictError
 from bda.plone.cart import extractitems
-from bda.plone.cart import get_catalog_brain
 from bda.plone.cart import get_data_provider
 from bda.plone.cart import get_item_data_provider
 from bda.plone.cart import get_item_state
@@ -19,6 +21,7 @@ from bda.plone.orders import permissions
 from bda.plone.orders import safe_encode
 from bda.plone.orders.interfaces import IBuyable
 from bda.plone.orders.interfaces import IVendor
+from bda.plone.orders.stock import change_item_stock
 from bda.plone.payment import Payments
 from bda.plone.payment.interfaces import IPaymentData
 from bda.plone.shipping import Shippings
@@ -26,6 +29,8 @@ from bda.plone.shipping.interfaces import IShippingItem
 from decimal import Decimal
 from node.ext.zodb import OOBTNode
 from node.utils import instance_property
+from plone.memoize import ram
+from plone.memoize.volatile import DontCache
 from plone.uuid.interfaces import IUUID
 from repoze.catalog.catalog import Catalog
 from repoze.catalog.indexes.field import CatalogFieldIndex
@@ -38,6 +43,8 @@ from souper.soup import NodeAttributeIndexer
 from souper.soup import NodeTextIndexer
 from souper.soup import Record
 from souper.soup import get_soup
+from zope.annotation import IAnnotations
+from zope.component import getAdapter
 from zope.component import queryAdapter
 from zope.event import notify
 from zope.interface import implementer
@@ -45,6 +52,7 @@ import datetime
 import logging
 import plone.api
 import time
+import transaction
 import uuid
 
 
@@ -52,6 +60,8 @@ logger = logging.getLogger('bda.plone.checkout')
 
 
 DT_FORMAT = '%d.%m.%Y %H:%M'
+VENDOR_PERMISSIONS_COUNTER_KEY = 'bda.plone.orders.vendor_permissions_counter'
+EXPORT_WATERMARKS_KEY = 'bda.plone.orders.export_watermarks'
 
 
 def create_ordernumber():
@@ -141,17 +151,81 @@ def get_vendors_for(user=None):
     return [vendor for vendor in get_all_vendors() if permitted(vendor)]
 
 
+def create_vendor_permissions_counter(portal):
+    """Create counter of local role changes on site root if inexistent.
+
+    Called on install and upgrade, thus reading the counter does not write
+    to the database.
+
+    :returns: Conflict resolving counter.
+    :rtype: BTrees.Length.Length
+    """
+    annotations = IAnnotations(portal)
+    if VENDOR_PERMISSIONS_COUNTER_KEY not in annotations:
+        annotations[VENDOR_PERMISSIONS_COUNTER_KEY] = Length()
+    return annotations[VENDOR_PERMISSIONS_COUNTER_KEY]
+
+
+def get_vendor_permissions_counter():
+    """Return counter of local role changes stored on site root.
+
+    :returns: Conflict resolving counter or ``None`` if not created yet.
+    :rtype: BTrees.Length.Length
+    """
+    annotations = IAnnotations(plone.api.portal.get())
+    return annotations.get(VENDOR_PERMISSIONS_COUNTER_KEY)
+
+
+def invalidate_vendor_uids_cache():
+    """Invalidate cached vendor uids of all users.
+    """
+    create_vendor_permissions_counter(plone.api.portal.get()).change(1)
+
+
+def _vendor_uids_cache_key(fun, user):
+    catalog = plone.api.portal.get_tool('portal_catalog')
+    catalog_counter = getattr(catalog, 'getCounter', None)
+    if catalog_counter is None:
+        raise DontCache
+    # counter gets created on install or upgrade
+    permissions_counter = get_vendor_permissions_counter()
+    if permissions_counter is None:
+        raise DontCache
+    portal = plone.api.portal.get()
+    get_groups = getattr(user, 'getGroups', None)
+    return (
+        '/'.join(portal.getPhysicalPath()),
+        user.getId(),
+        tuple(sorted(user.getRoles())),
+        tuple(sorted(get_groups() if get_groups else [])),
+        catalog_counter(),
+        permissions_counter(),
+    )
+
+
+@ram.cache(_vendor_uids_cache_key)
+def _get_vendor_uids_for(user):
+    return tuple(
+        uuid.UUID(IUUID(vendor)) for vendor in get_vendors_for(user=user)
+    )
+
+
 def get_vendor_uids_for(user=None):
     """Gel all vendor container uids a given or authenticated user has vendor
     permissions for.
 
+    Result is cached per user. Cache gets invalidated if portal catalog or
+    local roles change.
+
     :param user: Optional user object to check permissions on vendor areas. If
                  no user object is give, the current user is used.
     :type user: MemberData object
     :returns: Allowed vendor area uids for given or authenticated member.
     :rtype: List of uuid.UUID objects.
     """
-    return [uuid.UUID(IUUID(vendor)) for vendor in get_vendors_for(user=user)]
+    if user is None:
+        user = plone.api.user.get_current()
+    return list(_get_vendor_uids_for(user))
 
 
 # TODO: used in vocabularies, remove if possible
@@ -172,6 +246,224 @@ def get_vendor_order_uids_for(context, user=None):
     return order_uids
 
 
+def get_container_uids(obj):
+    """Get uids of object and all its containers up to site root.
+
+    :param obj: Content object.
+    :type obj: Content instance
+    :returns: Uids ordered from object to outermost container, site root
+              excluded.
+    :rtype: List of strings
+    """
+    uids = list()
+    obj = aq_inner(obj)
+    while obj is not None and not IPloneSiteRoot.providedBy(obj):
+        uid = IUUID(obj, None)
+        if uid:
+            uids.append(uid)
+        obj = aq_parent(obj)
+    return uids
+
+
+def calculate_order_container_uids(bookings):
+    """Get container uids of all bookings of an order.
+    """
+    container_uids = set()
+    for booking in bookings:
+        container_uids.update(booking.attrs.get('container_uids', []))
+    return list(container_uids)
+
+
+def update_container_uids(context, uid, container_uids):
+    """Update container uids of bookings and orders after content object
+    has been moved.
+
+    :param context: Context to work with
+    :type object: Plone or Content instance
+    :param uid: Uid of moved object.
+    :type uid: string
+    :param container_uids: Container uids of new location of moved object.
+    :type container_uids: List of strings
+    """
+    bookings_soup = get_bookings_soup(context)
+    bookings = list(bookings_soup.query(Any('container_uids', [uid])))
+    if not bookings:
+        return
+    for booking in bookings:
+        old_uids = booking.attrs['container_uids']
+        # uids inside moved object are unchanged
+        new_uids = old_uids[:old_uids.index(uid) + 1] + container_uids
+        # XXX: currently we need to delete attributes before setting to a new
+        #      value in order to persist change. fix in appropriate place.
+        del booking.attrs['container_uids']
+        booking.attrs['container_uids'] = new_uids
+    bookings_soup.reindex(records=bookings)
+    order_uids = set(booking.attrs['order_uid'] for booking in bookings)
+    order_bookings = dict()
+    for booking in bookings_soup.query(Any('order_uid', list(order_uids))):
+        order_bookings.setdefault(
+            booking.attrs['order_uid'], list()).append(booking)
+    orders_soup = get_orders_soup(context)
+    orders = list(orders_soup.query(Any('uid', list(order_uids))))
+    for order in orders:
+        if 'container_uids' in order.attrs:
+            del order.attrs['container_uids']
+        order.attrs['container_uids'] = calculate_order_container_uids(
+            order_bookings.get(order.attrs['uid'], []))
+    orders_soup.reindex(records=orders)
+
+
+# number of bookings marked exported between two savepoints
+EXPORTED_SAVEPOINT_SIZE = 1000
+
+# number of attempts to commit changes which cannot be retried by publisher
+COMMIT_ATTEMPTS = 3
+
+
+def mark_bookings_exported(bookings_soup, docids,
+                           savepoint_size=EXPORTED_SAVEPOINT_SIZE):
+    """Set exported flag on bookings and update ``exported`` index.
+
+    Only ``exported`` index gets updated instead of reindexing bookings in all
+    indexes. A savepoint is created after each ``savepoint_size`` bookings
+    and the ZODB cache gets garbage collected, thus marking large exports
+    does not keep all modified bookings in memory.
+
+    :param bookings_soup: Bookings soup.
+    :type bookings_soup: souper.soup.Soup
+    :param docids: Record ids of exported bookings.
+    :type docids: iterable of int
+    :returns: Number of bookings marked exported.
+    :rtype: int
+    """
+    index = bookings_soup.catalog['exported']
+    jar = bookings_soup.storage._p_jar
+    count = 0
+    for docid in docids:
+        booking = bookings_soup.get(docid)
+        if booking.attrs.get('exported'):
+            continue
+        booking.attrs['exported'] = True
+        index.reindex_doc(docid, booking)
+        count += 1
+        if count % savepoint_size == 0:
+            transaction.savepoint(optimistic=True)
+            if jar is not None:
+                jar.cacheGC()
+    return count
+
+
+def commit_retrying(func, attempts=COMMIT_ATTEMPTS):
+    """Call ``func`` and commit transaction.
+
+    On ``ConflictError`` the transaction gets aborted and ``func`` is called
+    again, at most ``attempts`` times. Used where the publisher cannot retry
+    the request, i.e. after an export has been streamed to the response, and
+    by the export job worker. ``func`` must apply all changes to commit,
+    since they get discarded on abort.
+
+    :raises: ``ConflictError`` if last attempt fails.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            func()
+            transaction.commit()
+            return
+        except ConflictError:
+            transaction.abort()
+            if attempt == attempts:
+                raise
+            logger.info(
+                u"Conflict while committing, attempt {0} of {1}.".format(
+                    attempt, attempts)
+            )
+
+
+def get_export_watermarks():
+    """Return watermarks of incremental exports stored on site root. Create
+    if inexistent.
+
+    :returns: Mapping of vendor uid string to datetime of last incremental
+              export.
+    :rtype: BTrees.OOBTree.OOBTree
+    """
+    annotations = IAnnotations(plone.api.portal.get())
+    if EXPORT_WATERMARKS_KEY not in annotations:
+        annotations[EXPORT_WATERMARKS_KEY] = OOBTree()
+    return annotations[EXPORT_WATERMARKS_KEY]
+
+
+def get_export_watermark(vendor_uid):
+    """Return datetime of last incremental export for vendor or ``None``.
+
+    Watermarks storage does not get created on read.
+    """
+    annotations = IAnnotations(plone.api.portal.get())
+    watermarks = annotations.get(EXPORT_WATERMARKS_KEY)
+    if watermarks is None:
+        return None
+    return watermarks.get(str(vendor_uid))
+
+
+def set_export_watermark(vendor_uid, watermark):
+    """Set datetime of last incremental export for vendor.
+    """
+    get_export_watermarks()[str(vendor_uid)] = watermark
+
+
+class BuyableResolver(object):
+    """Resolve catalog brains and objects of buyables by uid.
+
+    All uids passed to ``resolve`` are fetched with one ``portal_catalog``
+    query, and each buyable object gets woken up at most once. Uids which are
+    not found in catalog resolve to ``None``.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self._brains = dict()
+        self._objects = dict()
+
+    def _key(self, uid):
+        # catalog stores uids in hex representation
+        if isinstance(uid, uuid.UUID):
+            return uid.hex
+        return str(uid)
+
+    def resolve(self, uids):
+        """Fetch catalog brains for all given and not yet resolved uids.
+
+        :param uids: Buyable uids.
+        :type uids: Iterable of strings or uuid.UUID objects
+        """
+        uids = set(self._key(uid) for uid in uids if uid)
+        uids = [uid for uid in uids if uid not in self._brains]
+        if not uids:
+            return
+        cat = plone.api.portal.get_tool('portal_catalog')
+        for brain in cat(UID=uids):
+            self._brains[brain.UID] = brain
+        for uid in uids:
+            self._brains.setdefault(uid, None)
+
+    def brain(self, uid):
+        """Return catalog brain for uid or ``None``.
+        """
+        uid = self._key(uid)
+        if uid not in self._brains:
+            self.resolve([uid])
+        return self._brains[uid]
+
+    def object(self, uid):
+        """Return buyable object for uid or ``None``.
+        """
+        uid = self._key(uid)
+        if uid not in self._objects:
+            brain = self.brain(uid)
+            self._objects[uid] = brain.getObject() if brain else None
+        return self._objects[uid]
+
+
 @implementer(ICatalogFactory)
 class BookingsCatalogFactory(object):
 
@@ -199,6 +491,10 @@ class BookingsCatalogFactory(object):
         catalog[u'state'] = CatalogFieldIndex(state_indexer)
         salaried_indexer = NodeAttributeIndexer('salaried')
         catalog[u'salaried'] = CatalogFieldIndex(salaried_indexer)
+        # uids of buyable and its containers, used for contextual filtering
+        container_uids_indexer = NodeAttributeIndexer('container_uids')
+        catalog[u'container_uids'] = \
+            CatalogKeywordIndex(container_uids_indexer)
         search_attributes = [
             'email',
             'title'
@@ -252,6 +548,13 @@ class OrdersCatalogFactory(object):
         # salaried on order only used for sorting in orders table
         salaried_indexer = NodeAttributeIndexer('salaried')
         catalog[u'salaried'] = CatalogFieldIndex(salaried_indexer)
+        # total on order used for sorting and filtering in orders table
+        total_indexer = NodeAttributeIndexer('total')
+        catalog[u'total'] = CatalogFieldIndex(total_indexer)
+        # uids of buyables and their containers, used for contextual filtering
+        container_uids_indexer = NodeAttributeIndexer('container_uids')
+        catalog[u'container_uids'] = \
+            CatalogKeywordIndex(container_uids_indexer)
         return catalog
 
 
@@ -269,10 +572,9 @@ class OrderCheckoutAdapter(CheckoutAdapter):
     def items(self):
         return extractitems(readcookie(self.request))
 
-    def ordernumber_exists(self, soup, ordernumber):
-        for order in soup.query(Eq('ordernumber', ordernumber)):
-            return bool(order)
-        return False
+    @instance_property
+    def buyables(self):
+        return BuyableResolver(self.context)
 
     def save(self, providers, widget, data):
         super(OrderCheckoutAdapter, self).save(providers, widget, data)
@@ -335,10 +637,9 @@ class OrderCheckoutAdapter(CheckoutAdapter):
             order.attrs['shipping'] = Decimal(0)
         # create order bookings
         bookings = self.create_bookings(order)
-        # set order state, needed for sorting in orders table
-        order.attrs['state'] = calculate_order_state(bookings)
-        # set order salaried, needed for sorting in orders table
-        order.attrs['salaried'] = ifaces.SALARIED_NO
+        # set order state and salaried tallies. order state and salaried are
+        # derived from them, needed for sorting in orders table
+        set_order_tallies(order, *calculate_order_tallies(bookings))
         # lookup booking uids, buyable uids and vendor uids
         booking_uids = list()
         buyable_uids = list()
@@ -350,17 +651,19 @@ class OrderCheckoutAdapter(CheckoutAdapter):
         order.attrs['booking_uids'] = booking_uids
         order.attrs['buyable_uids'] = buyable_uids
         order.attrs['vendor_uids'] = list(vendor_uids)
+        order.attrs['container_uids'] = calculate_order_container_uids(
+            bookings)
         # cart discount related information
         cart_discount = cart_data.discount(self.items)
         order.attrs['cart_discount_net'] = cart_discount['net']
         order.attrs['cart_discount_vat'] = cart_discount['vat']
+        # set order totals, needed for sorting and filtering in orders table
+        set_order_totals(order, bookings)
         # create ordernumber
-        orders_soup = get_orders_soup(self.context)
-        ordernumber = create_ordernumber()
-        while self.ordernumber_exists(orders_soup, ordernumber):
-            ordernumber = create_ordernumber()
-        order.attrs['ordernumber'] = ordernumber
+        generator = getAdapter(self.context, ifaces.IOrderNumberGenerator)
+        order.attrs['ordernumber'] = generator(order)
         # add order
+        orders_soup = get_orders_soup(self.context)
         orders_soup.add(order)
         # add bookings
         bookings_soup = get_bookings_soup(self.context)
@@ -368,10 +671,7 @@ class OrderCheckoutAdapter(CheckoutAdapter):
         stock_threshold_reached_items = list()
         for booking in bookings:
             bookings_soup.add(booking)
-            buyable = get_object_by_uid(
-                self.context,
-                booking.attrs['buyable_uid']
-            )
+            buyable = self.buyables.object(booking.attrs['buyable_uid'])
             item_stock = get_item_stock(buyable)
             # no stock applied
             if item_stock is None:
@@ -389,6 +689,7 @@ class OrderCheckoutAdapter(CheckoutAdapter):
                 self.request,
                 order.attrs['uid'],
                 stock_threshold_reached_items,
+                buyables=self.buyables,
             )
             notify(event)
         # return uid of added order
@@ -397,7 +698,10 @@ class OrderCheckoutAdapter(CheckoutAdapter):
     def create_bookings(self, order):
         ret = list()
         cart_data = get_data_provider(self.context)
-        for uid, count, comment in self.items:
+        items = self.items
+        # fetch all buyables of cart with one catalog query
+        self.buyables.resolve([it[0] for it in items])
+        for uid, count, comment in items:
             booking = self.create_booking(
                 order, cart_data, uid, count, comment)
             if booking:
@@ -405,34 +709,27 @@ class OrderCheckoutAdapter(CheckoutAdapter):
         return ret
 
     def create_booking(self, order, cart_data, uid, count, comment):
-        brain = get_catalog_brain(self.context, uid)
+        brain = self.buyables.brain(uid)
         # brain could be None if uid for item in cookie which no longer exists.
         if not brain:
             return
-        buyable = brain.getObject()
+        buyable = self.buyables.object(uid)
         item_state = get_item_state(buyable, self.request)
         if not item_state.validate_count(count):
             msg = u'Item no longer available {0}'.format(buyable.id)
             logger.warning(msg)
             raise CheckoutError(msg)
-        item_stock = get_item_stock(buyable)
-        # stock not applied, state new
-        if item_stock is None:
-            available = None
-            state = ifaces.STATE_NEW
-        # calculate state from stock
-        else:
-            if item_stock.available is not None:
-                item_stock.available -= float(count)
-            available = item_stock.available
-            state = ifaces.STATE_NEW if available is None or available >= 0.0\
-                else ifaces.STATE_RESERVED
+        available = change_item_stock(buyable, -float(count))
+        # calculate state from stock, state new if no stock applied
+        state = ifaces.STATE_NEW if available is None or available >= 0.0\
+            else ifaces.STATE_RESERVED
         item_data = get_item_data_provider(buyable)
         vendor = acquire_vendor_or_shop_root(buyable)
         booking = OOBTNode()
         booking.attrs['email'] = order.attrs['personal_data.email']
         booking.attrs['uid'] = uuid.uuid4()
         booking.attrs['buyable_uid'] = uid
+        booking.attrs['container_uids'] = get_container_uids(buyable)
         booking.attrs['buyable_count'] = count
         booking.attrs['buyable_comment'] = comment
         booking.attrs['order_uid'] = order.attrs['uid']
@@ -465,15 +762,80 @@ class OrderCheckoutAdapter(CheckoutAdapter):
         return booking
 
 
+def is_billable_state(state):
+    """Return True, if bookings in given state are billable.
+    """
+    return state not in (ifaces.STATE_RESERVED, ifaces.STATE_CANCELLED)
+
+
 def is_billable_booking(booking):
     """Return True, if booking is billable and should be included in order
     summary calculations.
     To be used in Pythons filter function::
         filter(is_billable_booking, bookings)
     """
-    return booking.attrs['state'] not in (
-        ifaces.STATE_RESERVED, ifaces.STATE_CANCELLED
+    return is_billable_state(booking.attrs['state'])
+
+
+def calculate_booking_net(booking):
+    # XXX: use decimal
+    count = float(booking.attrs['buyable_count'])
+    net = booking.attrs.get('net', 0.0)
+    discount_net = float(booking.attrs['discount_net'])
+    return (net - discount_net) * count
+
+
+def calculate_booking_vat(booking):
+    # XXX: use decimal
+    count = float(booking.attrs['buyable_count'])
+    net = booking.attrs.get('net', 0.0)
+    discount_net = float(booking.attrs['discount_net'])
+    item_net = net - discount_net
+    return (item_net * booking.attrs.get('vat', 0.0) / 100.0) * count
+
+
+def calculate_order_net(bookings):
+    ret = 0.0
+    for booking in filter(is_billable_booking, bookings):
+        ret += calculate_booking_net(booking)
+    return ret
+
+
+def calculate_order_vat(bookings):
+    ret = 0.0
+    for booking in filter(is_billable_booking, bookings):
+        ret += calculate_booking_vat(booking)
+    return ret
+
+
+def calculate_order_total(order, net, vat):
+    # XXX: use decimal
+    attrs = order.attrs
+    total = net - float(attrs['cart_discount_net']) \
+        + vat - float(attrs['cart_discount_vat'])
+    return total + float(attrs['shipping'])
+
+
+def set_order_totals(order, bookings):
+    """Calculate net, vat and total of order from billable bookings and set
+    them on order.
+
+    Totals are always calculated from all bookings of order, thus no rounding
+    differences accumulate on booking state changes.
+    """
+    net = calculate_order_net(bookings)
+    vat = calculate_order_vat(bookings)
+    values = (
+        ('net', net),
+        ('vat', vat),
+        ('total', calculate_order_total(order, net, vat)),
     )
+    # XXX: currently we need to delete attributes before setting to a new
+    #      value in order to persist change. fix in appropriate place.
+    for name, value in values:
+        if name in order.attrs:
+            del order.attrs[name]
+        order.attrs[name] = value
 
 
 def _calculate_order_attr_from_bookings(bookings, attr, mixed_value):
@@ -497,11 +859,96 @@ def calculate_order_state(bookings):
 
 
 def calculate_order_salaried(bookings):
-    return _calculate_order_attr_from_bookings(
+    """Calculate salaried of order from billable bookings.
+
+    Orders without billable bookings, i.e. all bookings reserved or
+    cancelled, are not salaried. See ``set_order_tallies``.
+    """
+    salaried = _calculate_order_attr_from_bookings(
         filter(is_billable_booking, bookings),
         'salaried',
         ifaces.SALARIED_MIXED
     )
+    if salaried is None:
+        return ifaces.SALARIED_NO
+    return salaried
+
+
+def _tally_add(tally, value, delta):
+    count = tally.get(value, 0) + delta
+    if count > 0:
+        tally[value] = count
+    elif value in tally:
+        del tally[value]
+
+
+def update_order_tallies(state_tally, salaried_tally, old_state, new_state,
+                         old_salaried, new_salaried):
+    """Update state and salaried tallies in place by the change of one
+    booking.
+
+    Salaried tally only counts billable bookings, thus a state change might
+    change the salaried tally as well. ``old_state`` is ``None`` if booking
+    has not been counted yet, ``new_state`` is ``None`` if booking is not
+    counted any more.
+    """
+    if old_state is not None:
+        _tally_add(state_tally, old_state, -1)
+        if is_billable_state(old_state):
+            _tally_add(salaried_tally, old_salaried, -1)
+    if new_state is not None:
+        _tally_add(state_tally, new_state, 1)
+        if is_billable_state(new_state):
+            _tally_add(salaried_tally, new_salaried, 1)
+
+
+def calculate_order_tallies(bookings):
+    """Return 2-tuple containing booking counts per state and booking counts
+    per salaried value of billable bookings.
+    """
+    state_tally = dict()
+    salaried_tally = dict()
+    for booking in bookings:
+        state = booking.attrs['state']
+        _tally_add(state_tally, state, 1)
+        if is_billable_state(state):
+            _tally_add(salaried_tally, booking.attrs['salaried'], 1)
+    return state_tally, salaried_tally
+
+
+def value_from_tally(tally, mixed_value):
+    """Return single value counted in tally, ``mixed_value`` if several
+    values are counted or None if tally is empty.
+    """
+    if not tally:
+        return None
+    if len(tally) == 1:
+        return tally.keys()[0]
+    return mixed_value
+
+
+def set_order_tallies(order, state_tally, salaried_tally):
+    """Set state and salaried tallies on order and derive order state and
+    salaried from them.
+
+    Orders without billable bookings, i.e. all bookings reserved or
+    cancelled, are not salaried.
+    """
+    salaried = value_from_tally(salaried_tally, ifaces.SALARIED_MIXED)
+    if salaried is None:
+        salaried = ifaces.SALARIED_NO
+    values = (
+        ('state_tally', state_tally),
+        ('salaried_tally', salaried_tally),
+        ('state', value_from_tally(state_tally, ifaces.STATE_MIXED)),
+        ('salaried', salaried),
+    )
+    # XXX: currently we need to delete attributes before setting to a new
+    #      value in order to persist change. fix in appropriate place.
+    for name, value in values:
+        if name in order.attrs:
+            del order.attrs[name]
+        order.attrs[name] = value
 
 
 class OrderState(object):
@@ -541,6 +988,47 @@ class OrderState(object):
         raise NotImplementedError(
             'Abstract OrderState does not implement salaried.setter')
 
+    def update_order_totals(self, order, bookings=None):
+        """Recalculate net, vat and total stored on order.
+
+        Needs to be called if bookings changed between billable and not
+        billable state.
+
+        :param order: Order record.
+        :type order: souper.soup.Record object
+        :param bookings: All bookings of order. Queried if not given.
+        :type bookings: List of souper.soup.Record objects
+        """
+        # orders created before totals were stored
+        if 'total' not in order.attrs:
+            return
+        if bookings is None:
+            bookings = self.bookings_soup.query(
+                Eq('order_uid', order.attrs['uid']))
+        set_order_totals(order, list(bookings))
+
+    def update_order_tallies(self, order, changes):
+        """Update state and salaried tallies stored on order by booking
+        changes and derive order state and salaried from them.
+
+        :param order: Order record.
+        :type order: souper.soup.Record object
+        :param changes: Booking changes.
+        :type changes: List of 4-tuples containing old state, new state, old
+            salaried and new salaried.
+        :returns: False if order has no tallies stored, otherwise True.
+        :rtype: bool
+        """
+        # orders created before tallies were stored
+        if 'state_tally' not in order.attrs:
+            return False
+        state_tally = dict(order.attrs['state_tally'])
+        salaried_tally = dict(order.attrs['salaried_tally'])
+        for change in changes:
+            update_order_tallies(state_tally, salaried_tally, *change)
+        set_order_tallies(order, state_tally, salaried_tally)
+        return True
+
     def update_item_stock(self, booking, old_state, new_state):
         """Change stock according to transition. See table in transitions.py
         """
@@ -581,21 +1069,15 @@ class OrderState(object):
         # object no longer exists
         if not obj:
             return
-        stock = get_item_stock(obj)
-        # if stock.available is None, no stock information used
-        if stock.available is not None:
-            stock.available += float(booking.attrs['buyable_count'])
+        change_item_stock(obj, float(booking.attrs['buyable_count']))
 
     def decrease_stock(self, booking):
         obj = get_object_by_uid(self.context, booking.attrs['buyable_uid'])
         # object no longer exists
         if not obj:
             return
-        stock = get_item_stock(obj)
-        # if stock.available is None, no stock information used
-        if stock.available is not None:
-            # TODO: ATTENTION: here might get removed more than available..?
-            stock.available -= float(booking.attrs['buyable_count'])
+        # TODO: ATTENTION: here might get removed more than available..?
+        change_item_stock(obj, -float(booking.attrs['buyable_count']))
 
 
 class OrderData(OrderState):
@@ -621,6 +1103,7 @@ class OrderData(OrderState):
         self.context = context
         self._uid = uid
         self._order = order
+        self._bookings = None
         self.vendor_uids = vendor_uids
 
     @property
@@ -631,17 +1114,53 @@ class OrderData(OrderState):
 
     @property
     def order(self):
-        if self._order:
-            return self._order
-        return get_order(self.context, self.uid)
+        if not self._order:
+            self._order = get_order(self.context, self.uid)
+        return self._order
+
+    @property
+    def totals_stored(self):
+        """Flag whether totals stored on order record can be used.
+
+        This is the case if totals were stored at checkout and bookings are
+        not restricted to a subset of order vendors.
+        """
+        return self._order_values_stored('total')
+
+    @property
+    def tallies_stored(self):
+        """Flag whether state and salaried tallies stored on order can be
+        used.
+        """
+        return self._order_values_stored('state_tally')
+
+    def _order_values_stored(self, name):
+        attrs = self.order.attrs
+        if name not in attrs:
+            return False
+        if not self.vendor_uids:
+            return True
+        return set(attrs['vendor_uids']).issubset(self.vendor_uids)
 
     @property
     def bookings(self):
-        soup = self.bookings_soup
-        query = Eq('order_uid', self.uid)
-        if self.vendor_uids:
-            query = query & Any('vendor_uid', self.vendor_uids)
-        return soup.query(query)
+        """List of order bookings.
+
+        Bookings are queried once and reused by all properties of this
+        instance. Setters modifying bookings call ``invalidate_bookings``.
+        """
+        if self._bookings is None:
+            soup = self.bookings_soup
+            query = Eq('order_uid', self.uid)
+            if self.vendor_uids:
+                query = query & Any('vendor_uid', self.vendor_uids)
+            self._bookings = list(soup.query(query))
+        return self._bookings
+
+    def invalidate_bookings(self):
+        """Forget bookings queried before. Next access queries them again.
+        """
+        self._bookings = None
 
     @property
     def currency(self):
@@ -657,6 +1176,8 @@ class OrderData(OrderState):
 
     @property
     def state(self):
+        if self.tallies_stored:
+            return self.order.attrs['state']
         return calculate_order_state(self.bookings)
 
     @state.setter
@@ -664,18 +1185,36 @@ class OrderData(OrderState):
         # XXX: currently we need to delete attributes before setting to a new
         #      value in order to persist change. fix in appropriate place.
         bookings = self.bookings
+        order = self.order
+        changes = list()
+        billable_changed = False
         for booking in bookings:
-            self.update_item_stock(booking, booking.attrs['state'], value)
+            old_state = booking.attrs['state']
+            salaried = booking.attrs['salaried']
+            self.update_item_stock(booking, old_state, value)
+            if is_billable_state(old_state) != is_billable_state(value):
+                billable_changed = True
+            changes.append((old_state, value, salaried, salaried))
             del booking.attrs['state']
             booking.attrs['state'] = value
-        order = self.order
-        del order.attrs['state']
-        order.attrs['state'] = value
+        if not self.update_order_tallies(order, changes):
+            del order.attrs['state']
+            order.attrs['state'] = value
+        if billable_changed:
+            # bookings restricted to vendors do not contain all bookings of
+            # order, they get queried then
+            self.update_order_totals(
+                order,
+                bookings=None if self.vendor_uids else bookings
+            )
         self.reindex_bookings(bookings)
         self.reindex_order(order)
+        self.invalidate_bookings()
 
     @property
     def salaried(self):
+        if self.tallies_stored:
+            return self.order.attrs['salaried']
         return calculate_order_salaried(self.bookings)
 
     @salaried.setter
@@ -683,14 +1222,19 @@ class OrderData(OrderState):
         # XXX: currently we need to delete attributes before setting to a new
         #      value in order to persist change. fix in appropriate place.
         bookings = self.bookings
+        changes = list()
         for booking in bookings:
+            state = booking.attrs['state']
+            changes.append((state, state, booking.attrs['salaried'], value))
             del booking.attrs['salaried']
             booking.attrs['salaried'] = value
         order = self.order
-        del order.attrs['salaried']
-        order.attrs['salaried'] = value
+        if not self.update_order_tallies(order, changes):
+            del order.attrs['salaried']
+            order.attrs['salaried'] = value
         self.reindex_bookings(bookings)
         self.reindex_order(order)
+        self.invalidate_bookings()
 
     @property
     def tid(self):
@@ -705,29 +1249,19 @@ class OrderData(OrderState):
     def tid(self, value):
         for booking in self.bookings:
             booking.attrs['tid'] = value
+        self.invalidate_bookings()
 
     @property
     def net(self):
-        # XXX: use decimal
-        ret = 0.0
-        for booking in filter(is_billable_booking, self.bookings):
-            count = float(booking.attrs['buyable_count'])
-            net = booking.attrs.get('net', 0.0)
-            discount_net = float(booking.attrs['discount_net'])
-            ret += (net - discount_net) * count
-        return ret
+        if self.totals_stored:
+            return self.order.attrs['net']
+        return calculate_order_net(self.bookings)
 
     @property
     def vat(self):
-        # XXX: use decimal
-        ret = 0.0
-        for booking in filter(is_billable_booking, self.bookings):
-            count = float(booking.attrs['buyable_count'])
-            net = booking.attrs.get('net', 0.0)
-            discount_net = float(booking.attrs['discount_net'])
-            item_net = net - discount_net
-            ret += (item_net * booking.attrs.get('vat', 0.0) / 100.0) * count
-        return ret
+        if self.totals_stored:
+            return self.order.attrs['vat']
+        return calculate_order_vat(self.bookings)
 
     @property
     def discount_net(self):
@@ -756,9 +1290,9 @@ class OrderData(OrderState):
 
     @property
     def total(self):
-        # XXX: use decimal
-        total = self.net - self.discount_net + self.vat - self.discount_vat
-        return total + self.shipping
+        if self.totals_stored:
+            return self.order.attrs['total']
+        return calculate_order_total(self.order, self.net, self.vat)
 
 
 class BookingData(OrderState):
@@ -825,12 +1359,21 @@ class BookingData(OrderState):
         # XXX: currently we need to delete attributes before setting to a new
         #      value in order to persist change. fix in appropriate place.
         booking = self.booking
-        self.update_item_stock(booking, booking.attrs['state'], value)
+        order = self.order
+        old_state = booking.attrs['state']
+        salaried = booking.attrs['salaried']
+        self.update_item_stock(booking, old_state, value)
         del booking.attrs['state']
         booking.attrs['state'] = value
-        order = self.order
-        del order.order.attrs['state']
-        order.order.attrs['state'] = calculate_order_state(order.bookings)
+        if is_billable_state(old_state) != is_billable_state(value):
+            self.update_order_totals(
+                order.order,
+                bookings=None if self.vendor_uids else order.bookings
+            )
+        changes = [(old_state, value, salaried, salaried)]
+        if not self.update_order_tallies(order.order, changes):
+            del order.order.attrs['state']
+            order.order.attrs['state'] = calculate_order_state(order.bookings)
         self.reindex_bookings([booking])
         self.reindex_order(order.order)
 
@@ -843,11 +1386,15 @@ class BookingData(OrderState):
         # XXX: currently we need to delete attributes before setting to a new
         #      value in order to persist change. fix in appropriate place.
         booking = self.booking
+        state = booking.attrs['state']
+        old_salaried = booking.attrs['salaried']
         del booking.attrs['salaried']
         booking.attrs['salaried'] = value
         order = self.order
-        del order.order.attrs['salaried']
-        order.order.attrs['salaried'] = calculate_order_salaried(order.bookings)  # noqa
+        changes = [(state, state, old_salaried, value)]
+        if not self.update_order_tallies(order.order, changes):
+            del order.order.attrs['salaried']
+            order.order.attrs['salaried'] = calculate_order_salaried(order.bookings)  # noqa
         self.reindex_bookings([booking])
         self.reindex_order(order.order)
 
@@ -43,8 +43,10 @@ class StockThresholdReached(object):
                  context,
                  request,
                  order_uid,
-                 stock_threshold_reached_items):
+                 stock_threshold_reached_items,
+                 buyables=None):
         self.context = context
         self.request = request
         self.order_uid = order_uid
         self.stock_threshold_reached_items = stock_threshold_reached_items
+        self.buyables = buyables
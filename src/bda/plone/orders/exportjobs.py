@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from Products.CMFPlone.utils import safe_unicode
+from Testing.makerequest import makerequest
+from ZODB.POSException import ConflictError
+from ZODB.blob import Blob
+from bda.plone.orders.common import commit_retrying
+from bda.plone.orders.common import get_bookings_soup
+from bda.plone.orders.common import mark_bookings_exported
+from repoze.catalog.catalog import Catalog
+from repoze.catalog.indexes.field import CatalogFieldIndex
+from repoze.catalog.query import Any
+from repoze.catalog.query import Eq
+from repoze.catalog.query import Le
+from souper.interfaces import ICatalogFactory
+from souper.soup import NodeAttributeIndexer
+from souper.soup import Record
+from souper.soup import get_soup
+from zope.component.hooks import setSite
+from zope.interface import implementer
+import datetime
+import logging
+import plone.api
+import shutil
+import tempfile
+import threading
+import transaction
+import uuid
+
+
+logger = logging.getLogger('bda.plone.orders')
+
+
+# export job states
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+# days export jobs and their results are kept
+EXPORT_JOB_RETENTION_DAYS = 7
+
+# number of exported orders between two progress commits of worker
+EXPORT_JOB_COMMIT_SIZE = 500
+
+# minutes without progress after which pending or running export jobs are
+# considered stale, i.e. the worker thread died with the process
+EXPORT_JOB_TIMEOUT_MINUTES = 60
+
+# error of export jobs considered stale
+EXPORT_JOB_TIMEOUT_ERROR = u'Export job timed out'
+
+# number of export jobs running concurrently per process. each running
+# worker holds a ZODB connection
+EXPORT_JOB_WORKERS = 2
+
+# number of export jobs waiting for a free worker per process
+EXPORT_JOB_QUEUE_SIZE = 8
+
+
+def get_export_jobs_soup(context):
+    return get_soup('bda_plone_orders_exportjobs', context)
+
+
+@implementer(ICatalogFactory)
+class ExportJobsCatalogFactory(object):
+
+    def __call__(self, context=None):
+        catalog = Catalog()
+        uid_indexer = NodeAttributeIndexer('uid')
+        catalog[u'uid'] = CatalogFieldIndex(uid_indexer)
+        creator_indexer = NodeAttributeIndexer('creator')
+        catalog[u'creator'] = CatalogFieldIndex(creator_indexer)
+        created_indexer = NodeAttributeIndexer('created')
+        catalog[u'created'] = CatalogFieldIndex(created_indexer)
+        state_indexer = NodeAttributeIndexer('state')
+        catalog[u'state'] = CatalogFieldIndex(state_indexer)
+        return catalog
+
+
+def create_export_job(context, creator, filename, request, params):
+    """Create pending export job.
+
+    :param context: Context to work with
+    :type context: Plone or Content instance
+    :param creator: Id of user who submitted the export.
+    :type creator: string
+    :param filename: File name of export result.
+    :type filename: string
+    :param request: Submitting request. Server URL and virtual hosting
+                    settings are stored on job, thus URLs computed in export
+                    are the same as in a foreground export.
+    :type request: ZPublisher.HTTPRequest.HTTPRequest
+    :param params: Export parameters set as attributes on export view by
+                   worker.
+    :type params: dict
+    :returns: Export job record.
+    :rtype: souper.soup.Record
+    """
+    soup = get_export_jobs_soup(context)
+    job = Record()
+    job.attrs['uid'] = uuid.uuid4()
+    job.attrs['creator'] = creator
+    job.attrs['created'] = datetime.datetime.now()
+    job.attrs['heartbeat'] = job.attrs['created']
+    job.attrs['state'] = JOB_PENDING
+    job.attrs['progress'] = 0
+    job.attrs['total'] = 0
+    job.attrs['filename'] = filename
+    job.attrs['server_url'] = request['SERVER_URL']
+    virtual_root = request.get('VirtualRootPhysicalPath')
+    job.attrs['virtual_root'] = virtual_root
+    job.attrs['virtual_path'] = None
+    if virtual_root:
+        # path prefix of virtual root in URLs, i.e. ``_vh_`` path elements
+        job.attrs['virtual_path'] = request.physicalPathToURL(
+            virtual_root,
+            relative=1
+        )
+    job.attrs['params'] = dict(params)
+    job.attrs['blob'] = None
+    job.attrs['error'] = None
+    job.attrs['finished'] = None
+    soup.add(job)
+    return job
+
+
+def get_export_job(context, uid):
+    """Return export job record by uid or ``None``.
+    """
+    if not isinstance(uid, uuid.UUID):
+        try:
+            uid = uuid.UUID(uid)
+        except ValueError:
+            return None
+    soup = get_export_jobs_soup(context)
+    for job in soup.query(Eq('uid', uid)):
+        return job
+    return None
+
+
+def get_export_jobs_for(context, creator):
+    """Return export job records of creator, latest first.
+    """
+    soup = get_export_jobs_soup(context)
+    return soup.query(
+        Eq('creator', creator),
+        sort_index='created',
+        reverse=True
+    )
+
+
+def set_export_job_state(context, job, state, **attrs):
+    """Set state and given attributes on export job and reindex it.
+    """
+    job.attrs['state'] = state
+    for name, value in attrs.items():
+        job.attrs[name] = value
+    get_export_jobs_soup(context).reindex(records=[job])
+
+
+def export_job_stale(job, now=None):
+    """Check whether export job is pending or running without progress for
+    ``EXPORT_JOB_TIMEOUT_MINUTES``.
+    """
+    if job.attrs['state'] not in (JOB_PENDING, JOB_RUNNING):
+        return False
+    if now is None:
+        now = datetime.datetime.now()
+    heartbeat = job.attrs.get('heartbeat') or job.attrs['created']
+    timeout = datetime.timedelta(minutes=EXPORT_JOB_TIMEOUT_MINUTES)
+    return heartbeat < now - timeout
+
+
+def cleanup_export_jobs(context, now=None):
+    """Delete export jobs created before retention period and set stale
+    export jobs failed.
+
+    Blobs of deleted jobs get removed on next pack.
+
+    :returns: Number of deleted export jobs.
+    :rtype: int
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    threshold = now - datetime.timedelta(days=EXPORT_JOB_RETENTION_DAYS)
+    soup = get_export_jobs_soup(context)
+    jobs = list(soup.query(Le('created', threshold)))
+    for job in jobs:
+        del soup[job]
+    query = Any('state', [JOB_PENDING, JOB_RUNNING])
+    for job in list(soup.query(query)):
+        if export_job_stale(job, now=now):
+            set_export_job_state(
+                context,
+                job,
+                JOB_FAILED,
+                error=EXPORT_JOB_TIMEOUT_ERROR,
+                finished=now
+            )
+    return len(jobs)
+
+
+def get_job_user(site, user_id):
+    """Return user who submitted export job wrapped in its user folder.
+    """
+    for acl_users in (site.acl_users, site.getPhysicalRoot().acl_users):
+        user = acl_users.getUserById(user_id)
+        if user is not None:
+            if not hasattr(user, 'aq_base'):
+                user = user.__of__(acl_users)
+            return user
+    return None
+
+
+def setup_job_request(site, request, job):
+    """Setup server URL and virtual root of worker request like they were
+    on request export job has been submitted with.
+    """
+    request.other['SERVER_URL'] = job.attrs['server_url']
+    virtual_root = job.attrs.get('virtual_root')
+    if not virtual_root:
+        return
+    root = site.getPhysicalRoot()
+    request['PARENTS'] = [root.unrestrictedTraverse(virtual_root)]
+    request.setVirtualRoot(job.attrs['virtual_path'])
+
+
+def run_export_job(site, uid, view_class):
+    """Run export job and write result into a blob.
+
+    Export view gets instanciated with job parameters as attributes and
+    writes the export in chunks to a temporary file. Progress gets committed
+    each ``EXPORT_JOB_COMMIT_SIZE`` orders on a separate connection, thus it
+    can be polled by other connections while the export is read from one
+    consistent snapshot. Finally the result gets copied to a blob and
+    exported bookings are marked exported in one transaction, which gets
+    retried on write conflicts.
+
+    :param site: Plone site the job has been created in.
+    :type site: Plone instance
+    :param uid: Export job uid.
+    :type uid: uuid.UUID
+    :param view_class: Export view class providing ``write_export``, which
+                       returns record ids of bookings to mark exported.
+    :type view_class: class
+    """
+    job = get_export_job(site, uid)
+    # job deleted or already set failed as stale
+    if job is None or job.attrs['state'] != JOB_PENDING:
+        return
+    request = site.REQUEST
+    setup_job_request(site, request, job)
+    user = get_job_user(site, job.attrs['creator'])
+    if user is None:
+        set_export_job_state(
+            site,
+            job,
+            JOB_FAILED,
+            error=u'Unknown user',
+            finished=datetime.datetime.now()
+        )
+        transaction.commit()
+        return
+    newSecurityManager(request, user)
+    set_export_job_state(
+        site,
+        job,
+        JOB_RUNNING,
+        heartbeat=datetime.datetime.now()
+    )
+    transaction.commit()
+    # progress gets committed on a separate connection, committing the
+    # transaction of the export would read remaining rows from a newer
+    # snapshot than the export query
+    progress_tm = transaction.TransactionManager()
+    progress_connection = site._p_jar.db().open(
+        transaction_manager=progress_tm
+    )
+    progress_job = progress_connection.get(job._p_oid)
+    counts = dict(progress=0, total=0)
+
+    def progress(count, total):
+        counts['progress'] = count
+        counts['total'] = total
+        if count % EXPORT_JOB_COMMIT_SIZE == 0:
+            progress_job.attrs['progress'] = count
+            progress_job.attrs['total'] = total
+            progress_job.attrs['heartbeat'] = datetime.datetime.now()
+            # progress is informational, skip update on write conflict
+            try:
+                progress_tm.commit()
+            except ConflictError:
+                progress_tm.abort()
+
+    try:
+        view = view_class(site, request)
+        for name, value in job.attrs['params'].items():
+            setattr(view, name, value)
+        tmp = tempfile.TemporaryFile()
+        try:
+            docids = view.write_export(tmp, progress=progress)
+
+            def finish():
+                # blob is created on each attempt, since it gets discarded
+                # on abort
+                blob = Blob()
+                out = blob.open('w')
+                try:
+                    tmp.seek(0)
+                    shutil.copyfileobj(tmp, out)
+                finally:
+                    out.close()
+                mark_bookings_exported(get_bookings_soup(site), docids)
+                set_export_job_state(
+                    site,
+                    get_export_job(site, uid),
+                    JOB_FINISHED,
+                    blob=blob,
+                    progress=counts['progress'],
+                    total=counts['total'],
+                    finished=datetime.datetime.now()
+                )
+            commit_retrying(finish)
+        finally:
+            tmp.close()
+    except Exception as e:
+        logger.exception(u"Export job {0} failed.".format(uid))
+        transaction.abort()
+        job = get_export_job(site, uid)
+        set_export_job_state(
+            site,
+            job,
+            JOB_FAILED,
+            error=safe_unicode(str(e)),
+            finished=datetime.datetime.now()
+        )
+        transaction.commit()
+    finally:
+        progress_tm.abort()
+        progress_connection.close()
+
+
+class ExportJobWorker(threading.Thread):
+    """Thread running export job with its own ZODB connection.
+
+    At most ``EXPORT_JOB_WORKERS`` workers run concurrently, further workers
+    wait for a free slot before opening a connection.
+    """
+    slots = threading.BoundedSemaphore(EXPORT_JOB_WORKERS)
+
+    def __init__(self, db, site_path, uid, view_class):
+        super(ExportJobWorker, self).__init__(
+            name='bda.plone.orders export job {0}'.format(uid)
+        )
+        self.daemon = True
+        self.db = db
+        self.site_path = site_path
+        self.uid = uid
+        self.view_class = view_class
+
+    def run(self):
+        with self.slots:
+            self.run_job()
+
+    def run_job(self):
+        connection = self.db.open()
+        try:
+            app = makerequest(connection.root()['Application'])
+            site = app.unrestrictedTraverse(self.site_path)
+            setSite(site)
+            try:
+                run_export_job(site, self.uid, self.view_class)
+            finally:
+                noSecurityManager()
+                setSite(None)
+        except Exception:
+            logger.exception(
+                u"Export job worker {0} failed.".format(self.uid)
+            )
+        finally:
+            transaction.abort()
+            connection.close()
+
+
+def export_job_workers_exhausted():
+    """Check whether the maximum number of running and waiting export job
+    workers of this process has been reached.
+    """
+    workers = [
+        thread for thread in threading.enumerate()
+        if isinstance(thread, ExportJobWorker)
+    ]
+    return len(workers) >= EXPORT_JOB_WORKERS + EXPORT_JOB_QUEUE_SIZE
+
+
+def start_export_job(context, uid, view_class):
+    """Start export job worker after current transaction has been
+    committed, thus worker connection sees the job.
+
+    :param context: Context to work with
+    :type context: Plone or Content instance
+    :param uid: Export job uid.
+    :type uid: uuid.UUID
+    :param view_class: Export view class providing ``write_export``.
+    :type view_class: class
+    """
+    site = plone.api.portal.get()
+    db = site._p_jar.db()
+    site_path = '/'.join(site.getPhysicalPath())
+
+    def start(success):
+        if success:
+            ExportJobWorker(db, site_path, uid, view_class).start()
+
+    transaction.get().addAfterCommitHook(start)
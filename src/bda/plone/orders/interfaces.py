@@ -54,6 +54,26 @@ class ITrading(Interface):
     gtin = Attribute(u"Global Trade Item Number")
 
 
+class IOrderNumberGenerator(Interface):
+    """Create ordernumbers for new orders.
+    """
+
+    def __call__(order):
+        """Return unique ordernumber for given order record.
+        """
+
+
+class IStockCounter(Interface):
+    """Conflict resolving available stock counter of a buyable.
+    """
+
+    available = Attribute(u"Available stock or None if no stock used")
+
+    def change(delta):
+        """Change available stock by delta and return resulting value.
+        """
+
+
 class INotificationSettings(Interface):
     """Interface for looking up mail notification settings.
     """
@@ -171,3 +191,6 @@ class IStockThresholdReached(Interface):
 
     stock_threshold_reached_items = Attribute(u"List of items that are "
                                               u"getting out of stock.")
+
+    buyables = Attribute(u"``BuyableResolver`` instance used at checkout "
+                         u"or None.")
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from BTrees.OOBTree import OOBTree
+from bda.plone.orders.common import create_ordernumber
+from bda.plone.orders.common import get_orders_soup
+from bda.plone.orders.interfaces import IOrderNumberGenerator
+from persistent import Persistent
+from repoze.catalog.query import Eq
+from zope.annotation import IAnnotations
+from zope.interface import implementer
+import plone.api
+
+
+ORDERNUMBER_SEQUENCE_KEY = 'bda.plone.orders.ordernumber_sequence'
+
+
+class OrderNumberCounter(Persistent):
+    """Counter of one order number sequence shard.
+
+    Each counter is a separate persistent object, thus allocations in
+    different shards never write the same object. Concurrent allocations
+    in the same shard are not merged by conflict resolution, since this would
+    hand out one number twice. The conflicting transaction gets retried
+    instead and allocates the next free number.
+    """
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def next(self):
+        self.value += 1
+        return self.value
+
+
+class OrderNumberSequence(Persistent):
+    """Persistent order number sequence, optionally sharded by key.
+
+    Shards are kept in an ``OOBTree``, which resolves conflicts of concurrent
+    shard creation.
+    """
+
+    def __init__(self):
+        self.counters = OOBTree()
+        self.shard_ids = OOBTree()
+
+    def next(self, shard=''):
+        """Return next number of sequence shard.
+        """
+        counter = self.counters.get(shard)
+        if counter is None:
+            counter = self.counters[shard] = OrderNumberCounter()
+        return counter.next()
+
+    def shard_id(self, shard):
+        """Return short numeric id for shard key, allocate if inexistent.
+
+        Used to create short but unique prefixes for long shard keys like
+        vendor uids.
+        """
+        shard_id = self.shard_ids.get(shard)
+        if shard_id is None:
+            shard_id = self.shard_ids[shard] = self.next('__shard_ids__')
+        return shard_id
+
+
+def get_ordernumber_sequence():
+    """Return order number sequence stored on site root. Create if
+    inexistent.
+    """
+    annotations = IAnnotations(plone.api.portal.get())
+    if ORDERNUMBER_SEQUENCE_KEY not in annotations:
+        annotations[ORDERNUMBER_SEQUENCE_KEY] = OrderNumberSequence()
+    return annotations[ORDERNUMBER_SEQUENCE_KEY]
+
+
+@implementer(IOrderNumberGenerator)
+class HashOrderNumberGenerator(object):
+    """Default order number generator.
+
+    Create ordernumber by hashing current time and probe orders soup until
+    unused ordernumber found.
+    """
+
+    def __init__(self, context):
+        self.context = context
+
+    def ordernumber_exists(self, soup, ordernumber):
+        for order in soup.query(Eq('ordernumber', ordernumber)):
+            return bool(order)
+        return False
+
+    def __call__(self, order):
+        soup = get_orders_soup(self.context)
+        ordernumber = create_ordernumber()
+        while self.ordernumber_exists(soup, ordernumber):
+            ordernumber = create_ordernumber()
+        return ordernumber
+
+
+@implementer(IOrderNumberGenerator)
+class SequentialOrderNumberGenerator(object):
+    """Order number generator using a persistent sequence.
+
+    Ordernumbers are unique by design, no orders soup lookup is needed.
+    """
+    digits = 6
+
+    def __init__(self, context):
+        self.context = context
+
+    @property
+    def sequence(self):
+        return get_ordernumber_sequence()
+
+    def shard(self, order):
+        """Return sequence shard key for order.
+        """
+        return ''
+
+    def prefix(self, order, shard):
+        """Return ordernumber prefix for order and shard key.
+        """
+        return ''
+
+    def __call__(self, order):
+        shard = self.shard(order)
+        number = self.sequence.next(shard)
+        return '{0}{1:0{2}d}'.format(
+            self.prefix(order, shard),
+            number,
+            self.digits
+        )
+
+
+class DailyOrderNumberGenerator(SequentialOrderNumberGenerator):
+    """Sequential ordernumbers restarting every day, prefixed by date.
+    """
+    digits = 4
+
+    def shard(self, order):
+        return order.attrs['created'].strftime('%Y%m%d')
+
+    def prefix(self, order, shard):
+        return shard
+
+
+class VendorOrderNumberGenerator(SequentialOrderNumberGenerator):
+    """Sequential ordernumbers per vendor, prefixed by a short vendor id.
+
+    Orders containing bookings of several vendors are numbered in the shop
+    sequence.
+    """
+
+    def shard(self, order):
+        vendor_uids = order.attrs['vendor_uids']
+        if len(vendor_uids) == 1:
+            return str(vendor_uids[0])
+        return ''
+
+    def prefix(self, order, shard):
+        return '{0:03d}'.format(self.sequence.shard_id(shard))
@@ -1,6 +1,7 @@
 # -*- coding:utf-8 -*-
 from Products.CMFPlone import interfaces as Plone
 from Products.CMFQuickInstallerTool import interfaces as QuickInstaller
+from bda.plone.orders.common import create_vendor_permissions_counter
 from zope.interface import implementer
 
 
@@ -20,3 +21,11 @@ class HiddenProducts(object):
         """Do not show on QuickInstaller's list of installable products.
         """
         return ['bda.plone.orders:install-base']
+
+
+def setup_base(context):
+    """Create persistent counters on site root.
+    """
+    if context.readDataFile('bda.plone.orders_base.txt') is None:
+        return
+    create_vendor_permissions_counter(context.getSite())
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+from ZODB.POSException import ConflictError
+from bda.plone.cart import get_item_stock
+from bda.plone.orders.interfaces import IStockCounter
+from persistent import Persistent
+from zope.annotation import IAnnotations
+from zope.interface import implementer
+
+
+STOCK_COUNTER_KEY = 'bda.plone.orders.stock_counter'
+
+
+class StockCounter(Persistent):
+    """Persistent available stock counter.
+
+    Concurrent changes get merged by applying the deltas of both transactions
+    on the original value, as long as stock state decisions made in the
+    transaction are still valid for the merged value:
+
+    - A booking got state ``new`` because stock was available. It must still
+      be available after merge.
+
+    - A booking got state ``reserved`` because stock was overbooked. It must
+      still be overbooked after merge, but not more than seen in transaction,
+      since overbooking might be limited.
+
+    Otherwise ``ConflictError`` is raised and the transaction gets retried.
+    Setting the value absolutely increases ``generation``, such a change is
+    never merged with a concurrent one. If ``value`` is None, no stock
+    information is used.
+    """
+    # stock storage value the counter was set from
+    stored = None
+    generation = 0
+
+    def __init__(self, value=None):
+        self.set(value)
+
+    def set(self, value):
+        self.value = value
+        self.stored = value
+        self.generation += 1
+
+    def change(self, delta):
+        if self.value is not None:
+            self.value += delta
+        return self.value
+
+    def _p_resolveConflict(self, old, committed, new):
+        generation = old.get('generation')
+        if generation != committed.get('generation') \
+                or generation != new.get('generation'):
+            raise ConflictError
+        old_value = old.get('value')
+        committed_value = committed.get('value')
+        new_value = new.get('value')
+        if None in (old_value, committed_value, new_value):
+            raise ConflictError
+        resolved_value = committed_value + new_value - old_value
+        available = new_value >= 0 and resolved_value >= 0
+        overbooked = new_value < 0 and new_value <= resolved_value < 0
+        if not available and not overbooked:
+            raise ConflictError
+        resolved = dict(new)
+        resolved['value'] = resolved_value
+        return resolved
+
+
+@implementer(IStockCounter)
+class CountedStock(object):
+    """Mixin for ``IStock`` implementations keeping available stock in a
+    ``StockCounter`` stored in the annotations of the buyable.
+
+    Must precede the stock implementation in the bases, which is used as stock
+    storage. Reading and writing ``available`` goes through the counter. The
+    stored available stock is used until the counter gets changed first and
+    if it differs from the value the counter was set from, i.e. stock has
+    been edited without using ``IStock``.
+    """
+
+    @property
+    def stored_available(self):
+        return super(CountedStock, self).available
+
+    @property
+    def counter(self):
+        return IAnnotations(self.context).get(STOCK_COUNTER_KEY)
+
+    def synchronized_counter(self):
+        stored = self.stored_available
+        annotations = IAnnotations(self.context)
+        counter = annotations.get(STOCK_COUNTER_KEY)
+        if counter is None:
+            counter = annotations[STOCK_COUNTER_KEY] = StockCounter(stored)
+        elif counter.stored != stored:
+            counter.set(stored)
+        return counter
+
+    @property
+    def available(self):
+        stored = self.stored_available
+        counter = self.counter
+        if counter is None or counter.stored != stored:
+            return stored
+        return counter.value
+
+    @available.setter
+    def available(self, value):
+        storage = super(CountedStock, type(self)).available
+        storage.__set__(self, value)
+        self.synchronized_counter().set(value)
+
+    def change(self, delta):
+        return self.synchronized_counter().change(delta)
+
+
+def buyable_stock_counter(context):
+    """``IStockCounter`` adapter factory for buyables.
+
+    Returns the ``IStock`` adapter of buyable if it implements
+    ``IStockCounter``, otherwise None.
+    """
+    item_stock = get_item_stock(context)
+    if IStockCounter.providedBy(item_stock):
+        return item_stock
+    return None
+
+
+def change_item_stock(buyable, delta):
+    """Change available stock of buyable by delta.
+
+    Use ``IStockCounter`` adapter if available for buyable, otherwise change
+    available value of ``IStock`` adapter directly.
+
+    :param buyable: Buyable object.
+    :type buyable: IBuyable implementing content object
+    :param delta: Stock delta.
+    :type delta: float
+    :returns: Resulting available stock or None if no stock information used.
+    :rtype: float or None
+    """
+    counter = IStockCounter(buyable, None)
+    if counter is not None:
+        return counter.change(delta)
+    item_stock = get_item_stock(buyable)
+    if item_stock is None or item_stock.available is None:
+        return None
+    item_stock.available += delta
+    return item_stock.available
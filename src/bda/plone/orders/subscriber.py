@@ -1,11 +1,37 @@
 # -*- coding: utf-8 -*-
+from Acquisition import aq_base
+from bda.plone.orders.common import get_container_uids
+from bda.plone.orders.common import invalidate_vendor_uids_cache
+from bda.plone.orders.common import update_container_uids
 from plone import api
+from plone.uuid.interfaces import IUUID
 
 
 def reindex_customer_role(context, event):
-    """Reindex ``customer_role`` index after local roles changed.
+    """Reindex ``customer_role`` index and invalidate cached vendor uids
+    after local roles changed.
     """
     catalog = api.portal.get_tool(name='portal_catalog')
     catalog.reindexObject(context,
                           idxs=['customer_role'],
                           update_metadata=0)
+    invalidate_vendor_uids_cache()
+
+
+def update_container_uids_on_move(obj, event):
+    """Update container uids of bookings and orders after content has been
+    moved.
+    """
+    # event gets dispatched to all contained objects, only handle moved one
+    if obj is not event.object:
+        return
+    # object added or removed
+    if event.oldParent is None or event.newParent is None:
+        return
+    # object renamed
+    if aq_base(event.oldParent) is aq_base(event.newParent):
+        return
+    uid = IUUID(obj, None)
+    if not uid:
+        return
+    update_container_uids(obj, uid, get_container_uids(event.newParent))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Micro benchmark of DataTables row rendering.
+
+Compares per cell column lookup as done before column plans with compiled
+column plans. Run with the instance python::
+
+    bin/instance run src/bda/plone/orders/tests/benchmark_columns.py [rows]
+"""
+from bda.plone.orders.browser.views import compile_columns
+import sys
+import time
+
+
+class Record(object):
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+
+
+class Table(object):
+
+    @property
+    def columns(self):
+        # like real tables, column definitions are rebuilt on each access
+        columns = [{'id': 'col_{0}'.format(i)} for i in range(10)]
+        columns[0]['renderer'] = self.render_link
+        columns[5]['renderer'] = self.render_upper
+        return columns
+
+    def render_link(self, colname, record):
+        return '<a href="#">{0}</a>'.format(record.attrs.get(colname, ''))
+
+    def render_upper(self, colname, record):
+        return record.attrs.get(colname, '').upper()
+
+    def column_def(self, colname):
+        for column in self.columns:
+            if column['id'] == colname:
+                return column
+
+    def rows_per_cell(self, records):
+        colnames = [_['id'] for _ in self.columns]
+        rows = list()
+        for record in records:
+            result = list()
+            for colname in colnames:
+                coldef = self.column_def(colname)
+                renderer = coldef.get('renderer')
+                if renderer:
+                    value = renderer(colname, record)
+                else:
+                    value = record.attrs.get(colname, '')
+                result.append(value)
+            rows.append(result)
+        return rows
+
+    def rows_plan(self, records):
+        plan = compile_columns(self.columns)
+        return [[extract(record) for extract in plan] for record in records]
+
+
+def measure(func, records, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(records)
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def run(rows=10000):
+    records = [
+        Record(dict(('col_{0}'.format(i), 'value') for i in range(10)))
+        for j in range(rows)
+    ]
+    table = Table()
+    assert table.rows_per_cell(records[:10]) == table.rows_plan(records[:10])
+    for name, func in (('per cell lookup', table.rows_per_cell),
+                       ('column plan', table.rows_plan)):
+        duration = measure(func, records)
+        print('{0:<16} {1} rows: {2:.3f}s, {3:.2f}us per row'.format(
+            name, rows, duration, duration / rows * 1000000))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[-1]) if sys.argv[-1].isdigit() else 10000)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of orders export.
+
+Fills orders and bookings soups with synthetic data and measures the export
+form (``ExportOrdersForm.write_export``), marking the exported bookings
+(``mark_bookings_exported``) and the contextual export, streamed
+(``ExportOrdersContextual.write_csv``) and built as string
+(``ExportOrdersContextual.get_csv``). Reports rows per second, peak memory
+and ZODB object loads. Run with the instance python against a copy of the
+database::
+
+    bin/instance run src/bda/plone/orders/tests/benchmark_export.py \\
+        [--site Plone] [--user admin] [--orders 1000] [--bookings 3] \\
+        [--vendors 5] [--buyables 50]
+
+Nothing gets committed, transaction is aborted when done. Peak memory is the
+maximum resident set size of the process, thus the growth per export is
+reported, not the absolute amount an export needs.
+"""
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from Testing.makerequest import makerequest
+from bda.plone.orders import interfaces as ifaces
+from bda.plone.orders.browser.export import ExportOrdersContextual
+from bda.plone.orders.browser.export import ExportOrdersForm
+from bda.plone.orders.common import calculate_order_container_uids
+from bda.plone.orders.common import calculate_order_net
+from bda.plone.orders.common import calculate_order_tallies
+from bda.plone.orders.common import calculate_order_total
+from bda.plone.orders.common import calculate_order_vat
+from bda.plone.orders.common import get_bookings_soup
+from bda.plone.orders.common import get_container_uids
+from bda.plone.orders.common import get_orders_soup
+from bda.plone.orders.common import mark_bookings_exported
+from bda.plone.orders.common import set_order_tallies
+from bda.plone.orders.interfaces import IVendor
+from plone.uuid.interfaces import IUUID
+from souper.soup import Record
+from zope.component.hooks import setSite
+from zope.interface import alsoProvides
+import argparse
+import datetime
+import plone.api
+import random
+import resource
+import sys
+import time
+import transaction
+import uuid
+
+
+class CountingOut(object):
+    """Output stream counting written bytes and CSV rows.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.rows = 0
+
+    def write(self, data):
+        self.size += len(data)
+        self.rows += data.count('\r\n')
+
+
+def peak_memory():
+    """Peak resident set size of process in MB.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac os
+    if sys.platform == 'darwin':
+        return maxrss / 1024.0 / 1024.0
+    return maxrss / 1024.0
+
+
+def create_buyables(site, vendors, buyables):
+    """Create benchmark folder containing vendor folders with documents
+    as buyables.
+    """
+    folder = plone.api.content.create(
+        container=site,
+        type='Folder',
+        id='bda-plone-orders-benchmark',
+        title='Benchmark',
+    )
+    vendor_folders = list()
+    for i in range(vendors):
+        vendor = plone.api.content.create(
+            container=folder,
+            type='Folder',
+            id='vendor-{0}'.format(i),
+            title='Vendor {0}'.format(i),
+        )
+        alsoProvides(vendor, IVendor)
+        vendor.reindexObject(idxs=['object_provides'])
+        vendor_folders.append(vendor)
+    items = list()
+    for i in range(buyables):
+        vendor = vendor_folders[i % vendors]
+        buyable = plone.api.content.create(
+            container=vendor,
+            type='Document',
+            id='buyable-{0}'.format(i),
+            title='Buyable {0}'.format(i),
+        )
+        items.append((
+            IUUID(buyable),
+            buyable.Title(),
+            get_container_uids(buyable),
+        ))
+    return folder, items
+
+
+def create_orders(site, items, orders, bookings, start):
+    """Add synthetic orders and bookings like checkout does.
+    """
+    orders_soup = get_orders_soup(site)
+    bookings_soup = get_bookings_soup(site)
+    rand = random.Random(0)
+    for i in range(orders):
+        order = Record()
+        order.attrs['uid'] = uuid.uuid4()
+        order.attrs['creator'] = 'customer-{0}'.format(i % 100)
+        order.attrs['created'] = start + datetime.timedelta(minutes=i)
+        order.attrs['ordernumber'] = '{0:06d}'.format(i)
+        order.attrs['personal_data.company'] = u'Company {0}'.format(i)
+        order.attrs['personal_data.email'] = \
+            u'customer{0}@example.com'.format(i)
+        order.attrs['personal_data.gender'] = u'female'
+        order.attrs['personal_data.firstname'] = u'Firstname'
+        order.attrs['personal_data.lastname'] = u'Lastname {0}'.format(i)
+        order.attrs['personal_data.phone'] = u'+43 512 123456'
+        order.attrs['billing_address.street'] = u'Street {0}'.format(i)
+        order.attrs['billing_address.zip'] = u'6020'
+        order.attrs['billing_address.city'] = u'Innsbruck'
+        order.attrs['billing_address.country'] = u'040'
+        order.attrs['delivery_address.alternative_delivery'] = False
+        order.attrs['order_comment.comment'] = u''
+        order.attrs['payment_selection.payment'] = u'cash'
+        order.attrs['cart_discount_net'] = 0.0
+        order.attrs['cart_discount_vat'] = 0.0
+        order.attrs['shipping'] = 0.0
+        records = list()
+        for uid, title, container_uids in rand.sample(
+                items, min(bookings, len(items))):
+            booking = Record()
+            booking.attrs['email'] = order.attrs['personal_data.email']
+            booking.attrs['uid'] = uuid.uuid4()
+            booking.attrs['buyable_uid'] = uid
+            booking.attrs['container_uids'] = container_uids
+            booking.attrs['buyable_count'] = rand.randint(1, 5)
+            booking.attrs['buyable_comment'] = u''
+            booking.attrs['order_uid'] = order.attrs['uid']
+            # vendor folder is container of buyable
+            booking.attrs['vendor_uid'] = uuid.UUID(container_uids[1])
+            booking.attrs['creator'] = order.attrs['creator']
+            booking.attrs['created'] = order.attrs['created']
+            booking.attrs['exported'] = False
+            booking.attrs['title'] = title
+            booking.attrs['net'] = 10.0
+            booking.attrs['vat'] = 20.0
+            booking.attrs['discount_net'] = 0.0
+            booking.attrs['currency'] = 'EUR'
+            booking.attrs['quantity_unit'] = 'Quantity'
+            booking.attrs['remaining_stock_available'] = None
+            booking.attrs['state'] = ifaces.STATE_NEW
+            booking.attrs['salaried'] = ifaces.SALARIED_NO
+            booking.attrs['tid'] = 'none'
+            booking.attrs['shippable'] = False
+            booking.attrs['item_number'] = None
+            booking.attrs['gtin'] = None
+            records.append(booking)
+        set_order_tallies(order, *calculate_order_tallies(records))
+        order.attrs['booking_uids'] = [_.attrs['uid'] for _ in records]
+        order.attrs['buyable_uids'] = [_.attrs['buyable_uid'] for _ in records]
+        order.attrs['vendor_uids'] = list(
+            set([_.attrs['vendor_uid'] for _ in records]))
+        order.attrs['container_uids'] = calculate_order_container_uids(
+            records)
+        net = calculate_order_net(records)
+        vat = calculate_order_vat(records)
+        order.attrs['net'] = net
+        order.attrs['vat'] = vat
+        order.attrs['total'] = calculate_order_total(order, net, vat)
+        orders_soup.add(order)
+        for booking in records:
+            bookings_soup.add(booking)
+        if i % 1000 == 0:
+            transaction.savepoint(optimistic=True)
+            site._p_jar.cacheGC()
+
+
+def measure(name, func, connection):
+    """Run export function and print its measurements.
+
+    Connection cache is minimized before, thus ZODB loads include waking up
+    records and catalog buckets.
+    """
+    connection.cacheMinimize()
+    connection.getTransferCounts(clear=True)
+    memory = peak_memory()
+    start = time.time()
+    rows = func()
+    duration = time.time() - start
+    loads, stores = connection.getTransferCounts(clear=True)
+    print('{0:<12} {1} rows: {2:.3f}s, {3:.0f} rows/s, {4} loads, '
+          'peak memory {5:.1f}MB (+{6:.1f}MB)'.format(
+              name, rows, duration, rows / duration if duration else 0.0,
+              loads, peak_memory(), peak_memory() - memory))
+
+
+def run(app, args):
+    parser = argparse.ArgumentParser(description='Benchmark orders export.')
+    parser.add_argument('--site', default='Plone')
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--bookings', type=int, default=3,
+                        help='bookings per order')
+    parser.add_argument('--vendors', type=int, default=5)
+    parser.add_argument('--buyables', type=int, default=50)
+    options, unknown = parser.parse_known_args(args)
+    app = makerequest(app)
+    site = app[options.site]
+    setSite(site)
+    user = app.acl_users.getUserById(options.user)
+    newSecurityManager(None, user.__of__(app.acl_users))
+    request = site.REQUEST
+    connection = site._p_jar
+    try:
+        start = datetime.datetime.now()
+        print('Creating {0} vendors and {1} buyables'.format(
+            options.vendors, options.buyables))
+        folder, items = create_buyables(
+            site, options.vendors, options.buyables)
+        print('Creating {0} orders with {1} bookings each'.format(
+            options.orders, options.bookings))
+        create_orders(
+            site, items, options.orders, options.bookings, start)
+        transaction.savepoint(optimistic=True)
+        exported_docids = list()
+
+        def export_form():
+            view = ExportOrdersForm(site, request)
+            view.vendor = None
+            view.customer = None
+            view.from_date = start
+            view.to_date = start + datetime.timedelta(
+                minutes=options.orders)
+            view.gzip = False
+            out = CountingOut()
+            exported_docids[:] = view.write_export(out)
+            # header line
+            return out.rows - 1
+
+        def mark_exported():
+            return mark_bookings_exported(
+                get_bookings_soup(site), exported_docids)
+
+        def export_contextual():
+            view = ExportOrdersContextual(folder, request)
+            out = CountingOut()
+            view.write_csv(out)
+            # header line
+            return out.rows - 1
+
+        def export_contextual_string():
+            view = ExportOrdersContextual(folder, request)
+            return view.get_csv().count('\r\n') - 1
+
+        measure('form', export_form, connection)
+        measure('mark', mark_exported, connection)
+        measure('contextual', export_contextual, connection)
+        measure('string', export_contextual_string, connection)
+    finally:
+        transaction.abort()
+        noSecurityManager()
+        setSite(None)
+
+
+if __name__ == '__main__':
+    # ``app`` is provided by ``bin/instance run``
+    run(app, sys.argv[1:])  # noqa
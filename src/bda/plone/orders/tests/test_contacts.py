@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from BTrees.IOBTree import IOBTree
+from BTrees.Length import Length
+from bda.plone.orders.browser.contacts import ContactsTable
+from bda.plone.orders.browser.views import ResultWindow
+import unittest
+
+
+class DummyRequest(object):
+
+    def __init__(self, **form):
+        self.form = form
+
+    def get(self, name, default=None):
+        return self.form.get(name, default)
+
+
+class DummyStorage(object):
+
+    def __init__(self, iids):
+        self.data = IOBTree()
+        for iid in iids:
+            self.data[iid] = object()
+        self.length = Length(len(iids))
+
+
+class DummySoup(object):
+
+    def __init__(self, iids):
+        self.storage = DummyStorage(iids)
+
+    def lazy(self, query, with_size=False):
+        raise AssertionError('Catalog must not be queried')
+
+
+class TestContactsTableUnit(unittest.TestCase):
+
+    def setUp(self):
+        self.soup = DummySoup([7, 3, 12, 5, 9])
+
+    def test_all_contacts(self):
+        request = DummyRequest(start='1', length='2')
+        view = ContactsTable(None, request)
+        size, result = view.query(self.soup)
+        self.assertEqual(size, 5)
+        self.assertTrue(isinstance(result, ResultWindow))
+        self.assertEqual(list(result.iids), [5, 7])
+
+    def test_all_contacts_unlimited(self):
+        request = DummyRequest(start='3', length='-1')
+        view = ContactsTable(None, request)
+        size, result = view.query(self.soup)
+        self.assertEqual(size, 5)
+        self.assertEqual(list(result.iids), [9, 12])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from BTrees import family32
+from BTrees.IFBTree import IFTreeSet
+from BTrees.OOBTree import OOBTree
+from bda.plone.orders.browser.views import OrdersCursorData
+import datetime
+import unittest
+import uuid
+
+
+class DummyIndex(object):
+    family = family32
+
+    def __init__(self, fwd_index):
+        self._fwd_index = fwd_index
+
+
+class DummySoup(object):
+
+    def __init__(self, fwd_index, vendor_fwd_index):
+        self.catalog = {
+            'created': DummyIndex(fwd_index),
+            'vendor_uids': DummyIndex(vendor_fwd_index),
+        }
+
+
+class TestOrdersCursorDataUnit(unittest.TestCase):
+
+    def setUp(self):
+        self.dt1 = datetime.datetime(2016, 10, 1, 12, 0, 0, 123)
+        self.dt2 = datetime.datetime(2016, 10, 2, 12, 0)
+        self.dt3 = datetime.datetime(2016, 10, 3, 12, 0)
+        fwd_index = OOBTree()
+        fwd_index[self.dt1] = IFTreeSet([1, 4])
+        fwd_index[self.dt2] = IFTreeSet([2])
+        fwd_index[self.dt3] = IFTreeSet([3, 5])
+        self.vendor1 = uuid.UUID('f9c7df2a-2a6d-4f3a-9a44-3b1f6b7a0a01')
+        self.vendor2 = uuid.UUID('f9c7df2a-2a6d-4f3a-9a44-3b1f6b7a0a02')
+        vendor_fwd_index = OOBTree()
+        vendor_fwd_index[self.vendor1] = IFTreeSet([1, 2, 3, 4])
+        vendor_fwd_index[self.vendor2] = IFTreeSet([4, 5])
+        self.soup = DummySoup(fwd_index, vendor_fwd_index)
+        self.view = OrdersCursorData(None, None)
+
+    def test_cursor(self):
+        view = self.view
+        cursor = view.encode_cursor(self.dt1, 4)
+        self.assertEqual(view.decode_cursor(cursor), (self.dt1, 4))
+
+    def test_docids(self):
+        view = self.view
+        self.assertEqual(
+            [docid for created, docid in view.docids(self.soup, None)],
+            [1, 4, 2, 3, 5]
+        )
+        self.assertEqual(
+            list(view.docids(self.soup, (self.dt1, 1))),
+            [(self.dt1, 4), (self.dt2, 2), (self.dt3, 3), (self.dt3, 5)]
+        )
+        self.assertEqual(
+            list(view.docids(self.soup, (self.dt3, 3))),
+            [(self.dt3, 5)]
+        )
+
+    def test_vendor_docids(self):
+        view = self.view
+        self.assertEqual(
+            view.vendor_docids(self.soup, set([self.vendor1, self.vendor2])),
+            None
+        )
+        self.assertEqual(
+            list(view.vendor_docids(self.soup, set([self.vendor2]))),
+            [4, 5]
+        )
+        self.assertEqual(list(view.vendor_docids(self.soup, set())), [])
+
+    def test_docids_vendor(self):
+        view = self.view
+        vendor_docids = view.vendor_docids(self.soup, set([self.vendor2]))
+        self.assertEqual(
+            list(view.docids(self.soup, None, vendor_docids)),
+            [(self.dt1, 4), (self.dt3, 5)]
+        )
+        self.assertEqual(
+            list(view.docids(self.soup, (self.dt1, 4), vendor_docids)),
+            [(self.dt3, 5)]
+        )
+        vendor_docids = view.vendor_docids(self.soup, set([self.vendor1]))
+        self.assertEqual(
+            list(view.docids(self.soup, (self.dt1, 1), vendor_docids)),
+            [(self.dt1, 4), (self.dt2, 2), (self.dt3, 3)]
+        )
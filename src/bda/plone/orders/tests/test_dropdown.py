@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from bda.plone.orders.browser.dropdown import BaseDropdown
+import unittest
+import urlparse
+
+
+class DummyContext(object):
+
+    def absolute_url(self):
+        return 'http://example.com/plone/folder'
+
+
+class DummyRequest(object):
+
+    def __init__(self, **form):
+        self.form = form
+
+
+class DummyRecord(object):
+
+    def __init__(self, **attrs):
+        self.attrs = attrs
+
+
+class DummyDropdown(BaseDropdown):
+    name = 'dummy'
+    action = 'dummytransition'
+    vocab = {'new': 'New', 'done': 'Done'}
+    transitions = {'finish': 'Finish'}
+    value = 'new'
+
+    @property
+    def available_transitions(self):
+        return ['finish']
+
+
+class TestDropdownUnit(unittest.TestCase):
+
+    def check_definition_url(self, request):
+        context = DummyContext()
+        record = DummyRecord(uid='1234')
+        dropdown = DummyDropdown(context, request, record)
+        target = dropdown.items[0]['target']
+        url = DummyDropdown.definition(context, request)['url']
+        url = url.format(uid='1234', transition='finish')
+        target = urlparse.urlparse(target)
+        url = urlparse.urlparse(url)
+        # transition view is called via ajax action, not in target
+        self.assertEqual(url.path, '/plone/folder')
+        self.assertEqual(url.path, target.path)
+        self.assertEqual(
+            urlparse.parse_qs(url.query),
+            urlparse.parse_qs(target.query)
+        )
+
+    def test_definition_url(self):
+        self.check_definition_url(DummyRequest())
+
+    def test_definition_url_vendor(self):
+        self.check_definition_url(DummyRequest(vendor='5678'))
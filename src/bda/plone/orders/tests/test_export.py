@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from bda.plone.orders.browser.export import EXPORT_BUYABLES_KEY
+from bda.plone.orders.browser.export import GzipStream
+from bda.plone.orders.browser.export import StreamingCSVWriter
+from bda.plone.orders.browser.export import StreamingNDJSONWriter
+from bda.plone.orders.browser.export import buyable_url
+from bda.plone.orders.browser.export import parse_iso_datetime
+from bda.plone.orders.browser.export import unique_attrs
+import datetime
+import json
+import unittest
+import zlib
+
+
+class DummyOut(object):
+
+    def __init__(self):
+        self.chunks = list()
+
+    def write(self, data):
+        self.chunks.append(data)
+
+
+class DummyJar(object):
+
+    def __init__(self):
+        self.gc_count = 0
+
+    def cacheGC(self):
+        self.gc_count += 1
+
+
+class TestStreamingCSVWriterUnit(unittest.TestCase):
+
+    def test_chunks(self):
+        out = DummyOut()
+        jar = DummyJar()
+        writer = StreamingCSVWriter(out, jar=jar, chunk_size=2)
+        for i in range(5):
+            writer.writerow([i, 'a;b'])
+        self.assertEqual(out.chunks, [
+            '0;"a;b"\r\n1;"a;b"\r\n',
+            '2;"a;b"\r\n3;"a;b"\r\n',
+        ])
+        self.assertEqual(jar.gc_count, 2)
+        writer.close()
+        self.assertEqual(out.chunks[-1], '4;"a;b"\r\n')
+        self.assertEqual(''.join(out.chunks).count('\r\n'), 5)
+
+
+class TestGzipStreamUnit(unittest.TestCase):
+
+    def test_incremental_compression(self):
+        out = DummyOut()
+        stream = GzipStream(out)
+        writer = StreamingCSVWriter(stream, chunk_size=100)
+        for i in range(10000):
+            writer.writerow([i, 'booking title', '1,50'])
+        writer.close()
+        # compressed data is written while rows are generated
+        self.assertTrue(len(out.chunks) > 0)
+        stream.close()
+        data = ''.join(out.chunks)
+        # gzip magic number
+        self.assertEqual(data[:2], '\x1f\x8b')
+        csv_data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        self.assertEqual(csv_data.count('\r\n'), 10000)
+        self.assertTrue(csv_data.startswith('0;booking title;1,50\r\n'))
+
+
+class TestStreamingNDJSONWriterUnit(unittest.TestCase):
+
+    def test_objects(self):
+        out = DummyOut()
+        writer = StreamingNDJSONWriter(out, chunk_size=2)
+        writer.writeobject({'uid': 'a', 'bookings': [{'net': '1.50'}]})
+        writer.writeobject({'uid': 'b', 'bookings': []})
+        writer.writeobject({'uid': 'c'})
+        writer.close()
+        lines = ''.join(out.chunks).splitlines()
+        self.assertEqual(len(out.chunks), 2)
+        self.assertEqual(
+            [json.loads(line)['uid'] for line in lines],
+            ['a', 'b', 'c']
+        )
+        self.assertEqual(json.loads(lines[0])['bookings'], [{'net': '1.50'}])
+
+
+class TestNDJSONHelpersUnit(unittest.TestCase):
+
+    def test_parse_iso_datetime(self):
+        self.assertEqual(
+            parse_iso_datetime('2016-10-01'),
+            datetime.datetime(2016, 10, 1)
+        )
+        self.assertEqual(
+            parse_iso_datetime('2016-10-01T12:30:15'),
+            datetime.datetime(2016, 10, 1, 12, 30, 15)
+        )
+        self.assertEqual(
+            parse_iso_datetime('2016-10-01T12:30:15.000123'),
+            datetime.datetime(2016, 10, 1, 12, 30, 15, 123)
+        )
+        self.assertRaises(ValueError, parse_iso_datetime, '01.10.2016')
+
+    def test_unique_attrs(self):
+        self.assertEqual(
+            unique_attrs(['uid', 'created'], ['created', 'total']),
+            ['uid', 'created', 'total']
+        )
+
+
+class DummyRecord(object):
+
+    def __init__(self, **attrs):
+        self.attrs = attrs
+
+
+class DummyBuyable(object):
+
+    def __init__(self, uid):
+        self.uid = uid
+
+    def absolute_url(self):
+        return 'http://example.com/%s' % self.uid
+
+
+class DummyBuyables(object):
+
+    def __init__(self):
+        self.requested = list()
+
+    def object(self, uid):
+        self.requested.append(uid)
+        if uid == 'missing':
+            return None
+        return DummyBuyable(uid)
+
+
+class DummyRequest(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class DummyContext(object):
+
+    def __init__(self):
+        self.REQUEST = DummyRequest()
+
+
+class TestComputedBookingAttrsUnit(unittest.TestCase):
+
+    def test_shared_buyables(self):
+        context = DummyContext()
+        buyables = DummyBuyables()
+        context.REQUEST.set(EXPORT_BUYABLES_KEY, buyables)
+        booking = DummyRecord(buyable_uid='buyable-1')
+        self.assertEqual(
+            buyable_url(context, booking),
+            'http://example.com/buyable-1'
+        )
+        missing = DummyRecord(buyable_uid='missing')
+        self.assertEqual(buyable_url(context, missing), None)
+        self.assertEqual(buyables.requested, ['buyable-1', 'missing'])
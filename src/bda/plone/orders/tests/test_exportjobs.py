@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from Testing.makerequest import makerequest
+from bda.plone.orders.exportjobs import EXPORT_JOB_RETENTION_DAYS
+from bda.plone.orders.exportjobs import EXPORT_JOB_TIMEOUT_ERROR
+from bda.plone.orders.exportjobs import EXPORT_JOB_TIMEOUT_MINUTES
+from bda.plone.orders.exportjobs import JOB_FAILED
+from bda.plone.orders.exportjobs import JOB_FINISHED
+from bda.plone.orders.exportjobs import JOB_PENDING
+from bda.plone.orders.exportjobs import JOB_RUNNING
+from bda.plone.orders.exportjobs import cleanup_export_jobs
+from bda.plone.orders.exportjobs import create_export_job
+from bda.plone.orders.exportjobs import export_job_stale
+from bda.plone.orders.exportjobs import get_export_job
+from bda.plone.orders.exportjobs import get_export_jobs_for
+from bda.plone.orders.exportjobs import set_export_job_state
+from bda.plone.orders.exportjobs import setup_job_request
+from bda.plone.orders.tests import Orders_INTEGRATION_TESTING
+from bda.plone.orders.tests import set_browserlayer
+import datetime
+import unittest
+
+
+class TestExportJobs(unittest.TestCase):
+    layer = Orders_INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer['portal']
+        self.request = self.layer['request']
+        set_browserlayer(self.request)
+
+    def test_export_jobs(self):
+        job = create_export_job(
+            self.portal,
+            'vendor1',
+            'orders-export.csv',
+            self.request,
+            {'vendor': None, 'customer': None}
+        )
+        uid = job.attrs['uid']
+        self.assertEqual(job.attrs['state'], JOB_PENDING)
+        self.assertEqual(job.attrs['server_url'], 'http://nohost')
+        self.assertEqual(job.attrs['virtual_root'], None)
+        self.assertEqual(get_export_job(self.portal, str(uid)), job)
+        self.assertEqual(get_export_job(self.portal, 'invalid'), None)
+        self.assertEqual(
+            list(get_export_jobs_for(self.portal, 'vendor1')),
+            [job]
+        )
+        self.assertEqual(list(get_export_jobs_for(self.portal, 'other')), [])
+        set_export_job_state(self.portal, job, JOB_FINISHED, progress=3)
+        self.assertEqual(job.attrs['state'], JOB_FINISHED)
+        self.assertEqual(job.attrs['progress'], 3)
+        # jobs within retention period are kept
+        self.assertEqual(cleanup_export_jobs(self.portal), 0)
+        now = datetime.datetime.now() + datetime.timedelta(
+            days=EXPORT_JOB_RETENTION_DAYS + 1)
+        self.assertEqual(cleanup_export_jobs(self.portal, now=now), 1)
+        self.assertEqual(get_export_job(self.portal, uid), None)
+
+    def test_stale_export_jobs(self):
+        pending = create_export_job(
+            self.portal,
+            'vendor1',
+            'orders-export.csv',
+            self.request,
+            {}
+        )
+        running = create_export_job(
+            self.portal,
+            'vendor1',
+            'orders-export.csv',
+            self.request,
+            {}
+        )
+        timeout = datetime.timedelta(minutes=EXPORT_JOB_TIMEOUT_MINUTES + 1)
+        now = pending.attrs['created'] + timeout
+        set_export_job_state(
+            self.portal,
+            running,
+            JOB_RUNNING,
+            heartbeat=now - datetime.timedelta(minutes=1)
+        )
+        self.assertTrue(export_job_stale(pending, now=now))
+        self.assertFalse(export_job_stale(running, now=now))
+        self.assertEqual(cleanup_export_jobs(self.portal, now=now), 0)
+        self.assertEqual(pending.attrs['state'], JOB_FAILED)
+        self.assertEqual(pending.attrs['error'], EXPORT_JOB_TIMEOUT_ERROR)
+        self.assertEqual(pending.attrs['finished'], now)
+        self.assertFalse(export_job_stale(pending, now=now))
+        self.assertEqual(running.attrs['state'], JOB_RUNNING)
+
+    def test_job_request_virtual_host(self):
+        # site is virtual root of submitting request
+        self.request.other['SERVER_URL'] = 'https://shop.example.com'
+        self.request['PARENTS'] = [self.portal]
+        self.request.setVirtualRoot('')
+        job = create_export_job(
+            self.portal,
+            'vendor1',
+            'orders-export.csv',
+            self.request,
+            {}
+        )
+        request = makerequest(self.layer['app']).REQUEST
+        setup_job_request(self.portal, request, job)
+        self.assertEqual(
+            request.physicalPathToURL(self.portal.getPhysicalPath()),
+            'https://shop.example.com'
+        )
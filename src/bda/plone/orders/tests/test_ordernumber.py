@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from bda.plone.orders.ordernumber import DailyOrderNumberGenerator
+from bda.plone.orders.ordernumber import OrderNumberSequence
+from bda.plone.orders.ordernumber import SequentialOrderNumberGenerator
+from bda.plone.orders.ordernumber import VendorOrderNumberGenerator
+from souper.soup import Record
+import datetime
+import unittest
+import uuid
+
+
+class TestOrderNumberUnit(unittest.TestCase):
+
+    def setUp(self):
+        self.sequence = OrderNumberSequence()
+
+    def generator(self, factory):
+        # bypass site root lookup of sequence
+        factory = type('TestGenerator', (factory,), {
+            'sequence': self.sequence,
+        })
+        return factory(None)
+
+    def order(self, **attrs):
+        order = Record()
+        order.attrs['created'] = datetime.datetime(2016, 10, 18, 12, 0)
+        order.attrs['vendor_uids'] = [uuid.uuid4()]
+        order.attrs.update(attrs)
+        return order
+
+    def test_sequence_shards(self):
+        sequence = self.sequence
+        self.assertEqual(sequence.next(), 1)
+        self.assertEqual(sequence.next(), 2)
+        self.assertEqual(sequence.next('a'), 1)
+        self.assertEqual(sequence.next(), 3)
+        self.assertEqual(sequence.shard_id('a'), 1)
+        self.assertEqual(sequence.shard_id('b'), 2)
+        self.assertEqual(sequence.shard_id('a'), 1)
+
+    def test_sequential(self):
+        generator = self.generator(SequentialOrderNumberGenerator)
+        self.assertEqual(generator(self.order()), '000001')
+        self.assertEqual(generator(self.order()), '000002')
+
+    def test_daily(self):
+        generator = self.generator(DailyOrderNumberGenerator)
+        self.assertEqual(generator(self.order()), '201610180001')
+        self.assertEqual(generator(self.order()), '201610180002')
+        created = datetime.datetime(2016, 10, 19, 8, 0)
+        self.assertEqual(
+            generator(self.order(created=created)),
+            '201610190001'
+        )
+
+    def test_vendor(self):
+        generator = self.generator(VendorOrderNumberGenerator)
+        vendor_a = [uuid.uuid4()]
+        vendor_b = [uuid.uuid4()]
+        mixed = vendor_a + vendor_b
+        self.assertEqual(
+            generator(self.order(vendor_uids=vendor_a)), '001000001')
+        self.assertEqual(
+            generator(self.order(vendor_uids=vendor_b)), '002000001')
+        self.assertEqual(
+            generator(self.order(vendor_uids=vendor_a)), '001000002')
+        self.assertEqual(
+            generator(self.order(vendor_uids=mixed)), '003000001')
@@ -1,11 +1,38 @@
 # -*- coding: utf-8 -*-
 from Products.CMFPlone.interfaces import IPloneSiteRoot
+from ZODB.POSException import ConflictError
+from bda.plone.orders.common import BookingData
+from bda.plone.orders.common import OrderData
+from bda.plone.orders.common import _vendor_uids_cache_key
 from bda.plone.orders.common import acquire_vendor_or_shop_root
+from bda.plone.orders.common import calculate_order_container_uids
+from bda.plone.orders.common import calculate_order_net
+from bda.plone.orders.common import calculate_order_salaried
+from bda.plone.orders.common import calculate_order_state
+from bda.plone.orders.common import calculate_order_tallies
+from bda.plone.orders.common import calculate_order_vat
+from bda.plone.orders.common import commit_retrying
+from bda.plone.orders.common import get_bookings_soup
+from bda.plone.orders.common import get_export_watermark
+from bda.plone.orders.common import get_orders_soup
+from bda.plone.orders.common import get_vendor_permissions_counter
+from bda.plone.orders.common import invalidate_vendor_uids_cache
+from bda.plone.orders.common import mark_bookings_exported
+from bda.plone.orders.common import set_export_watermark
+from bda.plone.orders.common import set_order_tallies
+from bda.plone.orders.common import set_order_totals
+from bda.plone.orders.common import update_order_tallies
 from bda.plone.orders.interfaces import IVendor
 from bda.plone.orders.tests import Orders_INTEGRATION_TESTING
 from bda.plone.orders.tests import set_browserlayer
+from bda.plone.orders.transitions import BulkTransition
+from bda.plone.orders.upgrades import fix_order_totals
+from souper.soup import Record
 from zope.interface import alsoProvides
+import datetime
+import plone.api
 import unittest
+import uuid
 
 
 class TestOrders(unittest.TestCase):
@@ -16,6 +43,81 @@ class TestOrders(unittest.TestCase):
         self.request = self.layer['request']
         set_browserlayer(self.request)
 
+    def test_export_watermarks(self):
+        vendor_uid = uuid.uuid4()
+        self.assertEqual(get_export_watermark(vendor_uid), None)
+        watermark = datetime.datetime(2016, 10, 1, 12, 0)
+        set_export_watermark(vendor_uid, watermark)
+        self.assertEqual(get_export_watermark(vendor_uid), watermark)
+        self.assertEqual(get_export_watermark(str(vendor_uid)), watermark)
+
+    def test_vendor_uids_cache_key(self):
+        # counter gets created on install, not on read
+        counter = get_vendor_permissions_counter()
+        self.assertTrue(counter is not None)
+        user = plone.api.user.get_current()
+        key = _vendor_uids_cache_key(None, user)
+        # cache keys of sites in same zope instance differ
+        self.assertEqual(key[0], '/'.join(self.portal.getPhysicalPath()))
+        invalidate_vendor_uids_cache()
+        self.assertNotEqual(_vendor_uids_cache_key(None, user), key)
+
+    def test_fix_order_totals(self):
+        order_uid = uuid.uuid4()
+        vendor_uid = uuid.uuid4()
+        now = datetime.datetime.now()
+        order = Record()
+        for name, value in {
+            'uid': order_uid,
+            'personal_data.email': u'customer@example.com',
+            'personal_data.firstname': u'Firstname',
+            'personal_data.lastname': u'Lastname',
+            'billing_address.city': u'Innsbruck',
+            'ordernumber': '000001',
+            'creator': 'customer',
+            'created': now,
+            'booking_uids': [],
+            'buyable_uids': [],
+            'vendor_uids': [vendor_uid],
+            'container_uids': [],
+            'state': 'mixed',
+            'salaried': 'no',
+            'cart_discount_net': 0.0,
+            'cart_discount_vat': 0.0,
+            'shipping': 5.0,
+        }.items():
+            order.attrs[name] = value
+        get_orders_soup(self.portal).add(order)
+        bookings_soup = get_bookings_soup(self.portal)
+        for state in ('new', 'reserved'):
+            booking = Record()
+            for name, value in {
+                'uid': uuid.uuid4(),
+                'order_uid': order_uid,
+                'vendor_uid': vendor_uid,
+                'buyable_uid': uuid.uuid4(),
+                'container_uids': [],
+                'email': u'customer@example.com',
+                'creator': 'customer',
+                'created': now,
+                'exported': False,
+                'title': u'Buyable',
+                'state': state,
+                'salaried': 'no',
+                'buyable_count': 2,
+                'net': 10.0,
+                'vat': 20.0,
+                'discount_net': 0.0,
+            }.items():
+                booking.attrs[name] = value
+            bookings_soup.add(booking)
+        # orders created before totals were stored get them from billable
+        # bookings
+        fix_order_totals()
+        self.assertEqual(order.attrs['net'], 20.0)
+        self.assertEqual(order.attrs['vat'], 4.0)
+        self.assertEqual(order.attrs['total'], 29.0)
+
 
 class DummyContext(dict):
     __parent__ = None
@@ -48,3 +150,421 @@ class TestOrdersUnit(unittest.TestCase):
             root['sub1']
         )
         self.assertEqual(acquire_vendor_or_shop_root(root['sub2']), root)
+
+
+class DummyRecord(object):
+
+    def __init__(self, **attrs):
+        self.attrs = attrs
+
+
+class DummySoup(object):
+
+    def __init__(self, records):
+        self.records = records
+        self.queries = 0
+        self.reindexed = list()
+
+    def query(self, query):
+        self.queries += 1
+        for record in self.records:
+            yield record
+
+    def reindex(self, records):
+        self.reindexed.append(list(records))
+
+
+class DummyOrderData(OrderData):
+    orders_soup = None
+    bookings_soup = None
+
+
+class TestOrderDataUnit(unittest.TestCase):
+
+    def setUp(self):
+        self.bookings = [
+            DummyRecord(state='new', salaried='no', currency='EUR'),
+            DummyRecord(state='new', salaried='no', currency='EUR'),
+        ]
+        self.order = DummyRecord(
+            uid=uuid.uuid4(),
+            state='new',
+            salaried='no',
+            vendor_uids=[]
+        )
+        self.order_data = DummyOrderData(None, order=self.order)
+        self.order_data.orders_soup = DummySoup([self.order])
+        self.order_data.bookings_soup = DummySoup(self.bookings)
+
+    def test_bookings_queried_once(self):
+        order_data = self.order_data
+        self.assertEqual(order_data.state, 'new')
+        self.assertEqual(order_data.salaried, 'no')
+        self.assertEqual(order_data.currency, 'EUR')
+        self.assertEqual(order_data.tid, set())
+        self.assertEqual(order_data.bookings_soup.queries, 1)
+
+    def test_setter_invalidates_bookings(self):
+        order_data = self.order_data
+        order_data.salaried = 'yes'
+        # all bookings reindexed, not only the ones consumed by iteration
+        self.assertEqual(
+            order_data.bookings_soup.reindexed,
+            [self.bookings]
+        )
+        self.assertEqual(order_data.bookings_soup.queries, 1)
+        self.assertEqual(order_data.salaried, 'yes')
+        self.assertEqual(order_data.bookings_soup.queries, 2)
+
+
+class TestOrderTalliesUnit(unittest.TestCase):
+
+    def test_tallies_not_billable(self):
+        bookings = [
+            DummyRecord(state='reserved', salaried='no'),
+            DummyRecord(state='reserved', salaried='no'),
+        ]
+        state_tally, salaried_tally = calculate_order_tallies(bookings)
+        self.assertEqual(state_tally, {'reserved': 2})
+        self.assertEqual(salaried_tally, {})
+        order = DummyRecord()
+        set_order_tallies(order, state_tally, salaried_tally)
+        self.assertEqual(order.attrs['state'], 'reserved')
+        # orders without billable bookings are not salaried
+        self.assertEqual(order.attrs['salaried'], 'no')
+        self.assertEqual(calculate_order_salaried(bookings), 'no')
+        # stored tallies and calculation from bookings are equal
+        vendor_uids = [uuid.uuid4(), uuid.uuid4()]
+        order.attrs['uid'] = uuid.uuid4()
+        order.attrs['vendor_uids'] = vendor_uids
+        order_data = DummyOrderData(None, order=order)
+        order_data.bookings_soup = DummySoup(bookings)
+        self.assertTrue(order_data.tallies_stored)
+        self.assertEqual(order_data.salaried, 'no')
+        # vendor subset falls back to calculation from bookings
+        order_data = DummyOrderData(
+            None,
+            order=order,
+            vendor_uids=vendor_uids[:1]
+        )
+        order_data.bookings_soup = DummySoup(bookings)
+        self.assertFalse(order_data.tallies_stored)
+        self.assertEqual(order_data.salaried, 'no')
+        # add booking not counted yet
+        update_order_tallies(
+            state_tally, salaried_tally, None, 'new', None, 'yes')
+        self.assertEqual(state_tally, {'reserved': 2, 'new': 1})
+        self.assertEqual(salaried_tally, {'yes': 1})
+
+    def test_tallies(self):
+        bookings = [
+            DummyRecord(state='new', salaried='no'),
+            DummyRecord(state='new', salaried='yes'),
+            DummyRecord(state='reserved', salaried='no'),
+        ]
+        state_tally, salaried_tally = calculate_order_tallies(bookings)
+        self.assertEqual(state_tally, {'new': 2, 'reserved': 1})
+        # salaried tally only counts billable bookings
+        self.assertEqual(salaried_tally, {'no': 1, 'yes': 1})
+        order = DummyRecord()
+        set_order_tallies(order, state_tally, salaried_tally)
+        self.assertEqual(order.attrs['state'], calculate_order_state(bookings))
+        self.assertEqual(
+            order.attrs['salaried'],
+            calculate_order_salaried(bookings)
+        )
+        # cancel second booking
+        update_order_tallies(
+            state_tally, salaried_tally, 'new', 'cancelled', 'yes', 'yes')
+        self.assertEqual(
+            state_tally,
+            {'new': 1, 'reserved': 1, 'cancelled': 1}
+        )
+        self.assertEqual(salaried_tally, {'no': 1})
+        set_order_tallies(order, state_tally, salaried_tally)
+        self.assertEqual(order.attrs['state'], 'mixed')
+        self.assertEqual(order.attrs['salaried'], 'no')
+        # empty tally
+        set_order_tallies(order, {}, {})
+        self.assertEqual(order.attrs['state'], None)
+        self.assertEqual(order.attrs['salaried'], 'no')
+
+
+class DummyStockOrderData(DummyOrderData):
+
+    def increase_stock(self, booking):
+        pass
+
+    def decrease_stock(self, booking):
+        pass
+
+
+class DummyBookingData(BookingData):
+    orders_soup = None
+    bookings_soup = None
+    order_data = None
+
+    @property
+    def order(self):
+        return self.order_data
+
+    def increase_stock(self, booking):
+        pass
+
+    def decrease_stock(self, booking):
+        pass
+
+
+class TestOrderTotalsUnit(unittest.TestCase):
+
+    def setUp(self):
+        order_uid = uuid.uuid4()
+        self.bookings = [
+            DummyRecord(
+                uid=uuid.uuid4(),
+                order_uid=order_uid,
+                state='new',
+                salaried='no',
+                buyable_count=3,
+                net=0.1,
+                vat=10.0,
+                discount_net=0.0
+            ),
+            DummyRecord(
+                uid=uuid.uuid4(),
+                order_uid=order_uid,
+                state='reserved',
+                salaried='no',
+                buyable_count=3,
+                net=2.5,
+                vat=20.0,
+                discount_net=0.0
+            ),
+        ]
+        self.order = DummyRecord(
+            uid=order_uid,
+            state='mixed',
+            salaried='no',
+            vendor_uids=[],
+            cart_discount_net=0.0,
+            cart_discount_vat=0.0,
+            shipping=5.0
+        )
+        set_order_totals(self.order, self.bookings)
+
+    def order_data(self):
+        order_data = DummyStockOrderData(None, order=self.order)
+        order_data.orders_soup = DummySoup([self.order])
+        order_data.bookings_soup = DummySoup(self.bookings)
+        return order_data
+
+    def booking_data(self, booking):
+        booking_data = DummyBookingData(None, booking=booking)
+        booking_data.order_data = self.order_data()
+        booking_data.orders_soup = DummySoup([self.order])
+        booking_data.bookings_soup = DummySoup(self.bookings)
+        return booking_data
+
+    def totals(self):
+        return (
+            self.order.attrs['net'],
+            self.order.attrs['vat'],
+            self.order.attrs['total'],
+        )
+
+    def expected_totals(self):
+        net = calculate_order_net(self.bookings)
+        vat = calculate_order_vat(self.bookings)
+        return (net, vat, net + vat + 5.0)
+
+    def test_set_order_totals(self):
+        # reserved booking is not billable
+        self.assertEqual(self.totals()[0], 0.1 * 3.0)
+        self.assertEqual(self.totals(), self.expected_totals())
+
+    def test_order_state(self):
+        order_data = self.order_data()
+        order_data.state = 'cancelled'
+        self.assertEqual(self.totals(), (0.0, 0.0, 5.0))
+        # repeated cancel and renew does not accumulate rounding differences
+        for i in range(10):
+            order_data.state = 'new'
+            self.assertEqual(self.totals(), self.expected_totals())
+            order_data.state = 'cancelled'
+            self.assertEqual(self.totals(), (0.0, 0.0, 5.0))
+        order_data.state = 'new'
+        self.assertEqual(self.totals(), self.expected_totals())
+        # no change between billable and not billable, totals not touched
+        del self.order.attrs['net']
+        order_data.state = 'processing'
+        self.assertFalse('net' in self.order.attrs)
+
+    def test_booking_state(self):
+        new, reserved = self.bookings
+        totals = self.totals()
+        # reserved to processing gets billable
+        self.booking_data(reserved).state = 'processing'
+        self.assertEqual(self.totals(), self.expected_totals())
+        self.assertNotEqual(self.totals(), totals)
+        self.booking_data(new).state = 'cancelled'
+        self.assertEqual(self.totals(), self.expected_totals())
+        self.booking_data(reserved).state = 'cancelled'
+        self.assertEqual(self.totals(), (0.0, 0.0, 5.0))
+        # renew
+        self.booking_data(new).state = 'new'
+        self.assertEqual(self.totals(), totals)
+
+
+class TestContainerUidsUnit(unittest.TestCase):
+
+    def test_calculate_order_container_uids(self):
+        bookings = [
+            DummyRecord(container_uids=['buyable-1', 'folder-1']),
+            DummyRecord(container_uids=['buyable-2', 'folder-1']),
+            DummyRecord(),
+        ]
+        self.assertEqual(
+            sorted(calculate_order_container_uids(bookings)),
+            ['buyable-1', 'buyable-2', 'folder-1']
+        )
+        self.assertEqual(calculate_order_container_uids([]), [])
+
+
+class DummyIndex(object):
+
+    def __init__(self):
+        self.reindexed = list()
+
+    def reindex_doc(self, docid, obj):
+        self.reindexed.append(docid)
+
+
+class DummyStorage(object):
+    _p_jar = None
+
+
+class DummyCatalogSoup(object):
+
+    def __init__(self, records=None):
+        self.catalog = {'exported': DummyIndex()}
+        self.storage = DummyStorage()
+        self.records = records or list()
+
+    def get(self, docid):
+        return self.records[docid]
+
+
+class TestMarkBookingsExportedUnit(unittest.TestCase):
+
+    def test_mark_bookings_exported(self):
+        bookings = [
+            DummyRecord(exported=False),
+            DummyRecord(exported=True),
+            DummyRecord(exported=False),
+        ]
+        soup = DummyCatalogSoup(bookings)
+        count = mark_bookings_exported(soup, [0, 1, 2], savepoint_size=1)
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            [booking.attrs['exported'] for booking in bookings],
+            [True, True, True]
+        )
+        # already exported bookings are not reindexed
+        self.assertEqual(soup.catalog['exported'].reindexed, [0, 2])
+
+
+class TestCommitRetryingUnit(unittest.TestCase):
+
+    def test_commit_retrying(self):
+        calls = list()
+
+        def func():
+            calls.append(len(calls))
+            if len(calls) < 3:
+                raise ConflictError
+        commit_retrying(func, attempts=3)
+        self.assertEqual(calls, [0, 1, 2])
+
+    def test_commit_retrying_fails(self):
+        calls = list()
+
+        def func():
+            calls.append(len(calls))
+            raise ConflictError
+        self.assertRaises(ConflictError, commit_retrying, func, attempts=2)
+        self.assertEqual(calls, [0, 1])
+
+
+class DummyBulkTransition(BulkTransition):
+    orders_soup = None
+    bookings_soup = None
+
+
+class TestBulkTransitionUnit(unittest.TestCase):
+
+    def setUp(self):
+        order_uid = uuid.uuid4()
+        self.bookings = [
+            DummyRecord(
+                uid=uuid.uuid4(),
+                order_uid=order_uid,
+                vendor_uid=uuid.uuid4(),
+                state='new',
+                salaried='no'
+            ) for i in range(3)
+        ]
+        self.order = DummyRecord(uid=order_uid, state='new', salaried='no')
+        self.bulk_transition = DummyBulkTransition(None)
+        self.bulk_transition.orders_soup = DummySoup([self.order])
+        self.bulk_transition.bookings_soup = DummySoup(self.bookings)
+
+    def test_order_transition(self):
+        bulk_transition = self.bulk_transition
+        orders, bookings = bulk_transition(
+            'mark_salaried',
+            order_uids=[self.order.attrs['uid']]
+        )
+        self.assertEqual(orders, [self.order])
+        self.assertEqual(len(bookings), 3)
+        self.assertEqual(self.order.attrs['salaried'], 'yes')
+        self.assertEqual(
+            [booking.attrs['salaried'] for booking in self.bookings],
+            ['yes', 'yes', 'yes']
+        )
+        # each soup queried and reindexed once
+        self.assertEqual(bulk_transition.bookings_soup.queries, 1)
+        self.assertEqual(len(bulk_transition.bookings_soup.reindexed), 1)
+        self.assertEqual(bulk_transition.orders_soup.queries, 1)
+        self.assertEqual(
+            bulk_transition.orders_soup.reindexed,
+            [[self.order]]
+        )
+
+    def test_unchanged_order_not_modified(self):
+        bulk_transition = self.bulk_transition
+        # bookings already outstanding
+        orders, bookings = bulk_transition(
+            'mark_outstanding',
+            order_uids=[self.order.attrs['uid']]
+        )
+        self.assertEqual(orders, [])
+        self.assertEqual(bulk_transition.orders_soup.reindexed, [])
+        # all bookings of order filtered by vendor
+        bulk_transition.vendor_uids = [uuid.uuid4()]
+        orders, bookings = bulk_transition(
+            'mark_salaried',
+            order_uids=[self.order.attrs['uid']]
+        )
+        self.assertEqual(orders, [])
+        self.assertEqual(bookings, [])
+        self.assertEqual(self.order.attrs['salaried'], 'no')
+        self.assertEqual(bulk_transition.orders_soup.reindexed, [])
+
+    def test_invalid_transition(self):
+        self.assertRaises(
+            ValueError,
+            self.bulk_transition,
+            'invalid',
+            order_uids=[self.order.attrs['uid']]
+        )
+        self.assertEqual(self.order.attrs['salaried'], 'no')
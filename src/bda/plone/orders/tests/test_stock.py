@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+from ZODB.POSException import ConflictError
+from bda.plone.orders.stock import CountedStock
+from bda.plone.orders.stock import STOCK_COUNTER_KEY
+from bda.plone.orders.stock import StockCounter
+from zope.annotation import IAnnotations
+from zope.interface import implementer
+import unittest
+
+
+@implementer(IAnnotations)
+class DummyBuyable(dict):
+    item_available = None
+
+
+class DummyStock(object):
+
+    def __init__(self, context):
+        self.context = context
+
+    @property
+    def available(self):
+        return self.context.item_available
+
+    @available.setter
+    def available(self, value):
+        self.context.item_available = value
+
+
+class DummyCountedStock(CountedStock, DummyStock):
+    pass
+
+
+class TestStockCounterUnit(unittest.TestCase):
+
+    def resolve(self, old, committed, new):
+        counter = StockCounter()
+        return counter._p_resolveConflict(
+            {'value': old},
+            {'value': committed},
+            {'value': new}
+        )['value']
+
+    def test_change(self):
+        counter = StockCounter(3.0)
+        self.assertEqual(counter.change(-2.0), 1.0)
+        self.assertEqual(counter.change(1.0), 2.0)
+        counter = StockCounter()
+        self.assertEqual(counter.change(-2.0), None)
+
+    def copy(self, counter):
+        copy = StockCounter()
+        copy.__setstate__(counter.__getstate__())
+        return copy
+
+    def test_resolve_concurrent_changes(self):
+        counter = StockCounter(5.0)
+        old = counter.__getstate__()
+        # two transactions decrement the same committed counter
+        committed = self.copy(counter)
+        committed.change(-1.0)
+        new = self.copy(counter)
+        new.change(-2.0)
+        resolved = counter._p_resolveConflict(
+            old,
+            committed.__getstate__(),
+            new.__getstate__()
+        )
+        self.assertEqual(resolved['value'], 2.0)
+        self.assertEqual(resolved['generation'], old['generation'])
+        # stock set concurrently to decrement
+        committed = self.copy(counter)
+        committed.set(10.0)
+        self.assertRaises(
+            ConflictError,
+            counter._p_resolveConflict,
+            old,
+            committed.__getstate__(),
+            new.__getstate__()
+        )
+
+    def test_resolve_available(self):
+        # two concurrent checkouts, enough stock for both
+        self.assertEqual(self.resolve(5.0, 4.0, 3.0), 2.0)
+        # concurrent checkout and cancellation
+        self.assertEqual(self.resolve(5.0, 6.0, 3.0), 4.0)
+
+    def test_resolve_overbooked(self):
+        # reserved booking, concurrent cancellation frees stock
+        self.assertEqual(self.resolve(-1.0, 0.0, -2.0), -1.0)
+
+    def test_conflict(self):
+        # booking got state new, but merged stock is overbooked
+        self.assertRaises(ConflictError, self.resolve, 1.0, 0.0, 0.0)
+        # booking got state reserved, but merged stock is available
+        self.assertRaises(ConflictError, self.resolve, 0.0, 2.0, -1.0)
+        # booking reserved, concurrent booking overbooked even more
+        self.assertRaises(ConflictError, self.resolve, -1.0, -2.0, -2.0)
+        # stock usage changed concurrently
+        self.assertRaises(ConflictError, self.resolve, None, 1.0, None)
+
+
+class TestCountedStockUnit(unittest.TestCase):
+
+    def test_available(self):
+        buyable = DummyBuyable()
+        buyable.item_available = 5.0
+        stock = DummyCountedStock(buyable)
+        # stored value is used until counter gets changed
+        self.assertEqual(stock.available, 5.0)
+        self.assertFalse(STOCK_COUNTER_KEY in buyable)
+        self.assertEqual(stock.change(-2.0), 3.0)
+        self.assertEqual(stock.available, 3.0)
+        self.assertEqual(DummyCountedStock(buyable).available, 3.0)
+        # storage is not written on change
+        self.assertEqual(buyable.item_available, 5.0)
+        # writing available writes through to counter
+        stock.available = 5.0
+        self.assertEqual(buyable.item_available, 5.0)
+        self.assertEqual(stock.available, 5.0)
+        self.assertEqual(stock.change(-1.0), 4.0)
+        # stock edited in storage directly
+        buyable.item_available = 10.0
+        self.assertEqual(stock.available, 10.0)
+        self.assertEqual(stock.change(-1.0), 9.0)
+        self.assertEqual(stock.available, 9.0)
+
+    def test_available_none(self):
+        buyable = DummyBuyable()
+        stock = DummyCountedStock(buyable)
+        self.assertEqual(stock.available, None)
+        self.assertEqual(stock.change(-1.0), None)
+        self.assertEqual(stock.available, None)
+        # stock information applied later
+        buyable.item_available = 4.0
+        self.assertEqual(stock.available, 4.0)
+        self.assertEqual(stock.change(-1.0), 3.0)
+        self.assertEqual(stock.available, 3.0)
@@ -2,7 +2,16 @@
 from bda.plone.orders import events
 from bda.plone.orders import interfaces
 from bda.plone.orders.common import BookingData
+from bda.plone.orders.common import BuyableResolver
+from bda.plone.orders.common import OrderState
+from bda.plone.orders.common import calculate_order_state
+from bda.plone.orders.common import calculate_order_tallies
+from bda.plone.orders.common import is_billable_state
+from bda.plone.orders.common import set_order_tallies
+from bda.plone.orders.stock import change_item_stock
+from repoze.catalog.query import Any
 from zope.event import notify
+import uuid
 
 
 """
@@ -152,3 +161,228 @@ def do_transition_for(order_state, transition, context=None, request=None):
 
     else:
         raise ValueError(u"Invalid transition: %s" % transition)
+
+
+class BulkTransition(OrderState):
+    """Do a transition for many orders and bookings at once.
+
+    Unlike ``do_transition_for``, all bookings and orders are fetched with
+    one query each, aggregated order state and salaried are computed once
+    per order, each modified record gets reindexed once and events are
+    notified after all records have been modified.
+
+    Events are emitted the same way as ``do_transition_for`` does for
+    ``OrderData`` respective ``BookingData`` objects.
+    """
+
+    def __init__(self, context, request=None, vendor_uids=[]):
+        """Create bulk transition.
+
+        :param context: Context to work with
+        :type object: Plone or Content instance
+        :param request: Request passed to emitted events.
+        :type request: Request instance
+        :param vendor_uids: Vendor uids, used to filter bookings.
+        :type vendor_uids: List of vendor uids as string or uuid.UUID object.
+        """
+        self.context = context
+        self.request = request
+        self.vendor_uids = [uuid.UUID(str(vuid)) for vuid in vendor_uids]
+        self.buyables = BuyableResolver(context)
+
+    def _uuids(self, uids):
+        return [
+            uid if isinstance(uid, uuid.UUID) else uuid.UUID(uid)
+            for uid in uids
+        ]
+
+    def _vendor_filter(self, bookings):
+        if not self.vendor_uids:
+            return list(bookings)
+        return [
+            booking for booking in bookings
+            if booking.attrs['vendor_uid'] in self.vendor_uids
+        ]
+
+    def units(self, order_uids=[], booking_uids=[]):
+        """Return 2-tuple containing list of transition units and dict of all
+        bookings of affected orders by order uid.
+
+        A transition unit is a 2-tuple containing the current state of the
+        unit and the list of bookings to transition. Each order is a unit of
+        its bookings, each booking is a unit by itself.
+        """
+        soup = self.bookings_soup
+        order_uids = self._uuids(order_uids)
+        booking_uids = self._uuids(booking_uids)
+        single_bookings = list()
+        if booking_uids:
+            single_bookings = self._vendor_filter(
+                soup.query(Any('uid', booking_uids)))
+        all_order_uids = set(order_uids)
+        all_order_uids.update(
+            booking.attrs['order_uid'] for booking in single_bookings)
+        order_bookings = dict()
+        if all_order_uids:
+            query = Any('order_uid', list(all_order_uids))
+            for booking in soup.query(query):
+                order_bookings.setdefault(
+                    booking.attrs['order_uid'], list()).append(booking)
+        units = list()
+        for order_uid in order_uids:
+            bookings = self._vendor_filter(order_bookings.get(order_uid, []))
+            if bookings:
+                units.append((calculate_order_state(bookings), bookings))
+        for booking in single_bookings:
+            # already contained in order unit
+            if booking.attrs['order_uid'] in order_uids:
+                continue
+            units.append((booking.attrs['state'], [booking]))
+        return units, order_bookings
+
+    def resolve_transition(self, transition, state):
+        """Return 4-tuple containing state attribute name, target value,
+        event class and flag whether to emit event for last booking only.
+        """
+        if transition == interfaces.SALARIED_TRANSITION_SALARIED:
+            return 'salaried', interfaces.SALARIED_YES, None, False
+        elif transition == interfaces.SALARIED_TRANSITION_OUTSTANDING:
+            return 'salaried', interfaces.SALARIED_NO, None, False
+        elif transition == interfaces.STATE_TRANSITION_RENEW:
+            return (
+                'state',
+                interfaces.STATE_NEW,
+                events.OrderSuccessfulEvent,
+                True
+            )
+        elif transition in (interfaces.STATE_TRANSITION_PROCESS,
+                            interfaces.STATE_TRANSITION_FINISH):
+            event_class = None
+            if state == interfaces.STATE_RESERVED:
+                event_class = events.BookingReservedToOrderedEvent
+            if transition == interfaces.STATE_TRANSITION_PROCESS:
+                return 'state', interfaces.STATE_PROCESSING, event_class, False
+            return 'state', interfaces.STATE_FINISHED, event_class, False
+        elif transition == interfaces.STATE_TRANSITION_CANCEL:
+            return (
+                'state',
+                interfaces.STATE_CANCELLED,
+                events.BookingCancelledEvent,
+                False
+            )
+        raise ValueError(u"Invalid transition: %s" % transition)
+
+    def increase_stock(self, booking):
+        obj = self.buyables.object(booking.attrs['buyable_uid'])
+        # object no longer exists
+        if not obj:
+            return
+        change_item_stock(obj, float(booking.attrs['buyable_count']))
+
+    def decrease_stock(self, booking):
+        obj = self.buyables.object(booking.attrs['buyable_uid'])
+        # object no longer exists
+        if not obj:
+            return
+        change_item_stock(obj, -float(booking.attrs['buyable_count']))
+
+    def __call__(self, transition, order_uids=[], booking_uids=[]):
+        """Do transition for orders and bookings by uid.
+
+        :param transition: Transition name.
+        :type transition: string
+        :param order_uids: Order uids.
+        :type order_uids: List of uids as string or uuid.UUID object.
+        :param booking_uids: Booking uids.
+        :type booking_uids: List of uids as string or uuid.UUID object.
+        :returns: 2-tuple containing modified order and booking records.
+        :rtype: tuple
+        """
+        units, order_bookings = self.units(
+            order_uids=order_uids,
+            booking_uids=booking_uids
+        )
+        # validate transition before modifying anything
+        state_attr = self.resolve_transition(transition, None)[0]
+        orders = dict()
+        if order_bookings:
+            query = Any('uid', list(order_bookings.keys()))
+            for order in self.orders_soup.query(query):
+                orders[order.attrs['uid']] = order
+        # stock changes happen on main state transitions only
+        if state_attr == 'state':
+            self.buyables.resolve(
+                booking.attrs['buyable_uid']
+                for state, bookings in units
+                for booking in bookings
+            )
+        modified_bookings = dict()
+        modified_order_uids = set()
+        billable_changed_order_uids = set()
+        pending_events = list()
+        for state, bookings in units:
+            state_attr, value, event_class, emit_on_last = \
+                self.resolve_transition(transition, state)
+            for cnt, booking in enumerate(bookings):
+                old_value = booking.attrs[state_attr]
+                if state_attr == 'state':
+                    self.update_item_stock(booking, old_value, value)
+                    if is_billable_state(old_value) != \
+                            is_billable_state(value):
+                        billable_changed_order_uids.add(
+                            booking.attrs['order_uid'])
+                # XXX: currently we need to delete attributes before setting
+                #      to a new value in order to persist change. fix in
+                #      appropriate place.
+                del booking.attrs[state_attr]
+                booking.attrs[state_attr] = value
+                modified_bookings[booking.attrs['uid']] = booking
+                if old_value != value:
+                    modified_order_uids.add(booking.attrs['order_uid'])
+                if event_class and (
+                    not emit_on_last or cnt == len(bookings) - 1
+                ):
+                    pending_events.append((event_class, booking))
+        # aggregate order state and salaried once per order with changed
+        # bookings
+        modified_orders = list()
+        for order_uid, order in orders.items():
+            if order_uid not in modified_order_uids:
+                continue
+            bookings = order_bookings[order_uid]
+            set_order_tallies(order, *calculate_order_tallies(bookings))
+            if order_uid in billable_changed_order_uids:
+                self.update_order_totals(order, bookings=bookings)
+            modified_orders.append(order)
+        modified_bookings = modified_bookings.values()
+        if modified_bookings:
+            self.reindex_bookings(modified_bookings)
+        if modified_orders:
+            self.orders_soup.reindex(records=modified_orders)
+        for event_class, booking in pending_events:
+            booking_attrs = dict(booking.attrs.items())
+            notify(event_class(
+                context=self.context,
+                request=self.request,
+                order_uid=booking_attrs['order_uid'],
+                booking_attrs=booking_attrs,
+            ))
+        return modified_orders, modified_bookings
+
+
+def do_bulk_transition(context, transition, order_uids=[], booking_uids=[],
+                       request=None, vendor_uids=[]):
+    """Do transition for many orders and bookings by uid at once.
+
+    See ``BulkTransition``.
+    """
+    bulk_transition = BulkTransition(
+        context,
+        request=request,
+        vendor_uids=vendor_uids
+    )
+    return bulk_transition(
+        transition,
+        order_uids=order_uids,
+        booking_uids=booking_uids
+    )
@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
 from bda.plone.cart import get_object_by_uid
 from bda.plone.orders import message_factory as _
+from bda.plone.orders.common import BuyableResolver
 from bda.plone.orders.common import OrderData
 from bda.plone.orders.common import acquire_vendor_or_shop_root
+from bda.plone.orders.common import calculate_order_container_uids
 from bda.plone.orders.common import calculate_order_salaried
 from bda.plone.orders.common import calculate_order_state
+from bda.plone.orders.common import calculate_order_tallies
+from bda.plone.orders.common import create_vendor_permissions_counter
 from bda.plone.orders.common import get_bookings_soup
+from bda.plone.orders.common import get_container_uids
 from bda.plone.orders.common import get_order
 from bda.plone.orders.common import get_orders_soup
+from bda.plone.orders.common import set_order_tallies
+from bda.plone.orders.common import set_order_totals
 from bda.plone.orders.contacts import get_contacts_soup
 from bda.plone.orders.interfaces import ITrading
 from bda.plone.payment import Payments
@@ -447,3 +454,75 @@ def fix_order_state_and_salaried(ctx=None):
         order.attrs['state'] = calculate_order_state(bookings)
         order.attrs['salaried'] = calculate_order_salaried(bookings)
     soup.rebuild()
+
+
+def fix_order_totals(ctx=None):
+    """Add net, vat and total on order, needed for sorting and filtering in
+    orders table.
+    """
+    portal = getSite()
+    soup = get_orders_soup(portal)
+    data = soup.storage.data
+    for order in data.values():
+        order_data = OrderData(portal, order=order)
+        set_order_totals(order, order_data.bookings)
+        logging.info(
+            u"Added totals to order {0}".format(order.attrs['uid'])
+        )
+    soup.rebuild()
+    logging.info("Rebuilt orders catalog")
+
+
+def fix_order_tallies(ctx=None):
+    """Add state and salaried tallies on order, used to update order state
+    and salaried on booking transitions.
+    """
+    portal = getSite()
+    soup = get_orders_soup(portal)
+    data = soup.storage.data
+    for order in data.values():
+        order_data = OrderData(portal, order=order)
+        set_order_tallies(order, *calculate_order_tallies(order_data.bookings))
+        logging.info(
+            u"Added state and salaried tallies to order {0}".format(
+                order.attrs['uid']
+            )
+        )
+    soup.rebuild()
+    logging.info("Rebuilt orders catalog")
+
+
+def fix_container_uids(ctx=None):
+    """Add uids of buyable and its containers to bookings and orders, used
+    for contextual filtering.
+    """
+    portal = getSite()
+    bookings_soup = get_bookings_soup(portal)
+    bookings = list(bookings_soup.storage.data.values())
+    buyables = BuyableResolver(portal)
+    buyables.resolve(booking.attrs['buyable_uid'] for booking in bookings)
+    order_bookings = dict()
+    for booking in bookings:
+        buyable = buyables.object(booking.attrs['buyable_uid'])
+        container_uids = list()
+        if buyable is not None:
+            container_uids = get_container_uids(buyable)
+        booking.attrs['container_uids'] = container_uids
+        order_bookings.setdefault(
+            booking.attrs['order_uid'], list()).append(booking)
+    bookings_soup.rebuild()
+    logging.info("Added container uids to bookings and rebuilt catalog")
+    orders_soup = get_orders_soup(portal)
+    for order in orders_soup.storage.data.values():
+        order.attrs['container_uids'] = calculate_order_container_uids(
+            order_bookings.get(order.attrs['uid'], []))
+    orders_soup.rebuild()
+    logging.info("Added container uids to orders and rebuilt catalog")
+
+
+def add_vendor_permissions_counter(ctx=None):
+    """Add counter of local role changes used for caching vendor uids.
+    """
+    portal = getSite()
+    create_vendor_permissions_counter(portal)
+    logging.info("Added vendor permissions counter")